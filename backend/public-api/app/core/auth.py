@@ -0,0 +1,35 @@
+"""
+Authentication - JWT (HS256, JWT_SECRET), пользователь = claim "sub"
+Без токена проверки анонимные; история и дашборд требуют токен
+"""
+import logging
+from typing import Optional
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import jwt, JWTError
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+def get_current_user_id(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> Optional[str]:
+    """user_id из токена или None для анонимного запроса; неверный токен - 401"""
+    if credentials is None:
+        return None
+    try:
+        payload = jwt.decode(credentials.credentials, settings.JWT_SECRET, algorithms=["HS256"])
+    except JWTError as e:
+        logger.warning(f"Invalid token: {e}")
+        raise HTTPException(status_code=401, detail="Invalid or expired token.")
+    user_id = payload.get("sub")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Token has no subject.")
+    return str(user_id)
+
+
+def require_user_id(user_id: Optional[str] = Depends(get_current_user_id)) -> str:
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Authentication required.")
+    return user_id
@@ -0,0 +1,43 @@
+"""
+Лимит размера тела запроса - до того, как Starlette спулит загрузку во временный файл.
+
+Заявленный Content-Length сверх лимита отклоняется при первом чтении тела; без него
+(chunked) байты считаются по мере чтения, и загрузка обрывается, как только лимит превышен.
+413 поднимается как HTTPException из receive: FastAPI пробрасывает его из разбора формы,
+ответ формирует обычный обработчик исключений (с CORS-заголовками).
+"""
+from typing import Dict
+
+from fastapi import HTTPException
+
+
+class BodyLimitMiddleware:
+    def __init__(self, app, limits: Dict[str, int]):
+        # путь -> максимум байт тела
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        received = 0
+
+        def too_large():
+            return HTTPException(status_code=413, detail=f"Request body is larger than {limit // (1024 * 1024)} MB.")
+
+        async def limited_receive():
+            nonlocal received
+            if declared.isdigit() and int(declared) > limit:
+                raise too_large()
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,88 @@
+"""
+Circuit breaker для внешних API (Google, OpenRouter)
+closed -> open после BREAKER_FAILURE_THRESHOLD ошибок подряд (или сразу - при исчерпании квоты);
+open -> half_open через BREAKER_RECOVERY_SECONDS: проходит один пробный запрос;
+успех пробы закрывает цепь, ошибка - снова открывает.
+Состояние - на процесс.
+"""
+import time
+import logging
+from typing import Optional
+from app.core.config import settings
+from app.core.metrics import BREAKER_STATE, BREAKER_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, failure_threshold: int = None, recovery_seconds: float = None):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold or settings.BREAKER_FAILURE_THRESHOLD)
+        self.recovery_seconds = settings.BREAKER_RECOVERY_SECONDS if recovery_seconds is None else recovery_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejections = 0
+        # Время начала пробного запроса; проба, не вернувшая итог за recovery_seconds, не держит слот
+        self._probe: Optional[float] = None
+        self._set_state(CLOSED)
+
+    def _set_state(self, state: str):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(_STATE_VALUES[state])
+
+    def _recovery_due(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.recovery_seconds
+
+    def _probe_free(self) -> bool:
+        return self._probe is None or time.monotonic() - self._probe >= self.recovery_seconds
+
+    def available(self) -> bool:
+        """Пропустит ли цепь запрос сейчас - без занятия пробного слота"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self._recovery_due()
+        return self._probe_free()
+
+    def allow(self) -> bool:
+        """Можно ли делать запрос; в half_open пропускает только одну пробу"""
+        if self.state == OPEN and self._recovery_due():
+            self._set_state(HALF_OPEN)
+            self._probe = None
+            logger.info(f"🔌 Breaker {self.name}: half-open, probing")
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self._probe_free():
+            self._probe = time.monotonic()
+            return True
+        self.rejections += 1
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        return False
+
+    def record_success(self) -> bool:
+        """True, если этот успех закрыл цепь (провайдер восстановился)"""
+        self.failures = 0
+        if self.state == CLOSED:
+            return False
+        self._probe = None
+        self._set_state(CLOSED)
+        logger.info(f"✓ Breaker {self.name}: closed")
+        return True
+
+    def record_failure(self, trip: bool = False, reason: Optional[str] = None):
+        """trip - открыть сразу (квота исчерпана: повторять бессмысленно)"""
+        self.failures += 1
+        if self.state == HALF_OPEN or trip or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"⚠️ Breaker {self.name}: open after {self.failures} failure(s){f' ({reason})' if reason else ''}")
+            self._probe = None
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def stats(self) -> dict:
+        return {'state': self.state, 'failures': self.failures, 'rejections': self.rejections}
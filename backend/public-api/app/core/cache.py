@@ -1,51 +1,335 @@
 ﻿"""Redis caching layer"""
-import redis
+import asyncio
+import redis.asyncio as aioredis
 import hashlib
 import json
 import os
+import time
 import logging
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Optional, List, Tuple
+from app.core.config import settings
+from app.core.metrics import stage, cache_lookup
 
 logger = logging.getLogger(__name__)
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-try:
-    redis_client = redis.from_url(REDIS_URL, decode_responses=True)
-    redis_client.ping()
-    logger.info("✓ Redis connected")
-except Exception as e:
-    logger.warning(f"⚠️ Redis unavailable: {e}")
-    redis_client = None
+
+class RedisHealth:
+    """
+    Доступность Redis - по фоновому ping раз в REDIS_PROBE_INTERVAL секунд, а не при импорте:
+    старт не ждет Redis, а горячий путь не ходит в недоступный (до первой успешной проверки - без Redis).
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.available: Optional[bool] = None
+        self.last_error: Optional[str] = None
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def state(self) -> str:
+        return {None: "unknown", True: "available", False: "unavailable"}[self.available]
+
+    def client(self):
+        # Клиент создается без соединения; соединение - при первой команде, с таймаутом
+        if self._client is None:
+            self._client = aioredis.from_url(
+                self.url, decode_responses=True, socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT
+            )
+        return self._client
+
+    async def probe(self) -> bool:
+        try:
+            await asyncio.wait_for(self.client().ping(), settings.REDIS_CONNECT_TIMEOUT)
+            healthy, error = True, None
+        except Exception as e:
+            healthy, error = False, f"{type(e).__name__}: {e}"
+        if healthy != self.available:
+            if healthy:
+                logger.info("✓ Redis connected")
+            else:
+                logger.warning(f"⚠️ Redis unavailable: {error}")
+        self.available, self.last_error = healthy, error
+        return healthy
+
+    def failed(self, error: Exception):
+        """Ошибка команды на горячем пути: до следующей проверки работаем без Redis"""
+        if self.available:
+            logger.warning(f"⚠️ Redis marked unavailable: {error}")
+            self.available, self.last_error = False, f"{type(error).__name__}: {error}"
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(settings.REDIS_PROBE_INTERVAL)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+redis_health = RedisHealth(REDIS_URL)
+
+
+def get_async_redis():
+    """Async-клиент для горячего пути; None, пока Redis не подтвердил доступность"""
+    if not redis_health.available:
+        return None
+    return redis_health.client()
+
 
 def get_cache_key(prefix: str, data: str) -> str:
     hash_value = hashlib.sha256(data.encode()).hexdigest()
     return f"{prefix}:{hash_value}"
 
-def get_cached(key: str):
-    if not redis_client:
-        return None
-    try:
-        cached = redis_client.get(key)
-        if cached:
-            logger.debug(f"Cache HIT: {key[:50]}")
-            return json.loads(cached)
-    except:
-        pass
-    return None
-
-def set_cached(key: str, value: dict, ttl: int = 86400):
-    if not redis_client:
-        return False
-    try:
-        redis_client.setex(key, ttl, json.dumps(value))
-        return True
-    except:
-        return False
-
-def cache_google_search(query: str, results: list):
-    key = get_cache_key("google", query)
-    set_cached(key, results, ttl=86400 * 30)
-
-def get_cached_google_search(query: str):
-    key = get_cache_key("google", query)
-    return get_cached(key)
+
+class LRUCache:
+    """In-process LRU с TTL и ограничением по числу записей и по объему"""
+
+    def __init__(self, max_items: int, max_bytes: int, ttl: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, size, expires = item
+        if expires < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: int = None):
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, size, time.monotonic() + min(ttl or self.ttl, self.ttl))
+        self._bytes += size
+        while len(self._data) > self.max_items or self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            'items': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class TwoTierCache:
+    """
+    Локальный LRU перед Redis: горячие ключи не ходят в сеть.
+    stale_ttl > 0: запись хранится еще stale_ttl после потери свежести (конверт с fresh_until);
+    get() отдает только свежее, get_stale() - и устаревшее (пока внешний API недоступен).
+    """
+
+    def __init__(self, prefix: str, ttl: int, local: LRUCache, stale_ttl: int = 0):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.local = local
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    def key(self, data: str) -> str:
+        return get_cache_key(self.prefix, data)
+
+    def _unwrap(self, stored) -> Tuple[Any, bool]:
+        """(значение, свежее ли); записи без конверта (до stale_ttl) считаются свежими"""
+        if self.stale_ttl and isinstance(stored, dict) and "fresh_until" in stored:
+            return stored["value"], stored["fresh_until"] > time.time()
+        return stored, True
+
+    async def get(self, key: str):
+        with stage("cache"):
+            stored, result = await self._lookup(key)
+        value, fresh = self._unwrap(stored)
+        if value is not None and not fresh:
+            value, result = None, "stale"
+        cache_lookup(self.prefix, result)
+        return value
+
+    async def get_stale(self, key: str) -> Tuple[Any, bool]:
+        """(значение, свежее ли) - устаревшее тоже, пока не истек stale_ttl"""
+        with stage("cache"):
+            stored, result = await self._lookup(key)
+        value, fresh = self._unwrap(stored)
+        cache_lookup(self.prefix, result if fresh or value is None else "stale")
+        return value, fresh
+
+    async def _lookup(self, key: str) -> Tuple[Any, str]:
+        """(значение, local_hit | redis_hit | miss)"""
+        value = self.local.get(key)
+        if value is not None:
+            return value, "local_hit"
+
+        client = get_async_redis()
+        if client is None:
+            return None, "miss"
+        try:
+            raw = await client.get(key)
+        except Exception as e:
+            self.redis_errors += 1
+            redis_health.failed(e)
+            logger.warning(f"Redis get failed ({self.prefix}): {e}")
+            return None, "miss"
+        if raw is None:
+            self.redis_misses += 1
+            return None, "miss"
+
+        self.redis_hits += 1
+        value = json.loads(raw)
+        self.local.set(key, value, len(raw))
+        return value, "redis_hit"
+
+    async def get_many(self, keys: List[str]) -> List[Any]:
+        """Пакетный get: локальный LRU, остальное - одним MGET"""
+        return [value if fresh else None for value, fresh in await self.get_many_stale(keys)]
+
+    async def get_many_stale(self, keys: List[str]) -> List[Tuple[Any, bool]]:
+        """Пакетный get_stale: [(значение, свежее ли)], один MGET на все промахи локального LRU"""
+        with stage("cache"):
+            values = [self.local.get(key) for key in keys]
+            missing = [i for i, value in enumerate(values) if value is None]
+            cache_lookup(self.prefix, "local_hit", len(keys) - len(missing))
+            redis_hits = 0
+            client = get_async_redis()
+            if missing and client is not None:
+                try:
+                    raws = await client.mget([keys[i] for i in missing])
+                except Exception as e:
+                    self.redis_errors += 1
+                    redis_health.failed(e)
+                    logger.warning(f"Redis mget failed ({self.prefix}): {e}")
+                    raws = []
+                for i, raw in zip(missing, raws):
+                    if raw is None:
+                        self.redis_misses += 1
+                        continue
+                    redis_hits += 1
+                    values[i] = json.loads(raw)
+                    self.local.set(keys[i], values[i], len(raw))
+            self.redis_hits += redis_hits
+            cache_lookup(self.prefix, "redis_hit", redis_hits)
+            cache_lookup(self.prefix, "miss", len(missing) - redis_hits)
+        return [self._unwrap(value) for value in values]
+
+    async def set(self, key: str, value: Any, ttl: int = None):
+        ttl = ttl or self.ttl
+        if self.stale_ttl:
+            value = {"value": value, "fresh_until": time.time() + ttl}
+            ttl += self.stale_ttl
+        raw = json.dumps(value)
+        self.local.set(key, value, len(raw), ttl)
+
+        client = get_async_redis()
+        if client is None:
+            return
+        try:
+            await client.setex(key, ttl, raw)
+        except Exception as e:
+            self.redis_errors += 1
+            redis_health.failed(e)
+            logger.warning(f"Redis set failed ({self.prefix}): {e}")
+
+    def stats(self) -> dict:
+        return {
+            'local': self.local.stats(),
+            'redis_hits': self.redis_hits,
+            'redis_misses': self.redis_misses,
+            'redis_errors': self.redis_errors
+        }
+
+
+def normalize_text(text: str) -> Tuple[str, List[int]]:
+    """
+    Свернуть пробелы и регистр. Возвращает нормализованный текст
+    и для каждого его символа - позицию в исходном тексте.
+    """
+    chars = []
+    positions = []
+    pending_space = None
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if pending_space is None and chars:
+                pending_space = i
+            continue
+        if pending_space is not None:
+            chars.append(" ")
+            positions.append(pending_space)
+            pending_space = None
+        for folded in ch.casefold():
+            chars.append(folded)
+            positions.append(i)
+    return "".join(chars), positions
+
+def to_normalized_span(positions: List[int], start: int, end: int) -> Tuple[int, int]:
+    return bisect_left(positions, start), bisect_left(positions, end)
+
+def to_original_span(positions: List[int], start: int, end: int) -> Tuple[int, int]:
+    if not positions or start >= end:
+        return 0, 0
+    return positions[start], positions[min(end, len(positions)) - 1] + 1
+
+
+google_cache = TwoTierCache(
+    "google",
+    ttl=settings.SEARCH_CACHE_TTL,
+    local=LRUCache(max_items=4096, max_bytes=16 * 1024 * 1024, ttl=3600),
+    stale_ttl=settings.SEARCH_CACHE_STALE_TTL
+)
+
+async def cache_google_search(query: str, results: list):
+    await google_cache.set(google_cache.key(query), results)
+
+async def get_stale_google_searches(queries: List[str]) -> List[Tuple[Any, bool]]:
+    """[(результаты, свежие ли)] по всем запросам одним MGET - устаревшие тоже, для работы при недоступном Google"""
+    return await google_cache.get_many_stale([google_cache.key(query) for query in queries])
+
+# Результаты целых проверок, ключ - нормализованный текст + версия детектора
+result_cache = TwoTierCache(
+    "check",
+    ttl=settings.RESULT_CACHE_TTL,
+    local=LRUCache(
+        max_items=settings.RESULT_CACHE_LOCAL_ITEMS,
+        max_bytes=settings.RESULT_CACHE_LOCAL_MB * 1024 * 1024,
+        ttl=settings.RESULT_CACHE_LOCAL_TTL
+    )
+)
@@ -28,26 +28,151 @@ class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite:///./antiplagiat.db"
     
-    # Redis
+    # Group commit: сколько записей результатов максимум в одной транзакции
+    # и сколько ждать попутчиков (0 - только пока идет предыдущий коммит)
+    DB_WRITE_BATCH_MAX: int = 100
+    DB_WRITE_BATCH_WINDOW_MS: int = 0
+
+    # Redis: доступность проверяется в фоне (старт не ждет Redis), таймаут соединения и ping - в секундах
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_CONNECT_TIMEOUT: float = 2.0
+    REDIS_PROBE_INTERVAL: int = 15
+
+    # Startup: индексы загружаются в фоне (до загрузки /ready отвечает 503);
+    # STARTUP_WARMUP - прогнать короткий текст через конвейер до готовности;
+    # STARTUP_BUDGET_MS - бюджет времени от старта процесса до startup complete (bench.startup)
+    INDEXES_BACKGROUND_LOAD: bool = True
+    STARTUP_WARMUP: bool = False
+    STARTUP_BUDGET_MS: int = 3000
     
     # Google Search API
+    GOOGLE_SEARCH_URL: str = "https://www.googleapis.com/customsearch/v1"
     GOOGLE_SEARCH_API_KEY: str = ""
     GOOGLE_SEARCH_CX: str = ""
-    
+    GOOGLE_SEARCH_TIMEOUT: int = 15
+    GOOGLE_SEARCH_CONCURRENCY: int = 5
+    CHECK_DEADLINE_SECONDS: int = 20
+
+    # Circuit breaker внешних API: ошибок подряд до размыкания, пауза до пробного запроса
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RECOVERY_SECONDS: int = 30
+    # Кеш поиска: свежесть, затем сколько еще можно отдавать устаревшее при недоступном Google;
+    # устаревшие запросы обновляются в фоне по одному после восстановления (не больше REFRESH_MAX в очереди)
+    SEARCH_CACHE_TTL: int = 86400 * 30
+    SEARCH_CACHE_STALE_TTL: int = 86400 * 60
+    SEARCH_REFRESH_MAX: int = 1000
+
+    # Query planner: бюджет = BASE + PER_1000_WORDS * слов/1000, но не больше лимита тарифа
+    QUERY_BUDGET_BASE: int = 5
+    QUERY_BUDGET_PER_1000_WORDS: int = 3
+    QUERY_BUDGET_TIERS: str = "free:10,pro:40"
+    DEFAULT_TIER: str = "free"
+    QUERY_MIN_BEFORE_STOP: int = 5
+    QUERY_CONVERGENCE_WIDTH: float = 0.15
+
+    # Language ID: сколько символов выборки (окнами по всему тексту) смотрит определение языка
+    LANGUAGE_SAMPLE_CHARS: int = 2048
+
+    # Local fingerprint index
+    SHINGLE_SIZE: int = 5
+    WINNOW_WINDOW: int = 4
+    CORPUS_DIR: str = ""
+    # Архив прошлых проверок в памяти процесса: восстанавливается из БД при старте, сверх лимита отпечатков
+    # (~200 байт каждый) вытесняются старые проверки; период подхвата проверок, завершенных другими процессами
+    # (0 - только при старте)
+    ARCHIVE_MAX_FINGERPRINTS: int = 500_000
+    ARCHIVE_SYNC_INTERVAL: int = 60
+
+    # On-disk fingerprint index (mmap-сегменты, пополняется python -m app.corpus add): каталог ("" - выключен),
+    # документов в сегменте при пополнении, слияние мелких сегментов (не меньше MIN штук, суммарно до MAX_BYTES),
+    # период подхвата новых сегментов в процессах API/воркеров (0 - только при старте); сливает python -m app.corpus
+    FINGERPRINT_INDEX_DIR: str = ""
+    FINGERPRINT_SEGMENT_DOCS: int = 5000
+    FINGERPRINT_MERGE_MIN_SEGMENTS: int = 4
+    FINGERPRINT_MERGE_MAX_BYTES: int = 256 * 1024 * 1024
+    FINGERPRINT_MAINTENANCE_INTERVAL: int = 60
+
+    # Sharded analysis: документ от SHARD_MIN_CHARS символов (0 - выключено) режется на куски по SHARD_CHUNK_CHARS
+    # с перекрытием и обрабатывается в пуле из ANALYSIS_PROCESSES процессов (0 - по числу ядер) - на каждый процесс API/воркера
+    SHARD_MIN_CHARS: int = 100_000
+    SHARD_CHUNK_CHARS: int = 50_000
+    ANALYSIS_PROCESSES: int = 0
+
+    # Local similarity pre-filter (char n-gram TF-IDF); серая зона [LOW, HIGH) уходит в LLM
+    SIMILARITY_NGRAM: int = 3
+    SIMILARITY_DIM: int = 16384
+    SIMILARITY_LOW: float = 0.3
+    SIMILARITY_HIGH: float = 0.8
+
+    # Near-duplicate detection (MinHash + LSH)
+    MINHASH_PERMUTATIONS: int = 128
+    LSH_BANDS: int = 16
+    DEDUP_TOP_K: int = 5
+    DEDUP_REUSE_THRESHOLD: float = 0.9
+
+    # Whole-check result cache (LRU в процессе + Redis)
+    RESULT_CACHE_TTL: int = 86400 * 7
+    RESULT_CACHE_LOCAL_ITEMS: int = 512
+    RESULT_CACHE_LOCAL_MB: int = 64
+    RESULT_CACHE_LOCAL_TTL: int = 3600
+
+    # Background job queue: "" (синхронно), inprocess, sqlite, redis
+    JOB_QUEUE_BACKEND: str = ""
+    JOB_QUEUE_WORKERS: int = 2
+    JOB_QUEUE_SQLITE_PATH: str = "./jobs.db"
+    JOB_QUEUE_NAME: str = "antiplagiat:checks"
+    # Задача в running дольше JOB_STALE_SECONDS - воркер умер (с очереди она уже снята): помечается failed;
+    # проверка в процессе API - при старте и раз в JOB_REAPER_INTERVAL секунд (0 - только при старте)
+    JOB_STALE_SECONDS: int = 900
+    JOB_REAPER_INTERVAL: int = 300
+
+    # Progress streaming (SSE): интервал keepalive и сверки статуса с БД
+    PROGRESS_KEEPALIVE_SECONDS: int = 15
+
+    # Batch checks: лимит текстов в пакете, параллельный анализ, размер архива
+    BATCH_MAX_ITEMS: int = 100
+    BATCH_CONCURRENCY: int = 4
+    BATCH_MAX_ARCHIVE_MB: int = 100
+
+    # Metrics: API отдает /metrics; отдельные воркеры - на WORKER_METRICS_PORT + номер (0 - выключено)
+    WORKER_METRICS_PORT: int = 0
+    # Sampling profiler на запрос с заголовком X-Profile: <PROFILE_TOKEN>; пустой токен - выключен
+    PROFILE_TOKEN: str = ""
+    PROFILE_INTERVAL_MS: int = 5
+    PROFILE_DIR: str = "./profiles"
+
     # AI Configuration
     OPENROUTER_API_KEY: str = ""
     AI_MODEL: str = "google/gemini-2.0-flash-exp:free"
     AI_BASE_URL: str = "https://openrouter.ai/api/v1/chat/completions"
     AI_TIMEOUT: int = 30
     AI_MAX_RETRIES: int = 3
+    AI_CONCURRENCY: int = 4
+    AI_BATCH_SIZE: int = 10
+    AI_RETRY_BACKOFF: float = 0.5
+    AI_RETRY_BACKOFF_MAX: float = 8.0
     
-    # Rate Limiting
+    # Rate Limiting (token bucket в Redis, без Redis - на процесс; 0 - без лимита)
+    # Входящие проверки на клиента (пользователь из токена или IP)
     RATE_LIMIT_PER_MINUTE: int = 60
     RATE_LIMIT_PER_DAY: int = 1000
+    # Прокси перед API (Render - 1): IP клиента - из X-Forwarded-For, запись, добавленная самым внешним
+    # из них (N-я справа); левые записи клиент может подставить сам. 0 - адрес соединения
+    TRUSTED_PROXY_HOPS: int = 0
+    # Исходящие запросы - общие на все процессы
+    GOOGLE_RATE_PER_MINUTE: int = 100
+    GOOGLE_DAILY_QUOTA: int = 10000
+    OPENROUTER_RATE_PER_MINUTE: int = 20
+    OPENROUTER_DAILY_QUOTA: int = 0
+    # Доля суточной квоты, недоступная менее срочным запросам (пакеты - один резерв, фоновые - два)
+    OUTBOUND_QUOTA_RESERVE: float = 0.1
+    # Сколько исходящий запрос ждет токен, прежде чем проверка пойдет без него (кеш, локальный индекс)
+    OUTBOUND_MAX_WAIT_SECONDS: float = 10.0
     
     # File Upload
     MAX_FILE_SIZE_MB: int = 10
+    # Текст одной проверки (JSON или извлеченный из файла), символов
+    MAX_TEXT_CHARS: int = 1_000_000
     ALLOWED_FILE_TYPES: str = "txt,pdf,docx,rtf"
     
     @property
@@ -0,0 +1,139 @@
+"""
+Metrics - Prometheus (/metrics) и тайминги стадий проверки
+- with stage("search"): ... - гистограмма antiplagiat_stage_seconds{stage}
+  и сумма по стадии в трассе текущей проверки
+- трасса проверки живет в contextvar: задачи, созданные внутри проверки
+  (параллельные запросы к Google), пишут в ту же трассу
+- метрики - на процесс; отдельные воркеры (python -m app.worker) отдают свои на WORKER_METRICS_PORT
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "antiplagiat_stage_seconds", "Duration of a check pipeline stage", ["stage"], buckets=_LATENCY_BUCKETS
+)
+CHECK_SECONDS = Histogram(
+    "antiplagiat_check_seconds", "Duration of a whole check", ["mode", "outcome"], buckets=_LATENCY_BUCKETS
+)
+HTTP_SECONDS = Histogram(
+    "antiplagiat_http_request_seconds", "HTTP request duration (до заголовков ответа)",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS
+)
+# Доля попаданий: sum(rate(...{result=~".*_hit"})) / sum(rate(...))
+CACHE_LOOKUPS = Counter(
+    "antiplagiat_cache_lookups_total", "Cache lookups by result (local_hit, redis_hit, miss)", ["cache", "result"]
+)
+# Расход квоты Google - increase(antiplagiat_external_calls_total{service="google"}[1d])
+EXTERNAL_CALLS = Counter(
+    "antiplagiat_external_calls_total", "Outbound API calls", ["service", "outcome"]
+)
+EXTERNAL_CALLS_PER_CHECK = Histogram(
+    "antiplagiat_external_calls_per_check", "Outbound API calls made by one check", ["service"],
+    buckets=(0, 1, 2, 5, 10, 20, 40, 80)
+)
+AI_TOKENS = Counter("antiplagiat_ai_tokens_total", "OpenRouter tokens reported in responses", ["kind"])
+DB_WRITE_BATCH = Histogram(
+    "antiplagiat_db_write_batch_size", "Writes per group commit", ["writer"], buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+DB_WRITE_PENDING = Gauge("antiplagiat_db_write_pending", "Writes waiting for the next group commit", ["writer"])
+QUEUE_DEPTH = Gauge("antiplagiat_queue_depth", "Checks waiting in the job queue")
+BREAKER_STATE = Gauge("antiplagiat_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["name"])
+BREAKER_REJECTIONS = Counter("antiplagiat_breaker_rejections_total", "Calls rejected by an open circuit breaker", ["name"])
+# outcome: allowed (сразу), delayed (после ожидания), rejected (429 или не дождались токена)
+RATE_LIMITED = Counter("antiplagiat_rate_limit_total", "Rate limiter decisions", ["limiter", "outcome"])
+RATE_LIMIT_WAIT = Histogram(
+    "antiplagiat_rate_limit_wait_seconds", "Time an outbound call waited for a token", ["limiter"], buckets=_LATENCY_BUCKETS
+)
+FINGERPRINT_STORE = Gauge("antiplagiat_fingerprint_store", "On-disk fingerprint index size (segments, documents, postings)", ["kind"])
+DEGRADED_CHECKS = Counter("antiplagiat_degraded_checks_total", "Checks completed with degraded external search", ["reason"])
+
+EXTERNAL_SERVICES = ("google", "openrouter")
+
+
+class CheckTrace:
+    """Разбивка одной проверки по стадиям; параллельные стадии дают сумму больше общего времени"""
+
+    def __init__(self, mode: str, task_id: Optional[str] = None):
+        self.mode = mode
+        self.task_id = task_id
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_call(self, service: str):
+        self.calls[service] = self.calls.get(service, 0) + 1
+
+    def summary(self) -> Dict:
+        return {
+            "total": round(time.perf_counter() - self.started, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in sorted(self.stages.items())},
+            "calls": dict(self.calls),
+        }
+
+
+_trace: ContextVar[Optional[CheckTrace]] = ContextVar("check_trace", default=None)
+
+
+def current_trace() -> Optional[CheckTrace]:
+    return _trace.get()
+
+
+@contextmanager
+def check_trace(mode: str, task_id: Optional[str] = None):
+    """Трасса проверки: итог - в CHECK_SECONDS, вызовы внешних API - в EXTERNAL_CALLS_PER_CHECK, разбивка - в лог"""
+    trace = CheckTrace(mode, task_id)
+    token = _trace.set(trace)
+    outcome = "failed"
+    try:
+        yield trace
+        outcome = "completed"
+    finally:
+        _trace.reset(token)
+        CHECK_SECONDS.labels(mode, outcome).observe(time.perf_counter() - trace.started)
+        for service in EXTERNAL_SERVICES:
+            EXTERNAL_CALLS_PER_CHECK.labels(service).observe(trace.calls.get(service, 0))
+        logger.info(f"⏱️ Check {trace.task_id or '-'} {outcome}: {json.dumps(trace.summary())}")
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add_stage(name, elapsed)
+
+
+def observe_stage(name: str, seconds: float):
+    """Стадия, общая для нескольких проверок (group commit) - только гистограмма, без трассы"""
+    STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def external_call(service: str, outcome: str):
+    """outcome: ok, http_<код> или error (сеть/таймаут)"""
+    EXTERNAL_CALLS.labels(service, outcome).inc()
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_call(service)
+
+
+def cache_lookup(cache: str, result: str, count: int = 1):
+    if count:
+        CACHE_LOOKUPS.labels(cache, result).inc(count)
@@ -0,0 +1,84 @@
+"""
+Sampling profiler - включается на отдельный запрос заголовком X-Profile: <PROFILE_TOKEN>
+Отдельный поток раз в PROFILE_INTERVAL_MS снимает стек потока event loop (sys._current_frames)
+и копит свернутые стеки (формат flamegraph.pl / speedscope) в PROFILE_DIR.
+Под нагрузкой в профиль попадают и соседние запросы того же loop - профилируйте на тихом инстансе.
+"""
+import os
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Одновременно профилируется один запрос: иначе сэмплы перемешаются
+_busy = threading.Lock()
+
+
+def requested(header: Optional[str]) -> bool:
+    return bool(settings.PROFILE_TOKEN) and header == settings.PROFILE_TOKEN
+
+
+class SamplingProfiler:
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+@contextmanager
+def profile(name: str) -> Iterator[Optional[str]]:
+    """Путь к файлу профиля или None, если уже идет другой профиль"""
+    if not _busy.acquire(blocking=False):
+        logger.warning("Profiler busy, request not profiled")
+        yield None
+        return
+    path = os.path.join(settings.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded")
+    profiler = SamplingProfiler(threading.get_ident(), max(1, settings.PROFILE_INTERVAL_MS) / 1000)
+    profiler.start()
+    try:
+        yield path
+    finally:
+        profiler.stop()
+        _busy.release()
+        try:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.collapsed())
+            logger.info(f"🔬 Profile: {sum(profiler.samples.values())} samples -> {path}")
+        except OSError as e:
+            logger.warning(f"Profile write failed: {e}")
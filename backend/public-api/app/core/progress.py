@@ -0,0 +1,100 @@
+"""
+Progress events for running checks (SSE)
+Внутри процесса - asyncio.Queue на подписчика; воркеры в отдельных процессах
+(очередь sqlite/redis) пересылают события через Redis pub/sub
+"""
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Set
+from app.core.config import settings
+from app.core.cache import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Последние события задачи для подписчиков, подключившихся позже
+HISTORY_LIMIT = 256
+FINAL_EVENTS = ("done", "failed")
+
+
+class ProgressHub:
+
+    def __init__(self, channel_prefix: str = "progress"):
+        self.channel_prefix = channel_prefix
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._history: Dict[str, List[Dict]] = {}
+
+    def _channel(self, task_id: str) -> str:
+        return f"{self.channel_prefix}:{task_id}"
+
+    @property
+    def relay(self):
+        # Через Redis только если проверки выполняются в других процессах
+        if settings.JOB_QUEUE_BACKEND.strip().lower() not in ("sqlite", "redis"):
+            return None
+        return get_async_redis()
+
+    def _deliver(self, task_id: str, event: Dict):
+        for queue in self._subscribers.get(task_id, ()):
+            queue.put_nowait(event)
+
+    async def publish(self, task_id: str, event: Dict):
+        """Событие не должно ломать проверку: ошибки доставки только логируются"""
+        if event.get("event") in FINAL_EVENTS:
+            self._history.pop(task_id, None)
+        else:
+            history = self._history.setdefault(task_id, [])
+            if len(history) < HISTORY_LIMIT:
+                history.append(event)
+        self._deliver(task_id, event)
+
+        client = self.relay
+        if client is None:
+            return
+        try:
+            await client.publish(self._channel(task_id), json.dumps(event))
+        except Exception as e:
+            logger.warning(f"Progress relay failed: {e}")
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str) -> AsyncIterator[asyncio.Queue]:
+        """Очередь событий задачи; сначала - уже накопленная история"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self._history.get(task_id, ()):
+            queue.put_nowait(event)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+
+        listener = None
+        client = self.relay
+        if client is not None:
+            listener = asyncio.create_task(self._listen(client, task_id, queue))
+        try:
+            yield queue
+        finally:
+            if listener is not None:
+                listener.cancel()
+                await asyncio.gather(listener, return_exceptions=True)
+            subscribers = self._subscribers.get(task_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[task_id]
+
+    async def _listen(self, client, task_id: str, queue: asyncio.Queue):
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(self._channel(task_id))
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    queue.put_nowait(json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Без Redis поток продолжит работать на периодической проверке статуса
+            logger.warning(f"Progress subscription failed: {e}")
+        finally:
+            await pubsub.reset()
+
+
+progress_hub = ProgressHub()
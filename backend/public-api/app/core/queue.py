@@ -0,0 +1,158 @@
+"""
+Job queue for background checks
+Backends: inprocess (asyncio.Queue), sqlite (table), redis (list)
+"""
+import asyncio
+import json
+import sqlite3
+import logging
+from contextlib import closing
+from typing import Optional, Dict
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Общий интерфейс: put() кладет задачу, get() ждет следующую"""
+
+    name = "base"
+
+    async def put(self, job: Dict):
+        raise NotImplementedError
+
+    async def get(self, timeout: float = 1.0) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        raise NotImplementedError
+
+
+class InProcessQueue(JobQueue):
+    """Очередь внутри процесса API - воркеры запускаются как asyncio-задачи"""
+
+    name = "inprocess"
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def put(self, job: Dict):
+        await self._queue.put(job)
+
+    async def get(self, timeout: float = 1.0) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def size(self) -> int:
+        return self._queue.qsize()
+
+
+class SQLiteQueue(JobQueue):
+    """Таблица в отдельном SQLite-файле, общая для процессов на одной машине"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = None, poll_interval: float = 0.2):
+        self.path = path or settings.JOB_QUEUE_SQLITE_PATH
+        self.poll_interval = poll_interval
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS check_jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # with conn - только транзакция, соединение закрывает closing()
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _put(self, job: Dict):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT INTO check_jobs (payload) VALUES (?)", (json.dumps(job),))
+
+    def _claim(self) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE - только один процесс забирает строку
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id, payload FROM check_jobs ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("DELETE FROM check_jobs WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+            return json.loads(row[1])
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _size(self) -> int:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("SELECT COUNT(*) FROM check_jobs").fetchone()[0]
+
+    async def put(self, job: Dict):
+        await asyncio.to_thread(self._put, job)
+
+    async def get(self, timeout: float = 1.0) -> Optional[Dict]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is not None or loop.time() >= deadline:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    async def size(self) -> int:
+        return await asyncio.to_thread(self._size)
+
+
+class RedisQueue(JobQueue):
+    """Redis list: LPUSH + BRPOP, общая для всех машин"""
+
+    name = "redis"
+
+    def __init__(self, url: str = None, key: str = None):
+        import redis.asyncio as aioredis
+
+        self.key = key or settings.JOB_QUEUE_NAME
+        self._redis = aioredis.from_url(url or settings.REDIS_URL, decode_responses=True)
+
+    async def put(self, job: Dict):
+        await self._redis.lpush(self.key, json.dumps(job))
+
+    async def get(self, timeout: float = 1.0) -> Optional[Dict]:
+        item = await self._redis.brpop(self.key, timeout=max(1, int(timeout)))
+        if item is None:
+            return None
+        return json.loads(item[1])
+
+    async def size(self) -> int:
+        return await self._redis.llen(self.key)
+
+
+_BACKENDS = {
+    InProcessQueue.name: InProcessQueue,
+    SQLiteQueue.name: SQLiteQueue,
+    RedisQueue.name: RedisQueue,
+}
+
+_queue: Optional[JobQueue] = None
+
+
+def get_queue() -> Optional[JobQueue]:
+    """Очередь из настроек JOB_QUEUE_BACKEND; None - проверки идут синхронно"""
+    global _queue
+    backend = settings.JOB_QUEUE_BACKEND.strip().lower()
+    if not backend:
+        return None
+    if _queue is None:
+        if backend not in _BACKENDS:
+            raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
+        _queue = _BACKENDS[backend]()
+        logger.info(f"✓ Job queue: {backend}")
+    return _queue
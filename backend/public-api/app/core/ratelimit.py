@@ -0,0 +1,288 @@
+"""
+Rate limiting - token bucket в Redis (общий для всех воркеров uvicorn и python -m app.worker),
+без Redis - в памяти процесса (лимит тогда на процесс).
+
+- входящие: на клиента (user_id из токена или IP) - RATE_LIMIT_PER_MINUTE / RATE_LIMIT_PER_DAY,
+  сверх лимита 429 с Retry-After
+- исходящие: общий лимит на Google Custom Search и OpenRouter (в минуту и суточная квота);
+  запрос не отклоняется, а ждет токен (до OUTBOUND_MAX_WAIT_SECONDS) в очереди по приоритету.
+  Последние OUTBOUND_QUOTA_RESERVE суточной квоты достаются только более срочным запросам:
+  HIGH (одиночные проверки) - до нуля, NORMAL (пакеты) - до резерва, LOW (фоновое обновление кеша) - до двух резервов
+Суточная квота - корзина с равномерным пополнением (quota / 86400 в секунду), а не сброс в полночь.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request
+
+from app.core.auth import get_current_user_id
+from app.core.cache import get_async_redis
+from app.core.config import settings
+from app.core.metrics import RATE_LIMITED, RATE_LIMIT_WAIT
+
+logger = logging.getLogger(__name__)
+
+HIGH, NORMAL, LOW = 0, 1, 2
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=NORMAL)
+
+
+@contextmanager
+def priority(level: int):
+    """Приоритет исходящих запросов проверки; задачи, созданные внутри, его наследуют"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+# KEYS - корзины; ARGV - (capacity, rate, floor, cost) на каждую корзину.
+# Токены берутся из всех корзин сразу или ни из одной; ответ - {1|0, ожидание в секундах}
+_TAKE_SCRIPT = """
+redis.replicate_commands()
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 4 - 3])
+  local rate = tonumber(ARGV[i * 4 - 2])
+  local floor = tonumber(ARGV[i * 4 - 1])
+  local cost = tonumber(ARGV[i * 4])
+  local state = redis.call('HMGET', key, 'level', 'ts')
+  local level = tonumber(state[1]) or capacity
+  local ts = tonumber(state[2]) or now
+  level = math.min(capacity, level + math.max(0, now - ts) * rate)
+  levels[i] = level
+  local need = cost + floor - level
+  if need > 0 then
+    wait = math.max(wait, need / rate)
+  end
+end
+if wait > 0 then
+  return {0, tostring(wait)}
+end
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 4 - 3])
+  local rate = tonumber(ARGV[i * 4 - 2])
+  local cost = tonumber(ARGV[i * 4])
+  redis.call('HSET', key, 'level', tostring(levels[i] - cost), 'ts', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {1, '0'}
+"""
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """capacity токенов, пополнение rate в секунду; reserve - корзина суточной квоты (с резервом по приоритету)"""
+    suffix: str
+    capacity: float
+    rate: float
+    reserve: bool = False
+
+
+def per_minute(limit: int) -> List[Bucket]:
+    return [Bucket("m", limit, limit / 60)] if limit > 0 else []
+
+
+def per_day(limit: int) -> List[Bucket]:
+    return [Bucket("d", limit, limit / 86400, reserve=True)] if limit > 0 else []
+
+
+class _MemoryBuckets:
+    """Та же корзина в памяти процесса - когда Redis недоступен"""
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, buckets: List[Tuple[str, float, float, float, float]]) -> Tuple[bool, float]:
+        now = time.monotonic()
+        levels, wait = [], 0.0
+        for key, capacity, rate, floor, cost in buckets:
+            level, ts = self._state.get(key, (capacity, now))
+            level = min(capacity, level + max(0.0, now - ts) * rate)
+            levels.append(level)
+            need = cost + floor - level
+            if need > 0:
+                wait = max(wait, need / rate)
+        if wait > 0:
+            return False, wait
+        for (key, _, _, _, cost), level in zip(buckets, levels):
+            self._state[key] = (level - cost, now)
+        return True, 0.0
+
+
+class RateLimiter:
+    """
+    Набор корзин под одним именем; key - клиент (входящие) или "" (общий исходящий лимит).
+    try_acquire - без ожидания, acquire - с ожиданием в очереди процесса по приоритету.
+    """
+
+    def __init__(self, name: str, buckets: List[Bucket], reserve: float = 0.0):
+        self.name = name
+        self.buckets = buckets
+        self.reserve = reserve
+        self._memory = _MemoryBuckets()
+        self._script = None
+        self._script_client = None
+        self._redis_failed = False
+        # Ожидающие в этом процессе: (приоритет, порядок, событие) - токен пробует только первый
+        self._waiters: List = []
+        self._seq = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.buckets)
+
+    def _layout(self, key: str, cost: float, level: int) -> List[Tuple[str, float, float, float, float]]:
+        """(ключ, емкость, пополнение, неприкосновенный остаток, списание) на каждую корзину"""
+        layout = []
+        for bucket in self.buckets:
+            floor = 0.0
+            charge = cost
+            if bucket.reserve:
+                if level:
+                    # Резерв не больше емкости: иначе запрос низкого приоритета не пройдет никогда
+                    floor = min(bucket.capacity * self.reserve * level, bucket.capacity - 1)
+            else:
+                # Запрос дороже минутной корзины (пакет больше минутного лимита) забирает ее целиком;
+                # суточная квота списывается полностью - пакетами ее не обойти
+                charge = min(cost, bucket.capacity)
+            layout.append((f"ratelimit:{self.name}:{key}:{bucket.suffix}", bucket.capacity, bucket.rate, floor, charge))
+        return layout
+
+    async def _take(self, key: str, cost: float, level: int) -> Tuple[bool, float]:
+        layout = self._layout(key, cost, level)
+        client = get_async_redis()
+        if client is not None:
+            try:
+                if self._script_client is not client:
+                    self._script = client.register_script(_TAKE_SCRIPT)
+                    self._script_client = client
+                args = []
+                for _, capacity, rate, floor, charge in layout:
+                    args += [capacity, rate, floor, charge]
+                allowed, wait = await self._script(keys=[k for k, _, _, _, _ in layout], args=args)
+                self._redis_failed = False
+                return bool(int(allowed)), float(wait)
+            except Exception as e:
+                if not self._redis_failed:
+                    logger.warning(f"⚠️ Rate limiter {self.name}: Redis failed ({e}), using per-process buckets")
+                self._redis_failed = True
+        return self._memory.take(layout)
+
+    async def try_acquire(self, key: str = "", cost: float = 1) -> Tuple[bool, float]:
+        """(взят ли токен, через сколько секунд повторить)"""
+        if not self.enabled:
+            return True, 0.0
+        allowed, wait = await self._take(key, cost, HIGH)
+        RATE_LIMITED.labels(self.name, "allowed" if allowed else "rejected").inc()
+        return allowed, wait
+
+    async def acquire(self, cost: float = 1, timeout: Optional[float] = None) -> bool:
+        """Дождаться токена общего лимита; False - не дождались за timeout (OUTBOUND_MAX_WAIT_SECONDS)"""
+        if not self.enabled:
+            return True
+        level = current_priority()
+        if not self._waiters:
+            allowed, _ = await self._take("", cost, level)
+            if allowed:
+                RATE_LIMITED.labels(self.name, "allowed").inc()
+                return True
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + (settings.OUTBOUND_MAX_WAIT_SECONDS if timeout is None else timeout)
+        entry = (level, next(self._seq), asyncio.Event())
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                wait = None
+                if self._waiters[0] is entry:
+                    allowed, wait = await self._take("", cost, level)
+                    if allowed:
+                        RATE_LIMITED.labels(self.name, "delayed").inc()
+                        RATE_LIMIT_WAIT.labels(self.name).observe(loop.time() - started)
+                        return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    RATE_LIMITED.labels(self.name, "rejected").inc()
+                    logger.warning(f"⏳ Rate limiter {self.name}: no token within {deadline - started:.0f}s (priority {level})")
+                    return False
+                # Первый в очереди спит до пополнения, остальные - пока очередь не сдвинется
+                entry[2].clear()
+                try:
+                    await asyncio.wait_for(entry[2].wait(), min(wait, remaining) if wait is not None else remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            if self._waiters:
+                self._waiters[0][2].set()
+
+
+inbound_limiter = RateLimiter(
+    "client", per_minute(settings.RATE_LIMIT_PER_MINUTE) + per_day(settings.RATE_LIMIT_PER_DAY)
+)
+google_limiter = RateLimiter(
+    "google", per_minute(settings.GOOGLE_RATE_PER_MINUTE) + per_day(settings.GOOGLE_DAILY_QUOTA),
+    reserve=settings.OUTBOUND_QUOTA_RESERVE
+)
+openrouter_limiter = RateLimiter(
+    "openrouter", per_minute(settings.OPENROUTER_RATE_PER_MINUTE) + per_day(settings.OPENROUTER_DAILY_QUOTA),
+    reserve=settings.OUTBOUND_QUOTA_RESERVE
+)
+
+
+def client_ip(request: Request) -> str:
+    """
+    IP клиента. За TRUSTED_PROXY_HOPS прокси - запись X-Forwarded-For, добавленная самым внешним из них:
+    без этого все анонимные клиенты делят один лимит - IP прокси
+    """
+    hops = settings.TRUSTED_PROXY_HOPS
+    if hops > 0:
+        forwarded = [ip.strip() for value in request.headers.getlist("x-forwarded-for") for ip in value.split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[-min(hops, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+def client_key(request: Request, user_id: Optional[str] = Depends(get_current_user_id)) -> str:
+    """Клиент для входящего лимита: пользователь из токена, иначе IP"""
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{client_ip(request)}"
+
+
+async def limit_client(client: str, cost: int = 1):
+    """429 с Retry-After, если клиент исчерпал лимит; cost - число проверок (пакет - по тексту)"""
+    allowed, wait = await inbound_limiter.try_acquire(client, cost)
+    if not allowed:
+        logger.warning(f"Rate limit exceeded: {client}")
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded.",
+            headers={"Retry-After": str(max(1, int(wait + 0.999)))}
+        )
+
+
+async def rate_limited_user_id(
+    client: str = Depends(client_key), user_id: Optional[str] = Depends(get_current_user_id)
+) -> Optional[str]:
+    """get_current_user_id для эндпоинтов проверки - с учетом лимита клиента"""
+    await limit_client(client)
+    return user_id
@@ -0,0 +1,60 @@
+"""
+Readiness - что из стартовой работы процесса уже выполнено (GET /ready)
+/health отвечает, как только процесс принимает соединения; /ready - когда загружены
+обязательные компоненты (БД, локальные индексы, прогрев). Redis не обязателен:
+без него проверки идут на локальном кеше, его состояние только показывается.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, READY, FAILED = "pending", "running", "ready", "failed"
+
+
+class Readiness:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._components: Dict[str, Dict] = {}
+
+    def expect(self, *names: str):
+        """Компоненты, без которых процесс не готов"""
+        for name in names:
+            self._components.setdefault(name, {'state': PENDING})
+
+    @contextmanager
+    def step(self, name: str):
+        """Загрузка компонента: время и исход - в отчет /ready и в лог"""
+        component = self._components.setdefault(name, {'state': PENDING})
+        component['state'] = RUNNING
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            component.update(state=FAILED, error=f"{type(e).__name__}: {e}")
+            raise
+        else:
+            component['state'] = READY
+            component.pop('error', None)
+        finally:
+            component['ms'] = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(f"⏱️ Startup step {name}: {component['state']} in {component['ms']} ms")
+
+    @property
+    def ready(self) -> bool:
+        return all(c['state'] == READY for c in self._components.values())
+
+    def report(self) -> Dict:
+        states = {c['state'] for c in self._components.values()}
+        status = "ready" if self.ready else FAILED if FAILED in states else "starting"
+        return {
+            'status': status,
+            'uptime_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'components': {name: dict(c) for name, c in self._components.items()},
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,50 @@
+"""
+Single-flight: одновременные вызовы с одним ключом ждут один общий результат
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Первый вызов по ключу запускает задачу, остальные ждут ее же.
+    Задача не привязана к вызывающему: отмена одного ожидающего
+    (например, по дедлайну проверки) не отменяет ее для остальных.
+    Работает в пределах одного процесса / event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+            self.leaders += 1
+        else:
+            self.shared += 1
+            logger.debug(f"{self.name}: joined in-flight call")
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибку забирают ожидающие; если их не осталось - не шумим в лог asyncio
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'shared': self.shared}
@@ -0,0 +1,83 @@
+"""
+Group commit - записи результатов из параллельных проверок в одной транзакции
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, List, Tuple, TypeVar
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import observe_stage, DB_WRITE_BATCH
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class GroupWriter:
+    """
+    write(fn) ставит fn(session) в очередь и ждет коммита.
+    Пока идет одна транзакция, новые записи копятся и уходят следующей -
+    при нагрузке проверки, завершившиеся одновременно, делят один коммит,
+    без нагрузки запись не ждет. fn выполняется синхронно внутри AsyncSession.run_sync,
+    поэтому может использовать обычный ORM-код (db.get, db.add, db.execute).
+    """
+
+    def __init__(self, name: str, session_factory, max_batch: int = None, window: float = None):
+        self.name = name
+        self.session_factory = session_factory
+        self.max_batch = max(1, max_batch or settings.DB_WRITE_BATCH_MAX)
+        self.window = settings.DB_WRITE_BATCH_WINDOW_MS / 1000 if window is None else window
+        self._pending: List[Tuple[Callable, asyncio.Future]] = []
+        self._flusher: asyncio.Task = None
+        self.commits = 0
+        self.writes = 0
+
+    async def write(self, fn: Callable[[Session], T]) -> T:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((fn, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        # Отмена ожидающего не отменяет запись: она уже в очереди транзакции
+        return await asyncio.shield(future)
+
+    async def _flush_loop(self):
+        while self._pending:
+            if self.window:
+                await asyncio.sleep(self.window)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[Tuple[Callable, asyncio.Future]]):
+        started = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                results = await db.run_sync(lambda session: [fn(session) for fn, _ in batch])
+                await db.commit()
+            # Транзакция общая для нескольких проверок - в трассы проверок не попадает
+            observe_stage("db_commit", time.perf_counter() - started)
+            DB_WRITE_BATCH.labels(self.name).observe(len(batch))
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # Одна неудачная запись не должна ронять соседей - повторяем по одной
+            logger.warning(f"Group commit ({self.name}) of {len(batch)} failed, retrying one by one: {e}")
+            for item in batch:
+                await self._commit([item])
+            return
+
+        self.commits += 1
+        self.writes += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            'commits': self.commits,
+            'writes': self.writes,
+            'pending': len(self._pending)
+        }
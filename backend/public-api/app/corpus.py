@@ -0,0 +1,75 @@
+"""
+Reference corpus on disk (FINGERPRINT_INDEX_DIR)
+Usage:
+    python -m app.corpus add /data/theses            # *.txt рекурсивно, новые документы - новыми сегментами
+    python -m app.corpus compact                     # слить мелкие сегменты (после add - сразу; иначе по cron)
+    python -m app.corpus stats
+Процессы API и воркеры подхватывают новые сегменты за FINGERPRINT_MAINTENANCE_INTERVAL без перезапуска;
+сами они сегменты не сливают.
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.fingerprint import stable_id
+from app.services.fingerprint_store import SegmentBuilder, SegmentStore
+
+logger = logging.getLogger(__name__)
+
+
+def add_directory(store: SegmentStore, path: str, segment_docs: int, domain: str = "corpus") -> int:
+    """Те же ключи документов, что у FingerprintIndex.load_corpus_dir; уже проиндексированные пропускаются"""
+    root = Path(path)
+    if not root.is_dir():
+        raise SystemExit(f"Corpus dir not found: {path}")
+
+    added = skipped = 0
+    builder = SegmentBuilder()
+    for file in sorted(root.rglob("*.txt")):
+        doc_id = stable_id(f"corpus:{file.relative_to(root)}")
+        if store.has_doc(doc_id) or doc_id in builder.documents:
+            skipped += 1
+            continue
+        try:
+            text = file.read_text(encoding="utf-8", errors="ignore")
+        except OSError as e:
+            logger.error(f"Corpus read error {file}: {e}")
+            continue
+        builder.add_document(doc_id, text, title=file.stem, domain=domain)
+        added += 1
+        if len(builder) >= segment_docs:
+            store.append(builder)
+            builder = SegmentBuilder()
+    store.append(builder)
+    logger.info(f"✓ Corpus {path}: {added} documents added, {skipped} already indexed")
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="On-disk reference corpus index")
+    parser.add_argument("command", choices=["add", "compact", "stats"])
+    parser.add_argument("path", nargs="?", help="каталог с *.txt (для add)")
+    parser.add_argument("--index-dir", default=settings.FINGERPRINT_INDEX_DIR)
+    parser.add_argument("--segment-docs", type=int, default=settings.FINGERPRINT_SEGMENT_DOCS)
+    parser.add_argument("--domain", default="corpus")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.index_dir:
+        raise SystemExit("FINGERPRINT_INDEX_DIR (or --index-dir) is required")
+    store = SegmentStore(args.index_dir).open()
+
+    if args.command == "add":
+        if not args.path:
+            raise SystemExit("add: corpus directory is required")
+        add_directory(store, args.path, max(1, args.segment_docs), args.domain)
+        store.maintain()
+    elif args.command == "compact":
+        store.maintain()
+    print(json.dumps(store.stats()))
+
+
+if __name__ == "__main__":
+    main()
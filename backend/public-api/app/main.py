@@ -1,21 +1,104 @@
-﻿from fastapi import FastAPI, HTTPException, Request, Depends
+﻿from fastapi import FastAPI, HTTPException, Request, Depends, UploadFile, File, Form, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from langdetect import detect, lang_detect_exception
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import json
 import logging
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
 
 from app.core.config import settings
-from app.services import detector
-from app.models import CheckResult, CheckRequest, create_db_and_tables, get_db
+from app.core.cache import redis_health
+from app.core.readiness import readiness
+from app.core.queue import get_queue
+from app.core.progress import progress_hub, FINAL_EVENTS
+from app.core.auth import get_current_user_id, require_user_id
+from app.core.ratelimit import rate_limited_user_id, client_key, limit_client, priority, HIGH, NORMAL
+from app.core.metrics import stage, HTTP_SECONDS, QUEUE_DEPTH, DB_WRITE_PENDING
+from app.core import profiler
+from app.core.bodylimit import BodyLimitMiddleware
+from app.services.detector import detector
+from app.services.ai import ai_service
+from app.services.language import detect_language
+from app.services.checks import run_check, run_batch, enqueue_batch, load_indexes, close_indexes, warm_up, result_writer
+from app.services.extract import extract_text, extract_archive, UnsupportedDocument, DocumentTooLarge
+from app.services.storage import attach_result, load_matches, result_options
+from app.services.history import history_page, dashboard
+from app.worker import worker_loop, process_job, reaper_loop
+from app.models import (
+    CheckResult, CheckBatch, CheckRequest, CheckResultResponse, MatchPageResponse,
+    BatchCheckRequest, BatchResponse, HistoryResponse, DashboardResponse,
+    AsyncSessionLocal, async_engine, init_db, get_async_db
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_workers = []
+# Фоновые проверки потоковых запросов (без очереди)
+_background = set()
+
+async def _load_components():
+    """Индексы и прогрев: до их окончания /ready отвечает 503, а проверки идут по уже загруженному"""
+    try:
+        with readiness.step("indexes"):
+            await load_indexes()
+        if settings.STARTUP_WARMUP:
+            with readiness.step("warmup"):
+                await warm_up()
+    except Exception as e:
+        logger.error(f"❌ Startup loading failed: {e}", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Старт не ждет ни Redis (его доступность проверяется в фоне), ни загрузки индексов
+    started = time.perf_counter()
+    readiness.expect("database", "indexes", *(("warmup",) if settings.STARTUP_WARMUP else ()))
+    with readiness.step("database"):
+        await asyncio.to_thread(init_db)
+    redis_health.start()
+
+    loader = asyncio.create_task(_load_components())
+    if not settings.INDEXES_BACKGROUND_LOAD:
+        await loader
+
+    # Для inprocess-очереди воркеры живут в процессе API
+    queue = get_queue()
+    if queue is not None and queue.name == "inprocess":
+        for i in range(settings.JOB_QUEUE_WORKERS):
+            _workers.append(asyncio.create_task(worker_loop(queue, f"api-{i}")))
+    # Задачи, брошенные умершими воркерами (любой бэкенд очереди), - в failed;
+    # для inprocess-очереди - и pending-задачи прежнего процесса (очередь в памяти после рестарта пуста)
+    if queue is not None:
+        lost_before = datetime.utcnow() if queue.name == "inprocess" else None
+        _workers.append(asyncio.create_task(reaper_loop(lost_before)))
+    logger.info(f"🚀 Startup complete in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    yield
+
+    for task in [loader] + _workers + list(_background):
+        task.cancel()
+    await redis_health.stop()
+    await close_indexes()
+    # Закрываем общие пулы HTTP-соединений
+    await detector.aclose()
+    await ai_service.aclose()
+    await async_engine.dispose()
+
 app = FastAPI(
     title="Antiplagiat API",
     description="API для проверки текстов на уникальность.",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Настройка CORS
@@ -27,9 +110,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+# Загрузки обрываются по размеру тела до того, как Starlette спулит их целиком (запас - на заголовки multipart)
+_MULTIPART_OVERHEAD = 64 * 1024
+app.add_middleware(
+    BodyLimitMiddleware,
+    limits={
+        "/api/v1/check/upload": settings.MAX_FILE_SIZE_BYTES + _MULTIPART_OVERHEAD,
+        "/api/v1/batch/upload": settings.BATCH_MAX_ARCHIVE_MB * 1024 * 1024 + _MULTIPART_OVERHEAD,
+    },
+)
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    # Шаблон маршрута (/api/v1/check/{task_id}), а не путь - иначе метка на каждый task_id
+    started = time.perf_counter()
+    if profiler.requested(request.headers.get("X-Profile")):
+        name = request.url.path.strip("/").replace("/", "_") or "root"
+        with profiler.profile(name) as path:
+            response = await call_next(request)
+        if path:
+            response.headers["X-Profile-File"] = path
+    else:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.labels(
+        request.method, getattr(route, "path", "unmatched"), str(response.status_code)
+    ).observe(time.perf_counter() - started)
+    return response
 
 @app.get("/", tags=["General"])
 def read_root():
@@ -40,39 +147,380 @@ def health_check():
     # Простая проверка, что API работает
     return {"status": "ok"}
 
-@app.post("/api/v1/check", response_model=CheckResult, tags=["Plagiarism Check"])
-async def create_check(request: CheckRequest, db: Session = Depends(get_db)):
+@app.get("/ready", tags=["General"])
+def readiness_check():
+    """Готовность принимать проверки: 200 - все обязательные компоненты загружены, иначе 503"""
+    report = readiness.report()
+    report["redis"] = {"state": redis_health.state, "error": redis_health.last_error}
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Gauges, которые дешевле посчитать при сборе, чем поддерживать
+    DB_WRITE_PENDING.labels(result_writer.name).set(result_writer.stats()['pending'])
+    queue = get_queue()
+    if queue is not None:
+        try:
+            QUEUE_DEPTH.set(await queue.size())
+        except Exception as e:
+            logger.warning(f"Queue size unavailable: {e}")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/api/v1/check", response_model=CheckResultResponse, tags=["Plagiarism Check"])
+async def create_check(request: CheckRequest, user_id: Optional[str] = Depends(rate_limited_user_id)):
     """
     Создает новую проверку текста.
     - **text**: Текст для проверки (минимум 100 символов).
+    - **mode**: fast - только локальный индекс, deep - локальный индекс + Google.
+    """
+    return await _submit_check(request.text, request.mode, user_id)
+
+@app.post("/api/v1/check/upload", response_model=CheckResultResponse, tags=["Plagiarism Check"])
+async def create_check_from_file(
+    file: UploadFile = File(...),
+    mode: str = Form("deep", pattern="^(fast|deep)$"),
+    user_id: Optional[str] = Depends(rate_limited_user_id)
+):
+    """
+    Проверка документа (txt, pdf, docx, rtf).
+    Файл принимается во временный файл (в памяти только первый мегабайт), тело сверх
+    MAX_FILE_SIZE_MB обрывается при чтении; текст извлекается постранично / по абзацам, до MAX_TEXT_CHARS.
     """
-    text = request.text
+    file_type = (file.filename or "").rsplit(".", 1)[-1].lower()
+    if file_type not in settings.ALLOWED_FILE_TYPES_LIST:
+        raise HTTPException(status_code=415, detail=f"Allowed file types: {settings.ALLOWED_FILE_TYPES}")
+
+    file.file.seek(0, 2)
+    if file.file.tell() > settings.MAX_FILE_SIZE_BYTES:
+        raise HTTPException(status_code=413, detail=f"File is larger than {settings.MAX_FILE_SIZE_MB} MB.")
+
+    try:
+        # Разбор документа - CPU и диск, не держим event loop
+        text = await run_in_threadpool(extract_text, file.file, file_type, settings.MAX_TEXT_CHARS)
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedDocument as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        await file.close()
+
+    return await _submit_check(text, mode, user_id)
+
+def _validate_text(text: str) -> str:
+    """Язык текста - дальше его используют сегментация и отбор запросов"""
     if not text or len(text) < 100:
         raise HTTPException(status_code=400, detail="Text must be at least 100 characters long.")
 
-    # Автоматическое определение языка
-    try:
-        lang = detect(text)
-    except lang_detect_exception.LangDetectException:
-        lang = "en" # Fallback
-        logger.warning("Could not detect language, falling back to 'en'")
-        
+    # Автоматическое определение языка: по выборке из текста, время не зависит от длины
+    with stage("language"):
+        lang = detect_language(text)
     logger.info(f"Detected language: {lang}")
+    return lang
+
+async def _create_pending(text: str, user_id: Optional[str] = None) -> CheckResult:
+    db_result = CheckResult(
+        task_id=str(uuid.uuid4()),
+        status="pending",
+        user_id=user_id,
+        total_words=len(text.split()),
+        total_chars=len(text)
+    )
+    await result_writer.write(lambda db: db.add(db_result))
+    return db_result
+
+async def _mark_failed(task_ids: List[str]):
+    def update(db):
+        for row in db.query(CheckResult).filter(CheckResult.task_id.in_(task_ids)):
+            row.status = "failed"
+    await result_writer.write(update)
 
-    # Теперь проверка всегда в режиме "deep"
+async def _enqueue_check(text: str, mode: str, user_id: Optional[str] = None, lang: Optional[str] = None) -> CheckResult:
+    # Режим очереди: сразу отдаем task_id, проверку выполнит воркер
+    db_result = await _create_pending(text, user_id)
     try:
-        result_data = await detector.analyze(text, "deep", lang, db)
-        return result_data
+        await get_queue().put({"task_id": db_result.task_id, "text": text, "mode": mode, "lang": lang, "priority": HIGH})
+    except Exception as e:
+        logger.error(f"Queue error: {e}", exc_info=True)
+        await _mark_failed([db_result.task_id])
+        raise HTTPException(status_code=503, detail="Check queue is unavailable.")
+    return db_result
+
+async def _submit_check(text: str, mode: str, user_id: Optional[str] = None):
+    lang = _validate_text(text)
+
+    if get_queue() is not None:
+        return await _enqueue_check(text, mode, user_id, lang)
+
+    try:
+        # Одиночную проверку ждет пользователь - ее запросы к Google/OpenRouter идут первыми
+        with priority(HIGH):
+            return await run_check(text, mode, user_id=user_id, lang=lang)
     except Exception as e:
         logger.error(f"Error during plagiarism check: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="An internal error occurred during the check.")
 
-@app.get("/api/v1/check/{task_id}", response_model=CheckResult, tags=["Plagiarism Check"])
-def get_check_result(task_id: str, db: Session = Depends(get_db)):
+@app.post("/api/v1/check/stream", tags=["Plagiarism Check"])
+async def create_check_stream(request: CheckRequest, user_id: Optional[str] = Depends(rate_limited_user_id)):
+    """
+    Создает проверку и сразу отдает поток событий (text/event-stream):
+    status -> progress (этапы, предварительные совпадения по каждому запросу) -> result.
+    Проверка продолжается и сохраняется, даже если клиент отключился.
+    """
+    lang = _validate_text(request.text)
+
+    if get_queue() is not None:
+        db_result = await _enqueue_check(request.text, request.mode, user_id, lang)
+    else:
+        db_result = await _create_pending(request.text, user_id)
+        job = {"task_id": db_result.task_id, "text": request.text, "mode": request.mode, "lang": lang, "priority": HIGH}
+        task = asyncio.create_task(process_job(job))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+    return _event_response(db_result.task_id)
+
+@app.get("/api/v1/check/{task_id}/events", tags=["Plagiarism Check"])
+def get_check_events(task_id: str):
+    """
+    Поток событий уже созданной проверки (SSE) - вместо опроса GET /api/v1/check/{task_id}.
+    Для завершенной проверки сразу приходит result.
+    """
+    return _event_response(task_id)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _load_result(task_id: str) -> Optional[CheckResultResponse]:
+    async with AsyncSessionLocal() as db:
+        row = await db.get(CheckResult, task_id, options=result_options())
+        if row is None:
+            return None
+        return CheckResultResponse.model_validate(await db.run_sync(attach_result, row))
+
+def _event_response(task_id: str) -> StreamingResponse:
+    return StreamingResponse(
+        _event_stream(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _event_stream(task_id: str):
+    # Подписка до чтения БД: итог, опубликованный между ними, не потеряется
+    async with progress_hub.subscribe(task_id) as events:
+        result = await _load_result(task_id)
+        if result is None:
+            yield _sse("error", {"task_id": task_id, "detail": "Task not found"})
+            return
+        yield _sse("status", {"task_id": task_id, "status": result.status})
+
+        while result.status not in ("completed", "failed"):
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=settings.PROGRESS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Редкая сверка с БД на случай потерянного события (воркер в другом процессе без Redis)
+                result = await _load_result(task_id) or result
+                yield ": keepalive\n\n"
+                continue
+            if event.get("event") in FINAL_EVENTS:
+                result = await _load_result(task_id) or result
+                break
+            yield _sse(event.get("event", "progress"), event)
+
+        yield _sse("result", result.model_dump(mode="json"))
+
+@app.get("/api/v1/check/{task_id}", response_model=CheckResultResponse, tags=["Plagiarism Check"])
+async def get_check_result(task_id: str, include_matches: bool = True, db: AsyncSession = Depends(get_async_db)):
     """
     Получает результат проверки по ее ID.
+    - **include_matches**: false - только сводка и источники (совпадения - через /matches постранично).
     """
-    db_result = db.query(CheckResult).filter(CheckResult.task_id == task_id).first()
+    db_result = await db.get(CheckResult, task_id, options=result_options(include_matches))
     if db_result is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return db_result
+    return await db.run_sync(attach_result, db_result, include_matches)
+
+@app.get("/api/v1/check/{task_id}/matches", response_model=MatchPageResponse, tags=["Plagiarism Check"])
+async def get_check_matches(
+    task_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Совпадения проверки постранично; sources - только источники этой страницы.
+    """
+    db_result = await db.get(CheckResult, task_id, options=result_options())
+    if db_result is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    total, items, sources = await db.run_sync(load_matches, db_result, offset, limit)
+    return MatchPageResponse(task_id=task_id, total=total, offset=offset, limit=limit, items=items, sources=sources)
+
+@app.post("/api/v1/batch", response_model=BatchResponse, tags=["Batch Check"])
+async def create_batch(
+    request: BatchCheckRequest,
+    db: AsyncSession = Depends(get_async_db),
+    user_id: Optional[str] = Depends(get_current_user_id),
+    client: str = Depends(client_key)
+):
+    """
+    Пакетная проверка (например, работы всей группы).
+    - **texts**: тексты (каждый минимум 100 символов, не больше BATCH_MAX_ITEMS).
+    - **names**: необязательные подписи к текстам (ФИО, имя файла).
+    - **mode**: fast | deep.
+    Ответ содержит task_id каждого текста и матрицу взаимной близости текстов пакета.
+    """
+    if request.names is not None and len(request.names) != len(request.texts):
+        raise HTTPException(status_code=400, detail="names must have the same length as texts.")
+    return await _submit_batch(request.texts, request.mode, db, request.names, user_id, client)
+
+@app.post("/api/v1/batch/upload", response_model=BatchResponse, tags=["Batch Check"])
+async def create_batch_from_archive(
+    file: UploadFile = File(...),
+    mode: str = Form("deep", pattern="^(fast|deep)$"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: Optional[str] = Depends(get_current_user_id),
+    client: str = Depends(client_key)
+):
+    """
+    Пакетная проверка ZIP-архива с документами (txt, pdf, docx, rtf).
+    Имена файлов становятся подписями элементов пакета.
+    """
+    if not (file.filename or "").lower().endswith(".zip"):
+        raise HTTPException(status_code=415, detail="Batch upload expects a .zip archive.")
+
+    file.file.seek(0, 2)
+    if file.file.tell() > settings.BATCH_MAX_ARCHIVE_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Archive is larger than {settings.BATCH_MAX_ARCHIVE_MB} MB.")
+
+    try:
+        documents = await run_in_threadpool(
+            extract_archive, file.file, settings.ALLOWED_FILE_TYPES_LIST,
+            settings.BATCH_MAX_ITEMS, settings.MAX_FILE_SIZE_BYTES, settings.MAX_TEXT_CHARS
+        )
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedDocument as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        await file.close()
+
+    if not documents:
+        raise HTTPException(status_code=400, detail="Archive contains no supported documents.")
+    names = [name for name, _ in documents]
+    return await _submit_batch([text for _, text in documents], mode, db, names, user_id, client)
+
+async def _submit_batch(
+    texts: List[str], mode: str, db: AsyncSession, names: Optional[List[str]] = None,
+    user_id: Optional[str] = None, client: Optional[str] = None
+):
+    if len(texts) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {settings.BATCH_MAX_ITEMS} texts.")
+    short = [names[i] if names else i for i, text in enumerate(texts) if not text or len(text) < 100]
+    if short:
+        raise HTTPException(status_code=400, detail=f"Texts must be at least 100 characters long: {short}")
+    # Пакет расходует лимит клиента по тексту
+    if client is not None:
+        await limit_client(client, len(texts))
+
+    # Язык по выборке из текста - доли миллисекунды, пул потоков не нужен
+    with stage("language"):
+        langs = [detect_language(text) for text in texts]
+    logger.info(f"Batch of {len(texts)}, languages: {dict(Counter(langs))}")
+
+    queue = get_queue()
+    if queue is not None:
+        batch, rows = await enqueue_batch(texts, mode, names, user_id)
+        try:
+            for row, text, lang in zip(rows, texts, langs):
+                await queue.put({"task_id": row.task_id, "text": text, "mode": mode, "lang": lang, "priority": NORMAL})
+        except Exception as e:
+            logger.error(f"Queue error: {e}", exc_info=True)
+            await _mark_failed([row.task_id for row in rows])
+            raise HTTPException(status_code=503, detail="Check queue is unavailable.")
+        return await _batch_response(db, batch)
+
+    try:
+        batch = await run_batch(texts, mode, names, user_id, langs)
+    except Exception as e:
+        logger.error(f"Error during batch check: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred during the batch check.")
+    return await _batch_response(db, batch)
+
+@app.get("/api/v1/batch/{batch_id}", response_model=BatchResponse, tags=["Batch Check"])
+async def get_batch_result(batch_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Состояние пакета: статусы элементов и матрица взаимной близости.
+    """
+    batch = await db.get(CheckBatch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return await _batch_response(db, batch)
+
+async def _batch_response(db: AsyncSession, batch: CheckBatch) -> BatchResponse:
+    # Элементы пакета - одним запросом, порядок как при отправке
+    found = await db.scalars(select(CheckResult).where(CheckResult.task_id.in_(batch.task_ids)))
+    rows = {r.task_id: r for r in found}
+    names = batch.names or [None] * len(batch.task_ids)
+    items = []
+    for task_id, name in zip(batch.task_ids, names):
+        row = rows.get(task_id)
+        items.append({
+            "task_id": task_id,
+            "name": name,
+            "status": row.status if row else "failed",
+            "originality": row.originality if row else None,
+            "total_words": row.total_words if row else None
+        })
+
+    statuses = Counter(item["status"] for item in items)
+    if statuses["pending"] + statuses["running"] == 0:
+        status = "completed"
+    else:
+        status = "pending" if statuses["pending"] == len(items) else "running"
+
+    # Пары текстов пакета, похожие друг на друга
+    pairs = []
+    matrix = batch.matrix or []
+    for i in range(len(matrix)):
+        for j in range(i + 1, len(matrix)):
+            if matrix[i][j] >= settings.SIMILARITY_LOW:
+                pairs.append({"a": batch.task_ids[i], "b": batch.task_ids[j], "similarity": matrix[i][j]})
+    pairs.sort(key=lambda p: p["similarity"], reverse=True)
+
+    return BatchResponse(
+        batch_id=batch.batch_id,
+        status=status,
+        mode=batch.mode,
+        total=len(items),
+        completed=statuses["completed"],
+        items=items,
+        matrix=batch.matrix,
+        pairs=pairs,
+        created_at=batch.created_at
+    )
+
+@app.get("/api/v1/user/history", response_model=HistoryResponse, tags=["User"])
+async def get_user_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(require_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    История проверок пользователя, новые сверху.
+    - **cursor**: next_cursor из предыдущего ответа (keyset-пагинация, без OFFSET).
+    """
+    try:
+        rows, next_cursor = await db.run_sync(history_page, user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return HistoryResponse(items=rows, next_cursor=next_cursor)
+
+@app.get("/api/v1/user/dashboard", response_model=DashboardResponse, tags=["User"])
+async def get_user_dashboard(user_id: str = Depends(require_user_id), db: AsyncSession = Depends(get_async_db)):
+    """
+    Статистика пользователя из агрегатов (без сканирования истории) + последние проверки.
+    """
+    return await db.run_sync(dashboard, user_id)
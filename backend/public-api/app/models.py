@@ -2,12 +2,17 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from sqlalchemy import Column, String, Float, Integer, DateTime, JSON, create_engine
+from sqlalchemy import Column, String, Float, Integer, BigInteger, DateTime, JSON, LargeBinary, Index, create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, deferred
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, Optional, List
 from datetime import datetime
 import os
 
+from app.core.config import settings
+
 Base = declarative_base()
 
 class CheckResult(Base):
@@ -17,12 +22,136 @@ class CheckResult(Base):
     originality = Column(Float, nullable=True)
     total_words = Column(Integer, nullable=True)
     total_chars = Column(Integer, nullable=True)
-    matches = Column(JSON, nullable=True)
-    sources = Column(JSON, nullable=True)
-    ai_powered = Column(String, default=False)
+    # Старый формат (JSON с текстом каждого фрагмента) - только чтение строк, записанных до упаковки
+    matches_json = deferred(Column("matches", JSON, nullable=True), group="payload")
+    sources_json = deferred(Column("sources", JSON, nullable=True), group="sources")
+    # Строковая колонка: пишутся только "true"/"false" - asyncpg не принимает bool для VARCHAR
+    ai_powered = Column(String, default="false")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Когда воркер взял задачу (running); по нему находятся задачи умерших воркеров
+    started_at = Column(DateTime, nullable=True)
+    user_id = Column(String, nullable=True, index=True)
+    minhash = Column(JSON, nullable=True)
+    # Чем результат хуже полного: дедлайн, устаревший кеш поиска, недоступный Google/LLM (None - полный)
+    degraded = Column(JSON, nullable=True)
+    # Компактный формат (app/services/storage.py), грузится только по запросу:
+    # payload - текст и совпадения, sources - ссылки на источники (нужны и без совпадений).
+    # match_count заполнен у всех строк компактного формата - по нему отличаются старые строки
+    match_count = Column(Integer, nullable=True)
+    text_data = deferred(Column(LargeBinary, nullable=True), group="payload")
+    match_data = deferred(Column(LargeBinary, nullable=True), group="payload")
+    source_data = deferred(Column(LargeBinary, nullable=True), group="sources")
+
+    __table_args__ = (
+        # История пользователя: keyset-пагинация по (created_at, task_id) в пределах user_id
+        Index("idx_check_user_created", "user_id", created_at.desc(), task_id.desc()),
+    )
+
+class Source(Base):
+    """Источники совпадений, общие для всех проверок (id - stable_id из детектора)"""
+    __tablename__ = "sources"
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    title = Column(String, nullable=True)
+    url = Column(String, nullable=True)
+    domain = Column(String, nullable=True)
+
+class UserStats(Base):
+    """Агрегаты пользователя, обновляются при записи результата - дашборд не сканирует историю"""
+    __tablename__ = "user_stats"
+    user_id = Column(String, primary_key=True)
+    check_count = Column(Integer, nullable=False, default=0)
+    originality_sum = Column(Float, nullable=False, default=0.0)
+    total_words = Column(BigInteger, nullable=False, default=0)
+    last_check_at = Column(DateTime, nullable=True)
+
+class CheckBatch(Base):
+    __tablename__ = "check_batches"
+    batch_id = Column(String, primary_key=True, index=True)
+    mode = Column(String, default="deep")
+    task_ids = Column(JSON, nullable=False)
+    names = Column(JSON, nullable=True)
+    matrix = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     user_id = Column(String, nullable=True, index=True)
 
+# Схемы API
+class CheckRequest(BaseModel):
+    text: str = Field(max_length=settings.MAX_TEXT_CHARS)
+    mode: str = Field(default="deep", pattern="^(fast|deep)$")
+
+class CheckResultResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    task_id: str
+    status: str
+    originality: Optional[float] = None
+    total_words: Optional[int] = None
+    total_chars: Optional[int] = None
+    matches: Optional[List[dict]] = None
+    sources: Optional[List[dict]] = None
+    match_count: Optional[int] = None
+    ai_powered: bool = False
+    created_at: Optional[datetime] = None
+    similar: Optional[List[dict]] = None
+    reused_from: Optional[str] = None
+    degraded: Optional[dict] = None
+
+class MatchPageResponse(BaseModel):
+    task_id: str
+    total: int
+    offset: int
+    limit: int
+    items: List[dict]
+    sources: List[dict]
+
+class HistoryItemResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    task_id: str
+    status: str
+    originality: Optional[float] = None
+    total_words: Optional[int] = None
+    match_count: Optional[int] = None
+    ai_powered: bool = False
+    created_at: Optional[datetime] = None
+
+class HistoryResponse(BaseModel):
+    items: List[HistoryItemResponse]
+    next_cursor: Optional[str] = None
+
+class DashboardResponse(BaseModel):
+    user_id: str
+    check_count: int
+    avg_originality: Optional[float] = None
+    total_words: int
+    last_check_at: Optional[datetime] = None
+    recent: List[HistoryItemResponse]
+
+class BatchCheckRequest(BaseModel):
+    texts: List[Annotated[str, Field(max_length=settings.MAX_TEXT_CHARS)]] = Field(min_length=1)
+    names: Optional[List[str]] = None
+    mode: str = Field(default="deep", pattern="^(fast|deep)$")
+
+class BatchItemResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    task_id: str
+    name: Optional[str] = None
+    status: str
+    originality: Optional[float] = None
+    total_words: Optional[int] = None
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    mode: str
+    total: int
+    completed: int
+    items: List[BatchItemResponse]
+    matrix: Optional[List[List[float]]] = None
+    pairs: Optional[List[dict]] = None
+    created_at: Optional[datetime] = None
+
 def _pick_database_url() -> str:
     # Render может прокидывать разные переменные
     for key in ("DATABASE_URL", "DATABASE_INTERNAL_URL", "POSTGRES_URL", "POSTGRESQL_URL"):
@@ -60,6 +189,31 @@ except Exception as e:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def _async_url(url: str) -> str:
+    # Тот же DATABASE_URL, async-драйвер: aiosqlite / asyncpg
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql+psycopg2://"):
+        # asyncpg не понимает sslmode, у него параметр ssl
+        return "postgresql+asyncpg://" + url[len("postgresql+psycopg2://"):].replace("sslmode=", "ssl=")
+    return url
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+# Async-движок для обработчиков и пайплайна проверки; sync остается для init_db и старта
+try:
+    if ASYNC_DATABASE_URL.startswith("sqlite"):
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+    else:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True, pool_size=10, max_overflow=20, echo=False)
+    logger.info("✓ Async database engine created")
+except Exception as e:
+    logger.info(f"❌ Async database error: {e}")
+    raise
+
+# expire_on_commit=False: объекты после коммита отдаются в ответ без повторного SELECT
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -67,9 +221,40 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def _upgrade_schema():
+    """
+    create_all не меняет существующие таблицы: колонки и индексы, добавленные в модели позже,
+    досоздаются здесь. Новые колонки - nullable, ADD COLUMN без DEFAULT; повторный запуск ничего не меняет
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=engine.dialect)}"
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                logger.info(f"✓ Schema: {table.name}.{column.name} added")
+            except Exception as e:
+                # Другой процесс, стартовавший одновременно, успел добавить ту же колонку
+                if column.name not in {c['name'] for c in inspect(engine).get_columns(table.name)}:
+                    raise
+                logger.info(f"Schema: {table.name}.{column.name} added concurrently ({type(e).__name__})")
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
 def init_db():
     try:
         Base.metadata.create_all(bind=engine)
+        _upgrade_schema()
         logger.info("✓ Database tables created")
     except Exception as e:
         logger.info(f"❌ Error: {e}")
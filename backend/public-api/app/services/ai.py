@@ -3,13 +3,23 @@ AI Service - OpenRouter Integration
 Reads API key from environment variables
 """
 import aiohttp
+import asyncio
 import json
-from typing import List, Dict
+import random
+from typing import List, Dict, Optional, Tuple
 import logging
 from app.core.config import settings
+from app.core.breaker import CircuitBreaker
+from app.core.ratelimit import openrouter_limiter
+from app.core.metrics import stage, external_call, AI_TOKENS
 
 logger = logging.getLogger(__name__)
 
+# Ответы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Ключ, баланс или лимит: повторы не помогут - breaker размыкается сразу
+TRIP_STATUSES = {401, 402, 403, 429}
+
 class OpenRouterAI:
     def __init__(self):
         self.api_key = settings.OPENROUTER_API_KEY
@@ -17,19 +27,116 @@ class OpenRouterAI:
         self.model = settings.AI_MODEL
         self.timeout = settings.AI_TIMEOUT
         self.max_retries = settings.AI_MAX_RETRIES
-        
+        self.concurrency = max(1, settings.AI_CONCURRENCY)
+        self.batch_size = max(1, settings.AI_BATCH_SIZE)
+        self.backoff_base = settings.AI_RETRY_BACKOFF
+        self.backoff_max = settings.AI_RETRY_BACKOFF_MAX
+
+        # Одна сессия (пул соединений) на процесс, создается при первом запросе
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.breaker = CircuitBreaker("openrouter")
+
         if not self.api_key:
             logger.warning("⚠️  OPENROUTER_API_KEY not set!")
         else:
             logger.info(f"✓ AI Service initialized with model: {self.model}")
-        
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.concurrency * 2, keepalive_timeout=60),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": "https://antiplagiat-api.onrender.com",
+                    "X-Title": "Antiplagiat AI Detection"
+                }
+            )
+        return self._session
+
+    async def aclose(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _backoff(self, attempt: int) -> float:
+        # Экспоненциальная задержка с full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _complete(self, prompt: str, max_tokens: int) -> Optional[str]:
+        """Один chat completion с повторами; None, если API недоступен или breaker разомкнут"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.3,
+            "max_tokens": max_tokens
+        }
+
+        for attempt in range(self.max_retries):
+            retry = False
+            try:
+                async with self._semaphore:
+                    # Проверка внутри семафора: ожидавшие в очереди не идут в уже отказавший API
+                    if not self.breaker.allow():
+                        return None
+                    # Без токена общего лимита - как при недоступном API: пары остаются с локальной оценкой
+                    if not await openrouter_limiter.acquire():
+                        return None
+                    with stage("ai"):
+                        async with self._get_session().post(self.base_url, json=payload) as response:
+                            external_call("openrouter", "ok" if response.status == 200 else f"http_{response.status}")
+                            if response.status == 200:
+                                self.breaker.record_success()
+                                data = await response.json()
+                                self._count_tokens(data.get("usage"))
+                                return data["choices"][0]["message"]["content"]
+                            logger.error(f"OpenRouter error: {response.status}")
+                            retry = response.status in RETRY_STATUSES
+                            if retry or response.status in TRIP_STATUSES:
+                                self.breaker.record_failure(
+                                    trip=response.status in TRIP_STATUSES, reason=f"HTTP {response.status}"
+                                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                external_call("openrouter", "error")
+                self.breaker.record_failure(reason=type(e).__name__)
+                logger.error(f"OpenRouter request error (attempt {attempt+1}): {e}")
+                retry = True
+            except (KeyError, IndexError, ValueError) as e:
+                logger.error(f"OpenRouter bad response: {e}")
+
+            if not retry or attempt == self.max_retries - 1:
+                break
+            await asyncio.sleep(self._backoff(attempt))
+
+        return None
+
+    @staticmethod
+    def _count_tokens(usage: Optional[Dict]):
+        # Расход квоты OpenRouter - по данным самого ответа
+        if not isinstance(usage, dict):
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if isinstance(usage.get(kind), int):
+                AI_TOKENS.labels(kind.split("_")[0]).inc(usage[kind])
+
+    @staticmethod
+    def _parse_json(content: str, opening: str = "{", closing: str = "}"):
+        start = content.find(opening)
+        end = content.rfind(closing) + 1
+        return json.loads(content[start:end])
+
     async def detect_paraphrase(self, text1: str, text2: str) -> Dict:
         """
         Определить, является ли text2 парафразом text1
         """
         if not self.api_key:
             return {"is_paraphrase": False, "similarity": 0.0, "explanation": "API key not configured"}
-        
+
         prompt = f"""Сравни два текста и определи, является ли второй текст парафразом первого.
 
 Текст 1: {text1}
@@ -43,96 +150,112 @@ class OpenRouterAI:
   "explanation": "краткое объяснение"
 }}"""
 
-        for attempt in range(self.max_retries):
+        content = await self._complete(prompt, max_tokens=500)
+        if content is None:
+            return {"is_paraphrase": False, "similarity": 0.0, "explanation": "API unavailable", "unavailable": True}
+
+        try:
+            return self._parse_json(content)
+        except ValueError:
+            return {
+                "is_paraphrase": "парафраз" in content.lower(),
+                "similarity": 0.7 if "похож" in content.lower() else 0.3,
+                "explanation": content
+            }
+
+    async def detect_paraphrase_batch(self, pairs: List[Tuple[str, str]]) -> List[Dict]:
+        """
+        Пакетная проверка пар (фрагмент, кандидат-источник):
+        до AI_BATCH_SIZE пар в одном запросе, пакеты идут параллельно.
+        Порядок ответов совпадает с порядком пар.
+        """
+        if not pairs:
+            return []
+        if not self.api_key:
+            return [{"is_paraphrase": False, "similarity": 0.0, "explanation": "API key not configured"} for _ in pairs]
+
+        batches = [pairs[i:i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]
+        results = await asyncio.gather(*(self._paraphrase_batch(batch) for batch in batches))
+        return [verdict for batch in results for verdict in batch]
+
+    async def _paraphrase_batch(self, pairs: List[Tuple[str, str]]) -> List[Dict]:
+        items = "\n\n".join(
+            f"Пара {i}:\nТекст 1: {text1}\nТекст 2: {text2}"
+            for i, (text1, text2) in enumerate(pairs, 1)
+        )
+        prompt = f"""Для каждой пары определи, является ли второй текст парафразом первого.
+
+{items}
+
+Ответь в формате JSON, по одному элементу на каждую пару:
+{{"results": [
+  {{"id": 1, "is_paraphrase": true/false, "similarity": 0.0-1.0, "explanation": "краткое объяснение"}}
+]}}"""
+
+        unavailable = {"is_paraphrase": False, "similarity": 0.0, "explanation": "API unavailable", "unavailable": True}
+        content = await self._complete(prompt, max_tokens=min(4000, 150 * len(pairs) + 200))
+        if content is None:
+            return [dict(unavailable) for _ in pairs]
+
+        try:
+            parsed = self._parse_json(content).get("results", [])
+        except (ValueError, AttributeError):
             try:
-                timeout = aiohttp.ClientTimeout(total=self.timeout)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.post(
-                        self.base_url,
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json",
-                            "HTTP-Referer": "https://antiplagiat-api.onrender.com",
-                            "X-Title": "Antiplagiat AI Detection"
-                        },
-                        json={
-                            "model": self.model,
-                            "messages": [{"role": "user", "content": prompt}],
-                            "temperature": 0.3,
-                            "max_tokens": 500
-                        }
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            content = data["choices"][0]["message"]["content"]
-                            
-                            try:
-                                start = content.find("{")
-                                end = content.rfind("}") + 1
-                                json_str = content[start:end]
-                                result = json.loads(json_str)
-                                return result
-                            except:
-                                return {
-                                    "is_paraphrase": "парафраз" in content.lower(),
-                                    "similarity": 0.7 if "похож" in content.lower() else 0.3,
-                                    "explanation": content
-                                }
-                        else:
-                            logger.error(f"OpenRouter error: {response.status}")
-                            if attempt < self.max_retries - 1:
-                                continue
-            except Exception as e:
-                logger.error(f"AI detection error (attempt {attempt+1}): {e}")
-                if attempt < self.max_retries - 1:
-                    continue
-        
-        return {"is_paraphrase": False, "similarity": 0.0, "explanation": "API unavailable"}
-    
+                parsed = self._parse_json(content, "[", "]")
+            except ValueError:
+                parsed = []
+
+        by_id = {}
+        for item in parsed:
+            try:
+                by_id[int(item["id"])] = item
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        # Пара без вердикта (сбой разбора, пропуск в ответе) - не "не парафраз", а непроверенная:
+        # детектор оставит ее с локальной оценкой и пометит результат degraded
+        missing = sum(1 for i in range(1, len(pairs) + 1) if i not in by_id)
+        if missing:
+            logger.warning(f"AI batch response: no verdict for {missing}/{len(pairs)} pairs")
+        verdicts = []
+        for i in range(1, len(pairs) + 1):
+            item = by_id.get(i)
+            if item is None:
+                verdicts.append({**unavailable, "explanation": "No verdict in batch response"})
+                continue
+            try:
+                similarity = float(item.get("similarity", 0.0) or 0.0)
+            except (TypeError, ValueError):
+                similarity = 0.0
+            verdicts.append({
+                "is_paraphrase": bool(item.get("is_paraphrase", False)),
+                "similarity": similarity,
+                "explanation": item.get("explanation", "")
+            })
+        return verdicts
+
     async def extract_key_ideas(self, text: str) -> List[str]:
         """
         Извлечь ключевые идеи
         """
         if not self.api_key:
             return []
-        
+
         prompt = f"""Извлеки 5-7 ключевых идей из текста. Каждая идея - одно предложение.
 
 Текст: {text}
 
 Ответь в JSON: {{"key_ideas": ["идея 1", "идея 2", ...]}}"""
 
+        content = await self._complete(prompt, max_tokens=800)
+        if content is None:
+            return []
+
         try:
-            timeout = aiohttp.ClientTimeout(total=self.timeout)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    self.base_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.3,
-                        "max_tokens": 800
-                    }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        content = data["choices"][0]["message"]["content"]
-                        
-                        try:
-                            start = content.find("{")
-                            end = content.rfind("}") + 1
-                            result = json.loads(content[start:end])
-                            return result.get("key_ideas", [])
-                        except:
-                            return []
-        except Exception as e:
-            logger.error(f"Key ideas error: {e}")
-        
-        return []
+            return self._parse_json(content).get("key_ideas", [])
+        except (ValueError, AttributeError):
+            logger.error("Key ideas: unparseable response")
+            return []
 
 # Singleton
-ai_service = OpenRouterAI()
\ No newline at end of file
+ai_service = OpenRouterAI()
@@ -0,0 +1,399 @@
+"""
+Check pipeline - общий для HTTP-обработчика и воркеров очереди
+"""
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Dict, List, Tuple
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.cache import result_cache, normalize_text, to_normalized_span, to_original_span
+from app.core.singleflight import SingleFlight
+from app.core.progress import progress_hub
+from app.core.writer import GroupWriter
+from app.core.metrics import check_trace, stage
+from app.models import CheckResult, CheckBatch, AsyncSessionLocal, SessionLocal
+from app.services.detector import detector, without_local, DETECTOR_VERSION
+from app.services.fingerprint import FingerprintIndex, fingerprint_index, fingerprints
+from app.services.fingerprint_store import SegmentStore
+from app.services.minhash import MinHashLSH, minhash_index, minhash_signature
+from app.services.similarity import pairwise_similarity
+from app.services import sharding
+from app.services.storage import store_result, upsert_sources, attach_result, result_options, unpack_text
+from app.services.history import record_completed
+
+logger = logging.getLogger(__name__)
+
+check_flight = SingleFlight("check")
+# Все записи пайплайна идут через group commit
+result_writer = GroupWriter("results", AsyncSessionLocal)
+
+
+def _is_truthy(value) -> bool:
+    # ai_powered хранится в строковой колонке
+    return str(value).strip().lower() in ("1", "true")
+
+
+def _to_cache(result_data: Dict, positions: List[int]) -> Dict:
+    # Смещения храним в координатах нормализованного текста, сам фрагмент не храним
+    matches = []
+    for m in result_data.get('matches', []):
+        start, end = to_normalized_span(positions, m['start'], m['end'])
+        matches.append({k: v for k, v in m.items() if k != 'text'} | {'start': start, 'end': end})
+    return {**result_data, 'matches': matches}
+
+
+def _from_cache(cached: Dict, text: str, positions: List[int]) -> Dict:
+    matches = []
+    for m in cached.get('matches', []):
+        start, end = to_original_span(positions, m['start'], m['end'])
+        matches.append({**m, 'start': start, 'end': end, 'text': text[start:end]})
+    return {**cached, 'matches': matches}
+
+
+def _archive_texts(known: Callable[[str], bool], since: Optional[datetime] = None, budget: int = 0) -> List[Tuple[str, List]]:
+    """
+    Отпечатки завершенных проверок из text_data, кроме known; новые первыми, пока сумма в пределах budget
+    (0 - без ограничения). Возвращаются от старых к новым - в порядке вытеснения из архива
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(CheckResult.task_id).filter(CheckResult.status == "completed", CheckResult.text_data.isnot(None))
+        if since is not None:
+            query = query.filter(CheckResult.created_at >= since)
+        task_ids = [task_id for task_id, in query.order_by(CheckResult.created_at.desc()) if not known(task_id)]
+
+        docs, total = [], 0
+        for i in range(0, len(task_ids), 100):
+            page = task_ids[i:i + 100]
+            texts = dict(db.query(CheckResult.task_id, CheckResult.text_data).filter(CheckResult.task_id.in_(page)))
+            for task_id in page:
+                fps = fingerprints(unpack_text(texts.get(task_id)), settings.SHINGLE_SIZE, settings.WINNOW_WINDOW)
+                if budget and docs and total + len(fps) > budget:
+                    return docs[::-1]
+                total += len(fps)
+                docs.append((task_id, fps))
+        return docs[::-1]
+    finally:
+        db.close()
+
+
+def _load_indexes():
+    """Индексы в новых объектах - загрузка идет в потоке, пока процесс уже принимает запросы"""
+    index, minhashes = FingerprintIndex(), MinHashLSH()
+    if settings.CORPUS_DIR:
+        index.load_corpus_dir(settings.CORPUS_DIR)
+    if settings.FINGERPRINT_INDEX_DIR:
+        # Сегменты только отображаются в память: время старта не зависит от размера корпуса
+        index.store = SegmentStore(settings.FINGERPRINT_INDEX_DIR).open()
+
+    # Архив прошлых проверок - из текстов рядом с результатами, последние в пределах ARCHIVE_MAX_FINGERPRINTS
+    for task_id, fps in _archive_texts(index.has_submission, budget=settings.ARCHIVE_MAX_FINGERPRINTS):
+        index.add_submission(task_id, fps)
+    submissions, archived = index.archive_size
+    logger.info(f"✓ Archive: {submissions} submissions, {archived} fingerprints")
+
+    # LSH-индекс восстанавливается из сигнатур, сохраненных рядом с результатами
+    db = SessionLocal()
+    try:
+        rows = db.query(CheckResult.task_id, CheckResult.minhash).filter(CheckResult.minhash.isnot(None))
+        for task_id, signature in rows:
+            minhashes.add(task_id, signature)
+    finally:
+        db.close()
+    return index, minhashes
+
+
+_archive_task: Optional[asyncio.Task] = None
+
+
+async def _sync_archive():
+    """Проверки, завершенные другими процессами (воркеры, другие инстансы API), - в архив этого процесса"""
+    # Проверка завершается позже создания строки: окно - с запасом на очередь и дедлайн задачи
+    lookback = timedelta(seconds=settings.ARCHIVE_SYNC_INTERVAL + settings.JOB_STALE_SECONDS)
+    while True:
+        await asyncio.sleep(settings.ARCHIVE_SYNC_INTERVAL)
+        try:
+            docs = await asyncio.to_thread(_archive_texts, fingerprint_index.has_submission, datetime.utcnow() - lookback)
+            for task_id, fps in docs:
+                fingerprint_index.add_submission(task_id, fps)
+            if docs:
+                logger.info(f"Archive sync: {len(docs)} submissions from other processes")
+        except Exception as e:
+            logger.error(f"❌ Archive sync failed: {e}")
+
+
+async def load_indexes():
+    """Поднять локальные индексы процесса: корпус, архив и сигнатуры прошлых проверок"""
+    global _archive_task
+    index, minhashes = await asyncio.to_thread(_load_indexes)
+    fingerprint_index.adopt(index)
+    minhash_index.adopt(minhashes)
+    logger.info(f"MinHash index: {len(minhash_index)} submissions")
+    if fingerprint_index.store is not None:
+        fingerprint_index.store.start()
+    if settings.ARCHIVE_SYNC_INTERVAL > 0 and (_archive_task is None or _archive_task.done()):
+        _archive_task = asyncio.create_task(_sync_archive())
+
+
+async def close_indexes():
+    """Остановить фоновое обслуживание: сегменты (новые, слияние), синхронизация архива, пул процессов анализа"""
+    global _archive_task
+    if fingerprint_index.store is not None:
+        await fingerprint_index.store.stop()
+    if _archive_task is not None:
+        _archive_task.cancel()
+        await asyncio.gather(_archive_task, return_exceptions=True)
+        _archive_task = None
+    sharding.shutdown()
+
+
+# Короткие тексты для прогрева - по одному на поддерживаемый язык
+_WARMUP_TEXTS = (
+    "The quick brown fox jumps over the lazy dog while the committee reviews the annual report on regional development.",
+    "Студенты подготовили доклад о развитии региона, а комиссия рассмотрела его на заседании в конце учебного года.",
+    "Студенттер аймақтың дамуы туралы баяндама дайындады және комиссия оны оқу жылының соңында қарады.",
+)
+
+
+async def warm_up():
+    """Локальная часть конвейера на коротких текстах: без внешних API и записи в БД"""
+    for text in _WARMUP_TEXTS:
+        _, _, signature = _prepare(text, "fast")
+        _similar(signature)
+        await detector.analyze(text, "fast")
+    pairwise_similarity(list(_WARMUP_TEXTS))
+    # Процессы пула для длинных документов запускаются (spawn + импорты) заранее
+    await sharding.start()
+
+
+async def _analyze(text: str, mode: str, similar: List, positions: List[int], cache_key: str, progress=None, lang: Optional[str] = None) -> Dict:
+    """Анализ без кеша; результат в координатах нормализованного текста (см. _to_cache)"""
+    # Почти-дубликат прошлой проверки: берем ее совпадения вместо повторного анализа
+    previous = None
+    if similar and similar[0][1] >= settings.DEDUP_REUSE_THRESHOLD:
+        async with AsyncSessionLocal() as db:
+            previous = await db.get(CheckResult, similar[0][0], options=result_options())
+            # Результат fast-проверки не заменяет deep
+            # Деградированный результат (без Google/LLM) тоже не переиспользуем
+            if previous is not None and (
+                previous.status != "completed" or previous.degraded
+                or (mode == "deep" and not _is_truthy(previous.ai_powered))
+            ):
+                previous = None
+            if previous is not None:
+                await db.run_sync(attach_result, previous)
+
+    if previous is not None:
+        logger.info(f"Near-duplicate of {previous.task_id} ({similar[0][1]}), reusing its matches")
+        result_data = detector.reuse_analysis(
+            text, previous.matches, previous.sources, google_used=_is_truthy(previous.ai_powered)
+        )
+    else:
+        result_data = await detector.analyze(text, mode, progress=progress, lang=lang)
+
+    cache_form = _to_cache(result_data, positions)
+    # Частичный (сработал дедлайн) или деградированный результат не кешируем:
+    # следующая проверка того же текста после восстановления API получит полный.
+    # Совпадения с локальным индексом в кеш не идут - при попадании они ищутся заново (_resolve)
+    if not result_data.get('partial') and not result_data.get('degraded'):
+        await result_cache.set(cache_key, without_local(cache_form))
+    return {**cache_form, 'reused_from': previous.task_id if previous is not None else None}
+
+
+def _prepare(text: str, mode: str):
+    """Ключ кеша, сигнатура и похожие прошлые проверки - все, что нужно до анализа"""
+    with stage("prepare"):
+        normalized, positions = normalize_text(text)
+        cache_key = result_cache.key(f"{DETECTOR_VERSION}:{mode}:{normalized}")
+        signature = minhash_signature(text)
+    return positions, cache_key, signature
+
+
+def _similar(signature: List[int], task_id: Optional[str] = None) -> List:
+    return [(key, score) for key, score in minhash_index.query(signature) if key != task_id]
+
+
+async def _resolve(
+    text: str, mode: str, positions: List[int], cache_key: str, similar: List, cached: Optional[Dict],
+    progress=None, lang: Optional[str] = None
+) -> Dict:
+    if cached is not None:
+        logger.info("Result cache HIT")
+        # Внешние совпадения - из кеша, локальный индекс - заново: архив мог пополниться
+        # после записи в кеш (в том числе той самой проверкой, что его записала)
+        return await detector.with_local(_from_cache(cached, text, positions), text, lang)
+    # Одинаковые тексты, пришедшие одновременно, анализируются один раз;
+    # промежуточные события получает только первый из них
+    analyzed = await check_flight.do(
+        cache_key, lambda: _analyze(text, mode, similar, positions, cache_key, progress, lang)
+    )
+    return _from_cache(analyzed, text, positions)
+
+
+def _fill(db_result: CheckResult, text: str, result_data: Dict, signature: List[int]):
+    """Метаданные источников пишет вызывающий (upsert_sources) - одним запросом на всю транзакцию"""
+    db_result.status = "completed"
+    db_result.originality = result_data.get('originality', 0)
+    db_result.total_words = len(text.split())
+    db_result.total_chars = len(text)
+    store_result(db_result, text, result_data)
+    db_result.ai_powered = "true" if result_data.get('google_used') else "false"
+    db_result.degraded = result_data.get('degraded')
+    db_result.minhash = signature
+
+
+async def _index(db_result: CheckResult, text: str, signature: List[int]):
+    # Новые проверки сразу доступны как источник для следующих;
+    # отпечатки длинного текста считаются в потоке, в индекс добавляются в event loop
+    fps = None
+    if sharding.sharded(text):
+        fps = await asyncio.to_thread(fingerprints, text, fingerprint_index.k, fingerprint_index.window)
+    detector.index_submission(db_result.task_id, text, fps)
+    minhash_index.add(db_result.task_id, signature)
+
+
+async def run_check(
+    text: str, mode: str, task_id: Optional[str] = None, user_id: Optional[str] = None, lang: Optional[str] = None
+) -> CheckResult:
+    """
+    Выполнить проверку и сохранить результат.
+    Если task_id задан, обновляется существующая строка (задача из очереди).
+    lang - язык, уже определенный при приеме запроса (None - определит детектор).
+    """
+    with check_trace(mode, task_id) as trace:
+        # Тот же текст с точностью до пробелов и регистра - готовый результат из кеша
+        # Длинный текст нормализуется и подписывается в потоке - event loop не ждет
+        if sharding.sharded(text):
+            positions, cache_key, signature = await asyncio.to_thread(_prepare, text, mode)
+        else:
+            positions, cache_key, signature = _prepare(text, mode)
+        cached = await result_cache.get(cache_key)
+        similar = _similar(signature, task_id)
+        progress = None
+        if task_id:
+            async def progress(event: Dict):
+                await progress_hub.publish(task_id, event)
+        result_data = await _resolve(text, mode, positions, cache_key, similar, cached, progress, lang)
+
+        def persist(db: Session) -> CheckResult:
+            row = db.get(CheckResult, task_id) if task_id else None
+            if row is None:
+                row = CheckResult(task_id=task_id or str(uuid.uuid4()), user_id=user_id)
+                db.add(row)
+            _fill(row, text, result_data, signature)
+            upsert_sources(db, result_data.get('sources', []))
+            record_completed(db, [row])
+            return row
+
+        # Проверки, завершившиеся одновременно, пишутся одной транзакцией;
+        # db_write - ожидание своей транзакции вместе с коммитом
+        with stage("db_write"):
+            db_result = await result_writer.write(persist)
+        trace.task_id = db_result.task_id
+
+        await _index(db_result, text, signature)
+    # Подписчики SSE забирают итог из БД одним запросом
+    await progress_hub.publish(db_result.task_id, {
+        'event': 'done', 'task_id': db_result.task_id, 'originality': db_result.originality
+    })
+
+    # Ответ собирается из уже готового результата, без распаковки только что записанного
+    db_result.matches = result_data.get('matches', [])
+    db_result.sources = result_data.get('sources', [])
+    db_result.similar = [{"task_id": key, "similarity": score} for key, score in similar]
+    db_result.reused_from = result_data.get('reused_from')
+    return db_result
+
+
+def _prepare_batch(texts: List[str], mode: str):
+    # CPU-часть пакета одним вызовом в пуле потоков: нормализация, сигнатуры, матрица
+    prepared = [_prepare(text, mode) for text in texts]
+    matrix = pairwise_similarity(texts)
+    return prepared, matrix
+
+
+async def run_batch(
+    texts: List[str], mode: str, names: Optional[List[str]] = None, user_id: Optional[str] = None,
+    langs: Optional[List[str]] = None
+) -> CheckBatch:
+    """
+    Пакетная проверка: один проход подготовки, один запрос к кешу на весь пакет,
+    ограниченный параллелизм анализа и одна запись всех результатов.
+    """
+    prepared, matrix = await asyncio.to_thread(_prepare_batch, texts, mode)
+    cached_all = await result_cache.get_many([cache_key for _, cache_key, _ in prepared])
+    similar_all = [_similar(signature) for _, _, signature in prepared]
+
+    semaphore = asyncio.Semaphore(max(1, settings.BATCH_CONCURRENCY))
+
+    async def resolve(i: int) -> Dict:
+        positions, cache_key, _ = prepared[i]
+        async with semaphore:
+            # Своя трасса на элемент; общая запись пакета в нее не входит
+            with check_trace(mode):
+                return await _resolve(
+                    texts[i], mode, positions, cache_key, similar_all[i], cached_all[i], lang=langs[i] if langs else None
+                )
+
+    results = await asyncio.gather(*(resolve(i) for i in range(len(texts))), return_exceptions=True)
+
+    rows = []
+    for text, (_, _, signature), result_data in zip(texts, prepared, results):
+        row = CheckResult(task_id=str(uuid.uuid4()), user_id=user_id)
+        if isinstance(result_data, BaseException):
+            logger.error(f"Batch item failed: {result_data}", exc_info=result_data)
+            row.status = "failed"
+            row.total_words = len(text.split())
+            row.total_chars = len(text)
+        else:
+            _fill(row, text, result_data, signature)
+        rows.append(row)
+
+    batch = CheckBatch(
+        batch_id=str(uuid.uuid4()),
+        mode=mode,
+        task_ids=[row.task_id for row in rows],
+        names=names,
+        matrix=matrix,
+        user_id=user_id
+    )
+    sources = [s for r in results if not isinstance(r, BaseException) for s in r.get('sources', [])]
+
+    def persist(db: Session):
+        # Все строки пакета - одним INSERT (executemany) в общей транзакции
+        upsert_sources(db, sources)
+        record_completed(db, rows)
+        db.add_all(rows + [batch])
+
+    await result_writer.write(persist)
+
+    for text, (_, _, signature), row in zip(texts, prepared, rows):
+        if row.status == "completed":
+            await _index(row, text, signature)
+
+    logger.info(f"✓ Batch {batch.batch_id}: {len(rows)} items, {sum(r.status == 'failed' for r in rows)} failed")
+    return batch
+
+
+async def enqueue_batch(texts: List[str], mode: str, names: Optional[List[str]] = None, user_id: Optional[str] = None):
+    """Режим очереди: строки pending и пакет пишутся одной транзакцией, анализ - в воркерах"""
+    rows = [
+        CheckResult(
+            task_id=str(uuid.uuid4()), status="pending", user_id=user_id,
+            total_words=len(text.split()), total_chars=len(text)
+        )
+        for text in texts
+    ]
+    batch = CheckBatch(
+        batch_id=str(uuid.uuid4()),
+        mode=mode,
+        task_ids=[row.task_id for row in rows],
+        names=names,
+        matrix=await asyncio.to_thread(pairwise_similarity, texts),
+        user_id=user_id
+    )
+    await result_writer.write(lambda db: db.add_all(rows + [batch]))
+    return batch, rows
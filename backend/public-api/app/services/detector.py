@@ -1,99 +1,400 @@
 ﻿# -*- coding: utf-8 -*-
 """Plagiarism Detection - Google Search Integration"""
 import re
-from typing import List, Dict
+import time
+import heapq
+import asyncio
+import contextvars
+from collections import OrderedDict
+from bisect import bisect_right
+from typing import List, Dict, Optional, Callable, Awaitable, Tuple
 import logging
 from urllib.parse import quote
 
+import httpx
+
+from app.core.singleflight import SingleFlight
+from app.core.breaker import CircuitBreaker, CLOSED
+from app.core.ratelimit import google_limiter, priority, LOW
+from app.core.metrics import stage, external_call, DEGRADED_CHECKS
+from app.services.fingerprint import fingerprint_index, fingerprints, merge_spans, stable_id
+from app.services.similarity import triage
+from app.services.segmenter import Span, split_sentences
+from app.services import sharding
+from app.services.planner import query_budget, score_sentences, converged
+from app.services.language import detect_language
+from app.services.ai import ai_service
+
 logger = logging.getLogger(__name__)
 
+# Меняется при любом изменении логики анализа - старые кеши результатов становятся невалидными
+DETECTOR_VERSION = "2.6"
+
+search_flight = SingleFlight("google")
+
+
+def originality_score(matches: List[Dict], total_chars: int, searched: bool = False) -> float:
+    """
+    100 минус взвешенное покрытие текста совпадениями: каждый символ - с наибольшей similarity
+    среди покрывающих его совпадений (перекрытия не считаются дважды).
+    searched - был внешний поиск: "ничего не найдено" дает 95, а не 100.
+    """
+    if not matches:
+        return 95.0 if searched else 100.0
+    spans = sorted((m['start'], m['end'], m['similarity']) for m in matches)
+    weighted, heap, i, pos = 0.0, [], 0, spans[0][0]
+    while i < len(spans) or heap:
+        if not heap:
+            pos = max(pos, spans[i][0])
+        while i < len(spans) and spans[i][0] <= pos:
+            heapq.heappush(heap, (-spans[i][2], spans[i][1]))
+            i += 1
+        while heap and heap[0][1] <= pos:
+            heapq.heappop(heap)
+        if not heap:
+            continue
+        similarity, end = -heap[0][0], heap[0][1]
+        step = min(end, spans[i][0]) if i < len(spans) else end
+        weighted += (step - pos) * similarity
+        pos = step
+    return max(0, min(100, round(100 - (weighted / max(total_chars, 1) * 100), 2)))
+
+
+def without_local(result: Dict) -> Dict:
+    """Результат без совпадений с локальным индексом - так он хранится в кеше результатов"""
+    local_ids = {m['source_id'] for m in result['matches'] if m.get('type') == 'local_fingerprint'}
+    return {
+        **result,
+        'matches': [m for m in result['matches'] if m.get('type') != 'local_fingerprint'],
+        'sources': [s for s in result['sources'] if s['id'] not in local_ids],
+    }
+
+
+class SearchUnavailable(Exception):
+    """Google не ответил: ошибка, исчерпана квота или разомкнут breaker"""
+
+
 class GooglePlagiarismDetector:
     
     def __init__(self):
         from app.core.config import settings
         
+        self.search_url = settings.GOOGLE_SEARCH_URL
         self.google_api_key = settings.GOOGLE_SEARCH_API_KEY
         self.google_cx = settings.GOOGLE_SEARCH_CX
+        self.search_timeout = settings.GOOGLE_SEARCH_TIMEOUT
+        self.concurrency = max(1, settings.GOOGLE_SEARCH_CONCURRENCY)
+        self.deadline = settings.CHECK_DEADLINE_SECONDS
+        self.breaker = CircuitBreaker("google")
+        self.refresh_max = max(0, settings.SEARCH_REFRESH_MAX)
+        
+        # Один пул соединений на процесс, создается при первом запросе
+        self._client: Optional[httpx.AsyncClient] = None
+        # Запросы, отданные из устаревшего кеша, - обновляются в фоне после восстановления Google
+        self._stale_queries: "OrderedDict[str, None]" = OrderedDict()
+        self._refresher: Optional[asyncio.Task] = None
+        self._probe_lock = asyncio.Lock()
         
         logger.info("=" * 60)
         logger.info("DETECTOR INIT")
         logger.info(f"API Key: {bool(self.google_api_key)}")
         logger.info(f"CX: {self.google_cx}")
+        logger.info(f"Concurrency: {self.concurrency}, deadline: {self.deadline}s")
         logger.info("=" * 60)
     
-    def analyze(self, text: str, mode: str = "fast") -> Dict:
-        logger.info(f"analyze() mode={mode}, len={len(text)}")
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.search_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.concurrency * 4,
+                    max_keepalive_connections=self.concurrency * 2
+                )
+            )
+        return self._client
+    
+    async def aclose(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def analyze(
+        self, text: str, mode: str = "fast", tier: str = None,
+        progress: Optional[Callable[[Dict], Awaitable[None]]] = None, lang: Optional[str] = None
+    ) -> Dict:
+        """
+        progress - необязательный callback для промежуточных событий (SSE);
+        lang - язык, если уже определен при приеме запроса (сегментация и отбор запросов)
+        """
+        if lang is None:
+            with stage("language"):
+                lang = detect_language(text)
+        logger.info(f"analyze() mode={mode}, lang={lang}, len={len(text)}")
+        use_google = bool(mode == "deep" and self.google_api_key and self.google_cx)
         
-        if mode == "deep" and self.google_api_key and self.google_cx:
+        # Первый проход всегда по локальному индексу - без внешних запросов
+        local, prepared = await self._local_pass(text, lang, use_google)
+        await self._notify(progress, {
+            'event': 'progress', 'stage': 'local',
+            'matches': local['matches'], 'sources': local['sources']
+        })
+        
+        if use_google:
             logger.info("Using Google Search")
-            return self._google_search_analysis(text)
+            boundaries = prepared.boundaries if prepared is not None else None
+            return await self._google_search_analysis(text, local, tier, progress, lang, boundaries)
         else:
-            return self._fast_mock_analysis(text)
+            return local
+    
+    async def _local_pass(self, text: str, lang: Optional[str], with_boundaries: bool) -> Tuple[Dict, Optional[sharding.Prepared]]:
+        """
+        Поиск по локальному индексу. Длинный документ: отпечатки, поиск по сегментам и границы предложений
+        считаются по кускам в пуле процессов, слияние с индексом в памяти - в потоке, event loop не блокируется
+        """
+        if not sharding.sharded(text):
+            return self._local_index_analysis(text), None
+        with stage("shards"):
+            prepared = await sharding.prepare(text, lang, with_boundaries)
+        return await asyncio.to_thread(self._local_index_analysis, text, prepared), prepared
+    
+    async def with_local(self, result: Dict, text: str, lang: Optional[str] = None) -> Dict:
+        """
+        Результат из кеша (без локальных совпадений, см. without_local) + свежий поиск по локальному индексу:
+        архив пополняется каждой проверкой, повторно присланный текст должен найти и предыдущую
+        """
+        local, _ = await self._local_pass(text, lang, False)
+        matches = local['matches'] + result['matches']
+        sources = {s['id']: s for s in local['sources']}
+        for s in result['sources']:
+            sources.setdefault(s['id'], s)
+        originality = originality_score(matches, len(text), searched=bool(result.get('google_used')))
+        logger.info(f"Cached result + local index: {len(local['matches'])} local matches, originality={originality}%")
+        return {
+            **result,
+            'originality': originality,
+            'matches': matches,
+            'sources': sorted(sources.values(), key=lambda x: x['match_count'], reverse=True),
+        }
+    
+    async def _notify(self, progress, event: Dict):
+        if progress is None:
+            return
+        try:
+            await progress(event)
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {e}")
+    
+    def index_submission(self, task_id: str, text: str, fps: Optional[List] = None):
+        """Добавить завершенную проверку в локальный архив; fps - ее отпечатки, если уже посчитаны"""
+        if fps is None:
+            fps = fingerprints(text, fingerprint_index.k, fingerprint_index.window)
+        fingerprint_index.add_submission(task_id, fps)
+    
+    def reuse_analysis(self, text: str, previous_matches: List[Dict], previous_sources: List[Dict], google_used: bool = False) -> Dict:
+        """
+        Почти-дубликат прошлой проверки: переносим ее внешние совпадения
+        на новый текст вместо повторных запросов к Google.
+        """
+        local = self._local_index_analysis(text)
+        
+        matches = list(local['matches'])
+        sources_dict = {s['id']: dict(s) for s in local['sources']}
+        previous_sources = {s['id']: s for s in previous_sources or []}
+        
+        for m in previous_matches or []:
+            if m.get('type') == 'local_fingerprint':
+                continue
+            # Ищем рядом со старой позицией, чтобы повторяющиеся предложения не слипались
+            start = text.find(m['text'], max(0, m['start'] - 200))
+            if start < 0:
+                start = text.find(m['text'])
+            if start < 0:
+                continue
+            matches.append({**m, 'start': start, 'end': start + len(m['text'])})
+            
+            source_id = m['source_id']
+            if source_id not in sources_dict and source_id in previous_sources:
+                sources_dict[source_id] = {**previous_sources[source_id], 'match_count': 0}
+            if source_id in sources_dict:
+                sources_dict[source_id]['match_count'] += 1
+        
+        originality = originality_score(matches, len(text), google_used)
+        
+        logger.info(f"Reused {len(matches) - len(local['matches'])} matches, originality={originality}%")
+        
+        return {
+            'originality': originality,
+            'matches': matches,
+            'sources': sorted(sources_dict.values(), key=lambda x: x['match_count'], reverse=True),
+            'google_used': google_used,
+            'mode': 'reuse'
+        }
     
-    def _fast_mock_analysis(self, text: str) -> Dict:
-        originality = 92.0
+    def _local_index_analysis(self, text: str, prepared: Optional[sharding.Prepared] = None) -> Dict:
+        with stage("local_index"):
+            if prepared is not None:
+                found = fingerprint_index.search(text, prepared.fingerprints, prepared.store_hits)
+            else:
+                found = fingerprint_index.search(text)
+        matches = found['matches']
+        
+        # Совпадения с разными документами могут перекрываться - считается объединение
+        originality = originality_score(matches, len(text))
+        
+        logger.info(f"Local index: {found['matched']}/{found['fingerprints']} fingerprints, originality={originality}%")
+        
         return {
             'originality': originality,
-            'matches': [],
-            'sources': [],
+            'matches': matches,
+            'sources': found['sources'],
             'google_used': False,
             'mode': 'fast'
         }
     
-    def _google_search_analysis(self, text: str) -> Dict:
-        from app.core.cache import get_cached_google_search, cache_google_search
+    async def _google_search_analysis(
+        self, text: str, local: Dict, tier: str = None, progress=None, lang: Optional[str] = None,
+        boundaries: Optional[List[int]] = None
+    ) -> Dict:
+        from app.core.cache import get_stale_google_searches
         
         logger.info("Google Search analysis...")
         
         total_chars = len(text)
-        sentences = self._split_sentences(text)
+        sentences = self._split_sentences(text, lang, boundaries)
         
         logger.info(f"Sentences: {len(sentences)}")
         
         if not sentences:
-            return {
-                'originality': 100.0,
-                'matches': [],
-                'sources': [],
-                'google_used': False
-            }
+            return local
         
-        matches = []
-        sources_dict = {}
+        # Предложения, уже найденные в локальном индексе, не отправляем в Google
+        local_spans = merge_spans([(m['start'], m['end']) for m in local['matches']])
         
-        for i, sentence in enumerate(sentences[:5], 1):
-            if len(sentence) < 50:
-                continue
-            
-            # Логируем первые 50 символов
-            preview = sentence[:50] if len(sentence) > 50 else sentence
+        local_ends = [e for _, e in local_spans]
+        
+        def covered_locally(span: Span) -> bool:
+            overlap = 0
+            for s, e in local_spans[bisect_right(local_ends, span.start):]:
+                if s >= span.end:
+                    break
+                overlap += min(span.end, e) - max(span.start, s)
+            return overlap >= len(span.text) / 2
+        
+        candidates = [s for s in sentences if len(s.text) >= 50 and not covered_locally(s)]
+        if sharding.sharded(text):
+            scored = await asyncio.to_thread(score_sentences, candidates, lang)
+        else:
+            scored = score_sentences(candidates, lang)
+        ranked = [span for _, span in scored]
+        budget = query_budget(len(text.split()), tier)
+        
+        # Запросы, уже лежащие в кеше, бюджет не расходуют;
+        # пока Google недоступен, в дело идет и устаревший кеш.
+        # Кеш всех кандидатов - одним MGET; прочитанное передается в поиск, второй раз кеш не читается
+        search_down = not self.breaker.available()
+        lookups = ranked[:budget * 3]
+        stored = dict(zip(lookups, await get_stale_google_searches([span.text for span in lookups])))
+        cached, plan = [], []
+        for span in lookups:
+            results, fresh = stored[span]
+            if results and (fresh or search_down):
+                cached.append(span)
+            elif len(plan) < budget:
+                plan.append(span)
+        queue = cached + plan
+        
+        logger.info(f"Query plan: {len(plan)}/{budget} paid + {len(cached)} cached of {len(candidates)} candidates")
+        await self._notify(progress, {'event': 'progress', 'stage': 'plan', 'planned': len(queue)})
+        
+        async def search(i: int, span: Span) -> Tuple[List[Dict], str]:
             logger.info(f"Sentence {i}: checking...")
+            results, origin = await self._search_in_google(span.text, stored[span])
+            logger.info(f"Sentence {i}: found {len(results)} results ({origin})")
+            return results, origin
+        
+        # Не больше self.concurrency запросов одновременно; новые запускаются,
+        # пока доля предложений с находками не стабилизируется
+        started = time.monotonic()
+        tasks = {}
+        pending = set()
+        finished = checked = hits = 0
+        stop = False
+        
+        def launch():
+            while not stop and len(pending) < self.concurrency and len(tasks) < len(queue):
+                span = queue[len(tasks)]
+                task = asyncio.create_task(search(len(tasks) + 1, span))
+                tasks[task] = span
+                pending.add(task)
+        
+        launch()
+        while pending:
+            timeout = self.deadline - (time.monotonic() - started)
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                results, origin = task.result()
+                finished += 1
+                # Без ответа Google предложение не проверено - в оценку сходимости не идет
+                if origin != "unavailable":
+                    checked += 1
+                    hits += bool(results)
+                await self._notify(progress, self._query_event(tasks[task], results, finished, len(queue)))
+            if not stop and converged(hits, checked):
+                stop = True
+                logger.info(f"Converged after {checked} queries ({hits} with results)")
+            launch()
+        
+        # По дедлайну отдаем то, что успели найти
+        partial = bool(pending)
+        if pending:
+            logger.warning(f"Deadline {self.deadline}s: {len(pending)}/{len(tasks)} queries cancelled")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        matches = list(local['matches'])
+        sources_dict = {s['id']: dict(s) for s in local['sources']}
+        
+        found = []
+        origins = {"fresh": 0, "stale": 0, "unavailable": 0}
+        for task, span in tasks.items():
+            if task.cancelled() or not task.done():
+                continue
+            results, origin = task.result()
+            origins[origin] += 1
+            found.extend((span, result) for result in results)
+        
+        await self._notify(progress, {'event': 'progress', 'stage': 'verify', 'candidates': len(found)})
+        verified, ai_unverified, ai_out_of_time = await self._verify_results(found, started)
+        # Сверка LLM не уложилась в дедлайн - результат тоже неполный
+        partial = partial or ai_out_of_time
+        degraded = self._degradation(partial, origins["stale"], origins["unavailable"], ai_unverified, ai_out_of_time)
+        for span, result, similarity, match_type in verified:
+            matches.append({
+                'start': span.start,
+                'end': span.end,
+                'text': span.text,
+                'source_id': result['source_id'],
+                'similarity': similarity,
+                'type': match_type
+            })
             
-            results = self._search_in_google(sentence)
-            
-            logger.info(f"Found {len(results)} results")
-            
-            if results:
-                for result in results:
-                    matches.append({
-                        'start': text.find(sentence),
-                        'end': text.find(sentence) + len(sentence),
-                        'text': sentence,
-                        'source_id': result['source_id'],
-                        'similarity': result['similarity'],
-                        'type': 'google_exact'
-                    })
-                    
-                    source_id = result['source_id']
-                    if source_id not in sources_dict:
-                        sources_dict[source_id] = {
-                            'id': source_id,
-                            'title': result['title'],
-                            'url': result['url'],
-                            'domain': result['domain'],
-                            'match_count': 0
-                        }
-                    sources_dict[source_id]['match_count'] += 1
+            source_id = result['source_id']
+            if source_id not in sources_dict:
+                sources_dict[source_id] = {
+                    'id': source_id,
+                    'title': result['title'],
+                    'url': result['url'],
+                    'domain': result['domain'],
+                    'match_count': 0
+                }
+            sources_dict[source_id]['match_count'] += 1
         
         if matches:
             unique = {}
@@ -103,13 +404,16 @@ class GooglePlagiarismDetector:
                     unique[key] = m
             
             matches = list(unique.values())
-            weighted = sum((m['end'] - m['start']) * m['similarity'] for m in matches)
-            originality = max(0, min(100, round(100 - (weighted / total_chars * 100), 2)))
+            originality = originality_score(matches, total_chars)
             
             logger.info(f"Matches: {len(matches)}, originality={originality}%")
+        elif origins["unavailable"]:
+            # Google не ответил - "ничего не найдено" не доказано, остается оценка локального индекса
+            originality = local['originality']
+            logger.warning(f"No matches, search unavailable: local originality={originality}%")
         else:
-            originality = 95.0
-            logger.info("No matches, originality=95%")
+            originality = originality_score(matches, total_chars, searched=True)
+            logger.info(f"No matches, originality={originality}%")
         
         sources = list(sources_dict.values())
         
@@ -118,33 +422,205 @@ class GooglePlagiarismDetector:
             'matches': matches,
             'sources': sorted(sources, key=lambda x: x['match_count'], reverse=True),
             'google_used': True,
+            'partial': partial,
+            'degraded': degraded,
+            'queries': len(tasks),
             'mode': 'deep'
         }
     
-    def _split_sentences(self, text: str) -> List[str]:
-        parts = text.replace('?', '.').replace('!', '.').split('.')
-        sentences = [s.strip() for s in parts if len(s.strip()) > 40]
+    @staticmethod
+    def _degradation(
+        partial: bool, stale: int, unavailable: int, ai_unverified: int, ai_out_of_time: bool = False
+    ) -> Optional[Dict]:
+        """
+        None для полноценного результата, иначе - что именно пошло не так.
+        ai_out_of_time - пары остались без вердикта LLM из-за дедлайна (причина deadline, а не ai_unavailable)
+        """
+        reasons = [reason for reason, count in (
+            ("deadline", partial),
+            ("search_stale", stale),
+            ("search_unavailable", unavailable),
+            ("ai_unavailable", ai_unverified and not ai_out_of_time),
+        ) if count]
+        if not reasons:
+            return None
+        for reason in reasons:
+            DEGRADED_CHECKS.labels(reason).inc()
+        logger.warning(f"Degraded result: {', '.join(reasons)}")
+        return {
+            'reasons': reasons,
+            'stale_queries': stale,
+            'skipped_queries': unavailable,
+            'ai_unverified': ai_unverified
+        }
+    
+    def _query_event(self, span: Span, results: List[Dict], checked: int, planned: int) -> Dict:
+        # Предварительные совпадения (оценка Google, до сверки сниппетов) - итог придет в финальном результате
+        return {
+            'event': 'progress',
+            'stage': 'query',
+            'checked': checked,
+            'planned': planned,
+            'matches': [{
+                'start': span.start,
+                'end': span.end,
+                'text': span.text,
+                'source_id': r['source_id'],
+                'similarity': r['similarity'],
+                'type': 'candidate'
+            } for r in results],
+            'sources': [{
+                'id': r['source_id'], 'title': r['title'], 'url': r['url'], 'domain': r['domain']
+            } for r in results]
+        }
+    
+    async def _verify_results(self, found: List, started: float) -> Tuple[List, int, bool]:
+        """
+        Сверить предложение со сниппетом каждого результата Google.
+        Близкие пары засчитываются сразу, далекие отбрасываются,
+        в LLM уходят только пары из серой зоны.
+        Возвращает ([(span, result, similarity, type)], пар без вердикта LLM, не уложился ли LLM в дедлайн проверки).
+        """
+        verified = []
+        # Старые записи кеша без сниппета - как раньше, по оценке Google
+        with_snippet = []
+        for span, result in found:
+            if result.get('snippet'):
+                with_snippet.append((span, result))
+            else:
+                verified.append((span, result, result['similarity'], 'google_exact'))
+        
+        with stage("triage"):
+            groups = triage([(span.text, result['snippet']) for span, result in with_snippet])
+        
+        for i, score in groups['related']:
+            span, result = with_snippet[i]
+            verified.append((span, result, round(min(score, 1.0), 4), 'google_exact'))
+        
+        ambiguous = groups['ambiguous']
+        if not ambiguous:
+            return verified, 0, False
+        
+        if not ai_service.api_key:
+            for i, score in ambiguous:
+                span, result = with_snippet[i]
+                verified.append((span, result, round(score, 4), 'google_partial'))
+            return verified, 0, False
+        
+        pairs = [(with_snippet[i][0].text, with_snippet[i][1]['snippet']) for i, _ in ambiguous]
+        # LLM ждем не дольше остатка дедлайна проверки; дедлайн вышел - не вызываем вовсе
+        remaining = self.deadline - (time.monotonic() - started)
+        out_of_time = remaining <= 0
+        if out_of_time:
+            logger.warning(f"Deadline {self.deadline}s: AI verification skipped, using local scores")
+            verdicts = [None] * len(pairs)
+        else:
+            try:
+                verdicts = await asyncio.wait_for(
+                    ai_service.detect_paraphrase_batch(pairs), timeout=min(remaining, ai_service.timeout)
+                )
+            except asyncio.TimeoutError:
+                logger.warning("AI verification timed out, using local scores")
+                verdicts = [None] * len(pairs)
+                out_of_time = remaining <= ai_service.timeout
+        
+        unverified = 0
+        for (i, score), verdict in zip(ambiguous, verdicts):
+            span, result = with_snippet[i]
+            # LLM недоступен - пара остается с локальной оценкой, а не отбрасывается
+            if verdict is None or verdict.get('unavailable'):
+                unverified += 1
+                verified.append((span, result, round(score, 4), 'google_partial'))
+            elif verdict.get('is_paraphrase'):
+                verified.append((span, result, round(float(verdict.get('similarity') or score), 4), 'semantic_ai'))
+        
+        return verified, unverified, out_of_time
+    
+    def _split_sentences(self, text: str, lang: Optional[str] = None, boundaries: Optional[List[int]] = None) -> List[Span]:
+        with stage("segmentation"):
+            sentences = split_sentences(text, min_length=40, lang=lang, boundaries=boundaries)
         
         if not sentences and len(text.strip()) > 40:
-            sentences = [text.strip()]
+            start = len(text) - len(text.lstrip())
+            sentences = [Span(start, start + len(text.strip()), text.strip())]
         
         logger.info(f"Split into {len(sentences)} sentences")
         
         return sentences
     
-    def _search_in_google(self, query: str) -> List[Dict]:
-        from app.core.cache import get_cached_google_search, cache_google_search
-        
-        cached = get_cached_google_search(query)
+    async def _search_in_google(self, query: str, stored: Tuple[Optional[List[Dict]], bool]) -> Tuple[List[Dict], str]:
+        """
+        (результаты, происхождение): fresh - свежий кеш или ответ Google,
+        stale - устаревший кеш при недоступном Google, unavailable - ответа нет.
+        stored - (результаты, свежие ли) из кеша, прочитанные при планировании запросов
+        """
+        cached, fresh = stored
         if cached:
-            logger.info("Cache HIT")
-            return cached
+            # Старые записи кеша - с id от hash() (разный в каждом процессе)
+            cached = [{**r, 'source_id': stable_id(r['url'])} if r.get('url') else r for r in cached]
+            if fresh:
+                logger.info("Cache HIT")
+                return cached, "fresh"
+        
+        try:
+            # Одинаковые запросы из параллельных проверок уходят в Google один раз
+            return await search_flight.do(query, lambda: self._guarded_fetch(query)), "fresh"
+        except SearchUnavailable as e:
+            if not cached:
+                logger.warning(f"Search unavailable ({e}), no cached results")
+                return [], "unavailable"
+            logger.warning(f"Search unavailable ({e}), serving stale cache")
+            self._remember_stale(query)
+            return cached, "stale"
+    
+    def _remember_stale(self, query: str):
+        self._stale_queries[query] = None
+        self._stale_queries.move_to_end(query)
+        # При долгом простое помним только последние запросы
+        while len(self._stale_queries) > self.refresh_max:
+            self._stale_queries.popitem(last=False)
+    
+    def _start_refresh(self):
+        if not self._stale_queries or (self._refresher is not None and not self._refresher.done()):
+            return
+        # Пустой контекст: фоновые запросы не пишутся в трассу проверки, которая их запустила
+        self._refresher = asyncio.create_task(self._refresh_stale(), context=contextvars.Context())
+    
+    async def _refresh_stale(self):
+        """Обновить устаревшие записи кеша по одной, пока Google отвечает"""
+        refreshed = 0
+        # Низший приоритет: квоту под конец суток оставляем проверкам
+        with priority(LOW):
+            while self._stale_queries and self.breaker.available():
+                query, _ = self._stale_queries.popitem(last=False)
+                try:
+                    await search_flight.do(query, lambda: self._guarded_fetch(query))
+                    refreshed += 1
+                except SearchUnavailable:
+                    # Снова недоступен (или нет квоты) - запрос вернется в работу после следующего восстановления
+                    self._remember_stale(query)
+                    break
+        logger.info(f"Stale search cache: {refreshed} refreshed, {len(self._stale_queries)} left")
+    
+    async def _guarded_fetch(self, query: str) -> List[Dict]:
+        if self.breaker.state != CLOSED:
+            # Пробный запрос half-open - один; параллельные запросы ждут его итога, а не получают отказ
+            async with self._probe_lock:
+                if self.breaker.state != CLOSED:
+                    return await self._fetch_google(query)
+        return await self._fetch_google(query)
+    
+    async def _fetch_google(self, query: str) -> List[Dict]:
+        """Результаты Google (с записью в кеш) или SearchUnavailable"""
+        from app.core.cache import cache_google_search
+        
+        if not self.breaker.allow():
+            raise SearchUnavailable("circuit open")
+        # Общий на все процессы лимит Google: ждем токен в очереди по приоритету
+        if not await google_limiter.acquire():
+            raise SearchUnavailable("rate limited")
         
         try:
-            import httpx
-            
-            url = "https://www.googleapis.com/customsearch/v1"
-            
             # Обрезаем запрос до 150 символов
             search_query = query[:150]
             
@@ -158,14 +634,31 @@ class GooglePlagiarismDetector:
             logger.info("Google API call...")
             
             # httpx автоматически кодирует UTF-8
-            response = httpx.get(url, params=params, timeout=15)
+            try:
+                with stage("search"):
+                    response = await self._get_client().get(self.search_url, params=params)
+            except Exception as e:
+                external_call("google", "error")
+                self.breaker.record_failure(reason=type(e).__name__)
+                raise SearchUnavailable(f"{type(e).__name__}: {e}")
+            external_call("google", "ok" if response.status_code == 200 else f"http_{response.status_code}")
             
             logger.info(f"HTTP {response.status_code}")
             
             if response.status_code != 200:
                 logger.error(f"Error: {response.text[:200]}")
+                if response.status_code in (403, 429) or response.status_code >= 500:
+                    # 429 и 403 с dailyLimitExceeded/quotaExceeded - квота: размыкаем сразу
+                    body = response.text.lower()
+                    quota = response.status_code == 429 or "limit" in body or "quota" in body
+                    self.breaker.record_failure(trip=quota, reason=f"HTTP {response.status_code}")
+                    raise SearchUnavailable(f"HTTP {response.status_code}")
                 return []
             
+            self.breaker.record_success()
+            # Google отвечает - можно обновлять то, что отдавалось из устаревшего кеша
+            self._start_refresh()
+            
             data = response.json()
             
             if 'items' not in data:
@@ -177,23 +670,27 @@ class GooglePlagiarismDetector:
             
             results = [
                 {
-                    'source_id': hash(item['link']) % 100000,
+                    # Один id для URL во всех процессах - ключ общей таблицы sources
+                    'source_id': stable_id(item['link']),
                     'title': item.get('title', 'Untitled')[:200],
                     'url': item.get('link', ''),
                     'domain': item.get('displayLink', 'unknown'),
+                    'snippet': item.get('snippet', ''),
                     'similarity': 0.95
                 }
                 for item in data['items']
             ]
             
-            cache_google_search(query, results)
+            await cache_google_search(query, results)
             
             logger.info(f"Found {len(results)} sources")
             
             return results
             
+        except SearchUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Exception: {e}")
             return []
 
-detector = GooglePlagiarismDetector()
\ No newline at end of file
+detector = GooglePlagiarismDetector()
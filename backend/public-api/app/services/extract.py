@@ -0,0 +1,293 @@
+"""
+Document text extraction - генераторы фрагментов (страница / абзац)
+Файл читается с диска по частям, целиком в память не загружается
+"""
+import codecs
+import io
+import re
+import shutil
+import tempfile
+import zipfile
+import logging
+from typing import BinaryIO, Iterator, List, Tuple
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class UnsupportedDocument(ValueError):
+    """Файл не удалось разобрать как документ заявленного типа"""
+
+
+class DocumentTooLarge(UnsupportedDocument):
+    """Файл или извлеченный из него текст больше лимита"""
+
+
+def extract_segments(file: BinaryIO, file_type: str) -> Iterator[str]:
+    file_type = file_type.lower().lstrip(".")
+    extractors = {
+        "txt": _extract_txt,
+        "docx": _extract_docx,
+        "rtf": _extract_rtf,
+        "pdf": _extract_pdf,
+    }
+    if file_type not in extractors:
+        raise UnsupportedDocument(f"Unsupported file type: {file_type}")
+    file.seek(0)
+    for segment in extractors[file_type](file):
+        segment = segment.strip()
+        if segment:
+            yield segment
+
+
+def _extract_txt(file: BinaryIO) -> Iterator[str]:
+    # BOM определяет utf-16; иначе utf-8 с заменой битых байтов
+    head = file.read(4)
+    encoding = "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    file.seek(0)
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    buffer = ""
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer += decoder.decode(chunk, final=not chunk)
+        # Отдаем готовые абзацы, хвост остается в буфере
+        *paragraphs, buffer = re.split(r"\n\s*\n", buffer)
+        yield from paragraphs
+        # Текст без пустых строк - режем по последнему переводу строки, чтобы буфер не рос
+        if len(buffer) > CHUNK_SIZE * 16:
+            cut = buffer.rfind("\n")
+            if cut > 0:
+                yield buffer[:cut]
+                buffer = buffer[cut + 1:]
+        if not chunk:
+            break
+    yield buffer
+
+
+def _extract_docx(file: BinaryIO) -> Iterator[str]:
+    try:
+        archive = zipfile.ZipFile(file)
+        document = archive.open("word/document.xml")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise UnsupportedDocument(f"Invalid DOCX: {e}")
+
+    # Потоковый разбор XML: абзац за абзацем, обработанные элементы освобождаются
+    with archive, document:
+        parts = []
+        try:
+            for event, element in ElementTree.iterparse(document, events=("end",)):
+                if element.tag == _W_NS + "t" and element.text:
+                    parts.append(element.text)
+                elif element.tag == _W_NS + "tab":
+                    parts.append("\t")
+                elif element.tag in (_W_NS + "br", _W_NS + "cr"):
+                    parts.append("\n")
+                elif element.tag == _W_NS + "p":
+                    yield "".join(parts)
+                    parts = []
+                    element.clear()
+        except ElementTree.ParseError as e:
+            raise UnsupportedDocument(f"Invalid DOCX: {e}")
+        if parts:
+            yield "".join(parts)
+
+
+# Группы RTF, содержимое которых не является текстом документа
+_RTF_SKIP = {
+    "fonttbl", "colortbl", "stylesheet", "info", "pict", "object", "header", "footer",
+    "headerl", "headerr", "footerl", "footerr", "listtable", "listoverridetable",
+    "rsidtbl", "generator", "xmlnstbl", "themedata", "colorschememapping", "latentstyles",
+    "datastore", "fldinst",
+}
+_RTF_BREAKS = {"par": "\n\n", "line": "\n", "tab": "\t", "page": "\n\n", "sect": "\n\n", "cell": "\t", "row": "\n"}
+
+
+def _rtf_chars(file: BinaryIO) -> Iterator[str]:
+    # RTF - 7-битный ASCII, не-ASCII символы закодированы управляющими словами
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield from chunk.decode("latin-1")
+
+
+def _extract_rtf(file: BinaryIO) -> Iterator[str]:
+    """Минимальный потоковый парсер RTF: текст, \\par, \\'hh, \\uN"""
+    chars = _rtf_chars(file)
+    codepage = "cp1252"
+    stack = []
+    skip = False
+    uc = 1
+    pending_skip = 0
+    out = []
+    hex_bytes = bytearray()
+
+    def flush_hex():
+        if hex_bytes:
+            out.append(hex_bytes.decode(codepage, errors="replace"))
+            hex_bytes.clear()
+
+    ch = next(chars, None)
+    if ch != "{":
+        raise UnsupportedDocument("Invalid RTF: missing header")
+
+    while ch is not None:
+        if ch == "{":
+            flush_hex()
+            stack.append((skip, uc))
+            ch = next(chars, None)
+            continue
+        if ch == "}":
+            flush_hex()
+            if stack:
+                skip, uc = stack.pop()
+            ch = next(chars, None)
+            continue
+        if ch == "\\":
+            ch = next(chars, None)
+            if ch is None:
+                break
+            if ch.isalpha():
+                word = ""
+                while ch is not None and ch.isalpha():
+                    word += ch
+                    ch = next(chars, None)
+                param = ""
+                if ch == "-" or (ch is not None and ch.isdigit()):
+                    param += ch
+                    ch = next(chars, None)
+                    while ch is not None and ch.isdigit():
+                        param += ch
+                        ch = next(chars, None)
+                if ch == " ":
+                    ch = next(chars, None)
+
+                if word != "u":
+                    flush_hex()
+                if word in _RTF_SKIP:
+                    skip = True
+                elif word == "ansicpg" and param:
+                    codepage = f"cp{param}"
+                elif word == "uc" and param:
+                    uc = int(param)
+                elif word == "u" and param and not skip:
+                    flush_hex()
+                    code = int(param)
+                    out.append(chr(code + 65536 if code < 0 else code))
+                    pending_skip = uc
+                elif word in _RTF_BREAKS and not skip:
+                    out.append(_RTF_BREAKS[word])
+                    if word in ("par", "page", "sect"):
+                        text = "".join(out)
+                        out = []
+                        yield text
+                continue
+            if ch == "'":
+                code = (next(chars, "") or "") + (next(chars, "") or "")
+                if pending_skip:
+                    pending_skip -= 1
+                elif not skip:
+                    try:
+                        hex_bytes.append(int(code, 16))
+                    except ValueError:
+                        pass
+                ch = next(chars, None)
+                continue
+            if ch == "*":
+                skip = True
+            elif ch in "\\{}" and not skip:
+                flush_hex()
+                out.append(ch)
+            elif ch == "~" and not skip:
+                out.append(" ")
+            ch = next(chars, None)
+            continue
+        if ch in "\r\n":
+            ch = next(chars, None)
+            continue
+        if pending_skip:
+            pending_skip -= 1
+        elif not skip:
+            flush_hex()
+            out.append(ch)
+        ch = next(chars, None)
+
+    flush_hex()
+    if out:
+        yield "".join(out)
+
+
+def _extract_pdf(file: BinaryIO) -> Iterator[str]:
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError:
+        raise UnsupportedDocument("PDF support requires the 'pypdf' package")
+
+    try:
+        reader = PdfReader(file)
+        # Страницы разбираются по одной, текст страницы сразу уходит дальше
+        for page in reader.pages:
+            yield page.extract_text() or ""
+    except PdfReadError as e:
+        raise UnsupportedDocument(f"Invalid PDF: {e}")
+
+
+def extract_text(file: BinaryIO, file_type: str, max_chars: int = 0) -> str:
+    """
+    Собрать фрагменты в один текст; исходный файл при этом остается на диске.
+    max_chars > 0 - разбор прекращается, как только текст превысил лимит (DocumentTooLarge)
+    """
+    buffer = io.StringIO()
+    for i, segment in enumerate(extract_segments(file, file_type)):
+        if i:
+            buffer.write("\n\n")
+        buffer.write(segment)
+        if max_chars and buffer.tell() > max_chars:
+            raise DocumentTooLarge(f"Extracted text is longer than {max_chars} characters")
+    return buffer.getvalue()
+
+
+def extract_archive(
+    file: BinaryIO, allowed_types: List[str], max_items: int, max_member_bytes: int, max_chars: int = 0
+) -> List[Tuple[str, str]]:
+    """
+    ZIP с документами -> [(имя файла, текст)].
+    Каждый файл распаковывается во временный файл (zip-поток не поддерживает
+    быстрый seek, нужный docx/pdf); неподдерживаемые типы пропускаются.
+    """
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile as e:
+        raise UnsupportedDocument(f"Invalid ZIP: {e}")
+
+    documents = []
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or name.rsplit("/", 1)[-1].startswith("."):
+                continue
+            file_type = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+            if file_type not in allowed_types:
+                logger.info(f"Archive: skipped {name} (unsupported type)")
+                continue
+            # Размер из заголовка проверяем до распаковки - защита от zip-бомб
+            if info.file_size > max_member_bytes:
+                raise DocumentTooLarge(f"{name}: file is too large")
+            if len(documents) >= max_items:
+                raise UnsupportedDocument(f"Archive contains more than {max_items} documents")
+
+            with archive.open(info) as member, tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spooled:
+                shutil.copyfileobj(member, spooled, CHUNK_SIZE)
+                try:
+                    documents.append((name, extract_text(spooled, file_type, max_chars)))
+                except UnsupportedDocument as e:
+                    raise type(e)(f"{name}: {e}")
+    return documents
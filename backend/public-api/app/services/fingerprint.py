@@ -0,0 +1,282 @@
+"""
+Local fingerprint index - word shingles + winnowing
+Inverted index: fingerprint -> (doc_id, start, end)
+В памяти процесса - CORPUS_DIR и архив проверок; большой корпус - в сегментах на диске
+(fingerprint_store, FINGERPRINT_INDEX_DIR), поиск идет по обоим.
+Архив ограничен ARCHIVE_MAX_FINGERPRINTS: сверх лимита вытесняются самые старые проверки.
+"""
+import re
+import hashlib
+import logging
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterable, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# (hash, start, end) - позиции в символах исходного текста
+Fingerprint = Tuple[int, int, int]
+
+# domain документов архива проверок
+ARCHIVE = "archive"
+
+
+def submission_key(task_id: str) -> str:
+    return f"check:{task_id}"
+
+
+def stable_id(key: str) -> int:
+    """Стабильный между процессами id (48 бит, безопасно для JS number)"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=6).digest(), "big")
+
+
+def _hash_shingle(words: Iterable[str]) -> int:
+    data = " ".join(words).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def fingerprints(text: str, k: int, window: int) -> List[Fingerprint]:
+    """
+    Winnowing по хешам словесных k-грамм.
+    Из каждого окна в `window` хешей берется минимальный (самый правый при равенстве).
+    """
+    tokens = [(m.group().lower(), m.start(), m.end()) for m in WORD_RE.finditer(text)]
+    if len(tokens) < k:
+        return []
+
+    words = [t[0] for t in tokens]
+    hashes = [_hash_shingle(words[i:i + k]) for i in range(len(tokens) - k + 1)]
+
+    def span(i: int) -> Fingerprint:
+        return (hashes[i], tokens[i][1], tokens[i + k - 1][2])
+
+    if window <= 1:
+        return [span(i) for i in range(len(hashes))]
+
+    if len(hashes) <= window:
+        i = min(range(len(hashes)), key=lambda j: (hashes[j], -j))
+        return [span(i)]
+
+    selected = []
+    last = -1
+    for start in range(len(hashes) - window + 1):
+        best = start
+        for j in range(start + 1, start + window):
+            if hashes[j] <= hashes[best]:
+                best = j
+        if best != last:
+            selected.append(span(best))
+            last = best
+    return selected
+
+
+def merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Объединить пересекающиеся/смежные интервалы"""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class FingerprintIndex:
+
+    def __init__(self, k: int = None, window: int = None):
+        self.k = k or settings.SHINGLE_SIZE
+        self.window = window or settings.WINNOW_WINDOW
+        self._postings: Dict[int, List[Tuple[int, int, int]]] = {}
+        self._docs: Dict[int, Dict] = {}
+        # SegmentStore (on-disk index), если задан FINGERPRINT_INDEX_DIR
+        self.store = None
+        # Архив проверок в порядке добавления: doc_id -> хеши (для вытеснения)
+        self._archive: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._archive_fingerprints = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add_document(
+        self, key: str, text: str, title: str = None, url: str = "", domain: str = "local",
+        fps: Optional[List[Fingerprint]] = None
+    ) -> int:
+        """fps - отпечатки документа (окно self.window), если уже посчитаны вне event loop"""
+        doc_id = stable_id(key)
+        if doc_id in self._docs:
+            return doc_id
+
+        if fps is None:
+            fps = fingerprints(text, self.k, self.window)
+        for h, start, end in fps:
+            self._postings.setdefault(h, []).append((doc_id, start, end))
+
+        self._docs[doc_id] = {
+            'id': doc_id,
+            'title': (title or key)[:200],
+            'url': url,
+            'domain': domain,
+            'fingerprints': len(fps)
+        }
+        if domain == ARCHIVE:
+            self._archive[doc_id] = np.fromiter((h for h, _, _ in fps), dtype="<u8", count=len(fps))
+            self._archive_fingerprints += len(fps)
+            self._evict()
+        return doc_id
+
+    def add_submission(self, task_id: str, fps: List[Fingerprint]) -> int:
+        """Завершенная проверка в архив (отпечатки с окном self.window)"""
+        return self.add_document(submission_key(task_id), "", title=f"Check {task_id}", domain=ARCHIVE, fps=fps)
+
+    def has_submission(self, task_id: str) -> bool:
+        return stable_id(submission_key(task_id)) in self._docs
+
+    @property
+    def archive_size(self) -> Tuple[int, int]:
+        """(проверок, отпечатков) в архиве"""
+        return len(self._archive), self._archive_fingerprints
+
+    def _evict(self):
+        limit = settings.ARCHIVE_MAX_FINGERPRINTS
+        # Последняя проверка остается, даже если одна больше лимита
+        while limit > 0 and self._archive_fingerprints > limit and len(self._archive) > 1:
+            doc_id, hashes = self._archive.popitem(last=False)
+            self._archive_fingerprints -= len(hashes)
+            self._docs.pop(doc_id, None)
+            for h in set(hashes.tolist()):
+                postings = self._postings.get(h)
+                if postings is None:
+                    continue
+                kept = [p for p in postings if p[0] != doc_id]
+                if kept:
+                    self._postings[h] = kept
+                else:
+                    del self._postings[h]
+
+    def adopt(self, loaded: "FingerprintIndex"):
+        """
+        Заменить содержимое индексом, загруженным в фоне (новый объект - поиск не видит его наполовину).
+        Документы, добавленные сюда за время загрузки, переносятся.
+        """
+        for h, postings in self._postings.items():
+            added = [p for p in postings if p[0] not in loaded._docs]
+            if added:
+                loaded._postings.setdefault(h, []).extend(added)
+        for doc_id, doc in self._docs.items():
+            loaded._docs.setdefault(doc_id, doc)
+        for doc_id, hashes in self._archive.items():
+            if doc_id not in loaded._archive:
+                loaded._archive[doc_id] = hashes
+                loaded._archive_fingerprints += len(hashes)
+        self._postings, self._docs = loaded._postings, loaded._docs
+        self._archive, self._archive_fingerprints = loaded._archive, loaded._archive_fingerprints
+        if loaded.store is not None:
+            self.store = loaded.store
+        self._evict()
+
+    def _hits(self, fps: List[Fingerprint], store_hits: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict[int, set]:
+        """Номер отпечатка запроса -> документы, где он есть (в памяти и в сегментах на диске)"""
+        hits: Dict[int, set] = {}
+        if self._postings:
+            for i, (h, _, _) in enumerate(fps):
+                postings = self._postings.get(h)
+                if postings:
+                    hits[i] = {doc_id for doc_id, _, _ in postings}
+        if store_hits is None and self.store is not None:
+            store_hits = self.store.lookup(np.fromiter((h for h, _, _ in fps), dtype="<u8", count=len(fps)))
+        if store_hits is not None:
+            found, docs = store_hits
+            for i, doc_id in zip(found.tolist(), docs.tolist()):
+                hits.setdefault(i, set()).add(doc_id)
+        return hits
+
+    def _doc(self, doc_id: int) -> Optional[Dict]:
+        doc = self._docs.get(doc_id)
+        if doc is None and self.store is not None:
+            doc = self.store.doc(doc_id)
+        return doc
+
+    def search(
+        self, text: str, query: Optional[List[Fingerprint]] = None,
+        store_hits: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ) -> Dict:
+        """
+        Найти фрагменты текста, совпадающие с проиндексированными документами.
+        Возвращает matches/sources в формате детектора.
+        query и store_hits - отпечатки запроса и их находки в сегментах, уже посчитанные по кускам (sharding)
+        """
+        # В запросе берем все шинглы (окно 1): любой отпечаток документа,
+        # попавший в общий фрагмент, будет найден, а покрытие получится сплошным
+        fps = fingerprints(text, self.k, 1) if query is None else query
+        hits = self._hits(fps, store_hits) if fps else {}
+        if not hits:
+            return {'matches': [], 'sources': [], 'fingerprints': len(fps), 'matched': 0}
+
+        spans_by_doc: Dict[int, List[Tuple[int, int]]] = {}
+        hits_by_doc: Dict[int, int] = {}
+        for i in sorted(hits):
+            _, start, end = fps[i]
+            for doc_id in hits[i]:
+                spans_by_doc.setdefault(doc_id, []).append((start, end))
+                hits_by_doc[doc_id] = hits_by_doc.get(doc_id, 0) + 1
+
+        matches = []
+        sources = []
+        for doc_id, spans in spans_by_doc.items():
+            # Поиск длинного текста идет в потоке, а _evict в event loop мог уже вытеснить документ
+            doc = self._doc(doc_id)
+            if doc is None:
+                continue
+            regions = merge_spans(spans)
+            for start, end in regions:
+                matches.append({
+                    'start': start,
+                    'end': end,
+                    'text': text[start:end],
+                    'source_id': doc_id,
+                    'similarity': 1.0,
+                    'type': 'local_fingerprint'
+                })
+            sources.append({
+                'id': doc_id,
+                'title': doc['title'],
+                'url': doc['url'],
+                'domain': doc['domain'],
+                'match_count': len(regions),
+                'score': round(hits_by_doc[doc_id] / len(fps), 4)
+            })
+
+        return {
+            'matches': matches,
+            'sources': sorted(sources, key=lambda x: x['match_count'], reverse=True),
+            'fingerprints': len(fps),
+            'matched': len(hits)
+        }
+
+    def load_corpus_dir(self, path: str) -> int:
+        """Загрузить корпус: все *.txt из каталога (рекурсивно)"""
+        root = Path(path)
+        if not root.is_dir():
+            logger.warning(f"⚠️ Corpus dir not found: {path}")
+            return 0
+
+        count = 0
+        for file in sorted(root.rglob("*.txt")):
+            try:
+                text = file.read_text(encoding="utf-8", errors="ignore")
+            except OSError as e:
+                logger.error(f"Corpus read error {file}: {e}")
+                continue
+            self.add_document(f"corpus:{file.relative_to(root)}", text, title=file.stem, domain="corpus")
+            count += 1
+
+        logger.info(f"✓ Corpus loaded: {count} documents from {path}")
+        return count
+
+
+fingerprint_index = FingerprintIndex()
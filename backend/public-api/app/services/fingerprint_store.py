@@ -0,0 +1,365 @@
+"""
+On-disk fingerprint index - сегменты в каталоге FINGERPRINT_INDEX_DIR, открываются через mmap
+Все процессы (воркеры uvicorn, python -m app.worker) читают одни и те же страницы page cache:
+память процесса не растет вместе с корпусом, поиск - бинарный поиск прямо по отображенному файлу.
+
+Сегмент неизменяем, little-endian, секции выровнены по 8 байт:
+- заголовок (64 байта): MAGIC, число ключей, записей, документов, длина блока метаданных
+- keys: u8[n_keys] - отсортированные уникальные хеши отпечатков
+- offsets: u8[n_keys + 1] - записи ключа keys[i] - postings[offsets[i]:offsets[i + 1]]
+- postings: (doc u8, start u4, end u4)[n_postings] - записи фиксированной ширины
+- doc_ids: u8[n_docs] (отсортированы), doc_offsets: u8[n_docs + 1], затем JSON метаданных документов подряд
+
+MANIFEST.json - список действующих сегментов (от старых к новым); меняется только атомарной заменой файла
+под блокировкой. Пополнение - новым сегментом (python -m app.corpus add), слияние мелких
+сегментов - compact() (python -m app.corpus add / compact; процессы API и воркеры только подхватывают
+новый манифест). Удаленный слиянием файл остается доступен процессам, которые его уже отобразили (POSIX),
+до их перехода на новый манифест.
+"""
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import FINGERPRINT_STORE
+from app.services.fingerprint import fingerprints
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки нет - один писатель за раз
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"APFXSEG1"
+MANIFEST = "MANIFEST.json"
+_HEADER = struct.Struct("<8sQQQQ")
+HEADER_SIZE = 64
+POSTING = np.dtype([("doc", "<u8"), ("start", "<u4"), ("end", "<u4")])
+_EMPTY = (np.empty(0, dtype=np.int64), np.empty(0, dtype="<u8"))
+
+
+def write_segment(path: Path, hashes: np.ndarray, postings: np.ndarray, documents: Dict[int, bytes]):
+    """hashes[i] - ключ записи postings[i] (порядок любой); documents - doc_id -> JSON метаданных"""
+    order = np.argsort(hashes, kind="stable")
+    hashes, postings = hashes[order], postings[order]
+    keys, first = np.unique(hashes, return_index=True)
+    offsets = np.append(first, len(hashes)).astype("<u8")
+    doc_ids = np.array(sorted(documents), dtype="<u8")
+    blobs = [documents[int(d)] for d in doc_ids]
+    doc_offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in blobs], out=doc_offsets[1:])
+    blob = b"".join(blobs)
+
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(keys), len(postings), len(doc_ids), len(blob)).ljust(HEADER_SIZE, b"\0"))
+        for section in (keys.astype("<u8"), offsets, postings.astype(POSTING), doc_ids, doc_offsets):
+            f.write(section.tobytes())
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Segment:
+    """Один файл сегмента; массивы - представления numpy поверх mmap, без копирования"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = path.name
+        self.size = path.stat().st_size
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_keys, n_postings, n_docs, blob = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a fingerprint segment: {path}")
+        offset = HEADER_SIZE
+        self.keys = np.frombuffer(self._mm, "<u8", n_keys, offset)
+        offset += self.keys.nbytes
+        self.offsets = np.frombuffer(self._mm, "<u8", n_keys + 1, offset)
+        offset += self.offsets.nbytes
+        self.postings = np.frombuffer(self._mm, POSTING, n_postings, offset)
+        offset += self.postings.nbytes
+        self.doc_ids = np.frombuffer(self._mm, "<u8", n_docs, offset)
+        offset += self.doc_ids.nbytes
+        self.doc_offsets = np.frombuffer(self._mm, "<u8", n_docs + 1, offset)
+        self._blob = offset + self.doc_offsets.nbytes
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(номер хеша в запросе, doc) для каждой записи с совпавшим ключом"""
+        if not len(self.keys):
+            return _EMPTY
+        idx = np.searchsorted(self.keys, hashes)
+        idx[idx == len(self.keys)] = 0
+        found = np.nonzero(self.keys[idx] == hashes)[0]
+        if not len(found):
+            return _EMPTY
+        starts = self.offsets[idx[found]].astype(np.int64)
+        counts = self.offsets[idx[found] + 1].astype(np.int64) - starts
+        # Диапазоны записей всех найденных ключей одним массивом индексов
+        total = int(counts.sum())
+        positions = np.arange(total) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return np.repeat(found, counts), self.postings["doc"][positions]
+
+    def _doc_index(self, doc_id: int) -> int:
+        i = int(np.searchsorted(self.doc_ids, np.uint64(doc_id)))
+        return i if i < len(self.doc_ids) and int(self.doc_ids[i]) == doc_id else -1
+
+    def has_doc(self, doc_id: int) -> bool:
+        return self._doc_index(doc_id) >= 0
+
+    def _raw_doc(self, i: int) -> bytes:
+        return self._mm[self._blob + int(self.doc_offsets[i]):self._blob + int(self.doc_offsets[i + 1])]
+
+    def doc(self, doc_id: int) -> Optional[Dict]:
+        i = self._doc_index(doc_id)
+        return {'id': doc_id, **json.loads(self._raw_doc(i))} if i >= 0 else None
+
+    def documents(self) -> Iterator[Tuple[int, bytes]]:
+        for i, doc_id in enumerate(self.doc_ids.tolist()):
+            yield doc_id, self._raw_doc(i)
+
+    def records(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Все записи с ключом каждой - для слияния (копия в памяти)"""
+        return np.repeat(self.keys, np.diff(self.offsets).astype(np.int64)), np.array(self.postings)
+
+
+class SegmentBuilder:
+    """Документы нового сегмента в памяти; тот же winnowing, что у FingerprintIndex.add_document"""
+
+    def __init__(self, k: int = None, window: int = None):
+        self.k = k or settings.SHINGLE_SIZE
+        self.window = window or settings.WINNOW_WINDOW
+        self._hashes: List[int] = []
+        self._postings: List[Tuple[int, int, int]] = []
+        self.documents: Dict[int, bytes] = {}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_document(self, doc_id: int, text: str, title: str, url: str = "", domain: str = "local"):
+        if doc_id in self.documents:
+            return
+        fps = fingerprints(text, self.k, self.window)
+        for h, start, end in fps:
+            self._hashes.append(h)
+            self._postings.append((doc_id, start, end))
+        self.documents[doc_id] = json.dumps(
+            {'title': title[:200], 'url': url, 'domain': domain, 'fingerprints': len(fps)}, ensure_ascii=False
+        ).encode("utf-8")
+
+    def write(self, path: Path):
+        write_segment(path, np.array(self._hashes, dtype="<u8"), np.array(self._postings, dtype=POSTING), self.documents)
+
+
+class SegmentStore:
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._segments: List[Segment] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def _lock(self, name: str, blocking: bool = True) -> Iterator[bool]:
+        """Межпроцессная блокировка (flock); blocking=False - False, если занята"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / name, "a+b") as f:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self.path / MANIFEST, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'next': 1, 'segments': []}
+
+    def _write_manifest(self, manifest: Dict):
+        tmp = self.path / (MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path / MANIFEST)
+
+    @staticmethod
+    def _segment_name(manifest: Dict) -> str:
+        # Номер резервируется в манифесте: параллельные писатели не получат одно имя
+        name = f"seg-{manifest['next']:08d}.fpx"
+        manifest['next'] += 1
+        return name
+
+    def refresh(self) -> bool:
+        """Перейти на текущий манифест; уже отображенные сегменты переиспользуются. True - набор изменился"""
+        current = {s.name: s for s in self._segments}
+        for attempt in range(3):
+            names = self._read_manifest()['segments']
+            if names == list(current):
+                return False
+            try:
+                segments = [current.get(name) or Segment(self.path / name) for name in names]
+                break
+            except FileNotFoundError:
+                # Манифест прочитан до слияния, а файл уже удален - перечитываем
+                if attempt == 2:
+                    raise
+        self._segments = segments
+        self._report()
+        return True
+
+    def open(self) -> "SegmentStore":
+        self.refresh()
+        stats = self.stats()
+        logger.info(
+            f"✓ Fingerprint store: {stats['segments']} segments, {stats['documents']} documents, "
+            f"{stats['postings']} postings ({self.path})"
+        )
+        return self
+
+    def _report(self):
+        stats = self.stats()
+        for kind in ("segments", "documents", "postings"):
+            FINGERPRINT_STORE.labels(kind).set(stats[kind])
+
+    def stats(self) -> Dict:
+        segments = self._segments
+        return {
+            'segments': len(segments),
+            'documents': sum(len(s) for s in segments),
+            'keys': sum(len(s.keys) for s in segments),
+            'postings': sum(len(s.postings) for s in segments),
+            'bytes': sum(s.size for s in segments),
+        }
+
+    def lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(номер хеша в запросе, doc) по всем сегментам"""
+        found = [s.lookup(hashes) for s in self._segments]
+        found = [f for f in found if len(f[0])]
+        if not found:
+            return _EMPTY
+        return np.concatenate([f[0] for f in found]), np.concatenate([f[1] for f in found])
+
+    def has_doc(self, doc_id: int) -> bool:
+        return any(s.has_doc(doc_id) for s in self._segments)
+
+    def doc(self, doc_id: int) -> Optional[Dict]:
+        # Новые сегменты - первыми: при повторном добавлении действуют последние метаданные
+        for segment in reversed(self._segments):
+            doc = segment.doc(doc_id)
+            if doc is not None:
+                return doc
+        return None
+
+    def append(self, builder: SegmentBuilder) -> Optional[str]:
+        """Записать документы builder новым сегментом и добавить его в манифест"""
+        if not len(builder):
+            return None
+        with self._lock("manifest.lock"):
+            manifest = self._read_manifest()
+            name = self._segment_name(manifest)
+            builder.write(self.path / name)
+            manifest['segments'].append(name)
+            self._write_manifest(manifest)
+        self.refresh()
+        logger.info(f"📦 Fingerprint segment {name}: {len(builder)} documents")
+        return name
+
+    def _merge_candidates(self) -> List[Segment]:
+        """Самые мелкие сегменты, пока их сумма не больше FINGERPRINT_MERGE_MAX_BYTES"""
+        picked, total = [], 0
+        for segment in sorted(self._segments, key=lambda s: s.size):
+            if total + segment.size > settings.FINGERPRINT_MERGE_MAX_BYTES:
+                break
+            picked.append(segment)
+            total += segment.size
+        return picked if len(picked) >= max(2, settings.FINGERPRINT_MERGE_MIN_SEGMENTS) else []
+
+    def compact(self) -> bool:
+        """Слить мелкие сегменты в один; одновременно сливает только один процесс"""
+        with self._lock("compact.lock", blocking=False) as acquired:
+            if not acquired:
+                return False
+            self.refresh()
+            picked = self._merge_candidates()
+            if not picked:
+                return False
+            with self._lock("manifest.lock"):
+                manifest = self._read_manifest()
+                name = self._segment_name(manifest)
+                self._write_manifest(manifest)
+
+            documents: Dict[int, bytes] = {}
+            for segment in picked:
+                documents.update(segment.documents())
+            records = [segment.records() for segment in picked]
+            write_segment(
+                self.path / name, np.concatenate([r[0] for r in records]),
+                np.concatenate([r[1] for r in records]), documents
+            )
+
+            merged = {s.name for s in picked}
+            with self._lock("manifest.lock"):
+                manifest = self._read_manifest()
+                segments = manifest['segments']
+                # Слитый сегмент - на месте первого из исходных: порядок от старых к новым сохраняется
+                position = min(segments.index(n) for n in merged)
+                manifest['segments'] = [n for n in segments[:position] if n not in merged] + [name] + [
+                    n for n in segments[position:] if n not in merged
+                ]
+                self._write_manifest(manifest)
+            self.refresh()
+            for segment in picked:
+                segment.path.unlink(missing_ok=True)
+            logger.info(f"🗜️ Fingerprint store: {len(picked)} segments merged into {name} ({len(documents)} documents)")
+            return True
+
+    def maintain(self):
+        """Подхватить сегменты, записанные другими процессами, и слить мелкие (python -m app.corpus)"""
+        try:
+            self.refresh()
+            while self.compact():
+                pass
+        except Exception as e:
+            logger.error(f"❌ Fingerprint store maintenance failed: {e}", exc_info=True)
+
+    async def _run(self):
+        # Процессы API и воркеры только подхватывают новые сегменты: слияние прогоняет через память
+        # до FINGERPRINT_MERGE_MAX_BYTES записей, его делает отдельный python -m app.corpus compact
+        while True:
+            await asyncio.sleep(settings.FINGERPRINT_MAINTENANCE_INTERVAL)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"❌ Fingerprint store refresh failed: {e}", exc_info=True)
+
+    def start(self):
+        if settings.FINGERPRINT_MAINTENANCE_INTERVAL > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
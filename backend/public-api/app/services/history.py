@@ -0,0 +1,111 @@
+"""
+User history and dashboard
+- история: keyset-пагинация по индексу (user_id, created_at DESC, task_id DESC), без OFFSET
+- агрегаты: строка user_stats на пользователя, инкремент при записи результата
+"""
+import base64
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import CheckResult, UserStats
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(row: CheckResult) -> str:
+    raw = f"{row.created_at.isoformat()}|{row.task_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """ValueError для поврежденного курсора"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, task_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), task_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def history_page(db: Session, user_id: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[CheckResult], Optional[str]]:
+    """Страница истории (новые сверху) и курсор следующей страницы"""
+    query = db.query(CheckResult).filter(CheckResult.user_id == user_id)
+    if cursor:
+        created_at, task_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            CheckResult.created_at < created_at,
+            and_(CheckResult.created_at == created_at, CheckResult.task_id < task_id)
+        ))
+    # На одну строку больше - так известно, есть ли следующая страница
+    rows = query.order_by(CheckResult.created_at.desc(), CheckResult.task_id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def record_completed(db: Session, rows: List[CheckResult]):
+    """
+    Учесть завершенные проверки в агрегатах пользователей (без коммита -
+    в той же транзакции, что и сами результаты). Один upsert на пользователя.
+    """
+    deltas = {}
+    for row in rows:
+        if not row.user_id or row.status != "completed":
+            continue
+        delta = deltas.setdefault(row.user_id, {
+            "user_id": row.user_id, "check_count": 0, "originality_sum": 0.0,
+            "total_words": 0, "last_check_at": None
+        })
+        delta["check_count"] += 1
+        delta["originality_sum"] += row.originality or 0.0
+        delta["total_words"] += row.total_words or 0
+        created_at = row.created_at or datetime.utcnow()
+        if delta["last_check_at"] is None or created_at > delta["last_check_at"]:
+            delta["last_check_at"] = created_at
+    if not deltas:
+        return
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        for delta in deltas.values():
+            stmt = insert(UserStats).values(**delta)
+            # Инкремент на стороне БД: параллельные воркеры не теряют обновления
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["user_id"],
+                set_={
+                    "check_count": UserStats.check_count + stmt.excluded.check_count,
+                    "originality_sum": UserStats.originality_sum + stmt.excluded.originality_sum,
+                    "total_words": UserStats.total_words + stmt.excluded.total_words,
+                    "last_check_at": stmt.excluded.last_check_at,
+                }
+            ))
+        return
+
+    for delta in deltas.values():
+        stats = db.get(UserStats, delta["user_id"], with_for_update=True)
+        if stats is None:
+            db.add(UserStats(**delta))
+            continue
+        stats.check_count += delta["check_count"]
+        stats.originality_sum += delta["originality_sum"]
+        stats.total_words += delta["total_words"]
+        stats.last_check_at = delta["last_check_at"]
+
+
+def dashboard(db: Session, user_id: str, recent: int = 5) -> dict:
+    """Агрегаты - одно чтение по ключу, последние проверки - первая страница истории"""
+    stats = db.get(UserStats, user_id)
+    rows, _ = history_page(db, user_id, recent)
+    count = stats.check_count if stats else 0
+    return {
+        "user_id": user_id,
+        "check_count": count,
+        "avg_originality": round(stats.originality_sum / count, 2) if count else None,
+        "total_words": stats.total_words if stats else 0,
+        "last_check_at": stats.last_check_at if stats else None,
+        "recent": rows,
+    }
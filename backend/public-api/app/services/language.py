@@ -0,0 +1,93 @@
+"""
+Language identification (ru/en/kk) - детерминированно и за постоянное время
+Смотрим не весь текст, а LANGUAGE_SAMPLE_CHARS символов, набранных окнами по всему документу:
+- латиница против кириллицы (из латинских языков поддерживается только en);
+- в кириллице казахский отличают буквы, которых нет в русском (ә ғ қ ң ө ұ ү һ і),
+  а при их редкости - служебные слова (STOPWORDS_BY_LANG планировщика).
+Модель - таблицы в памяти, собираются один раз при импорте (старт приложения).
+"""
+import re
+import logging
+from typing import Dict
+
+from app.core.config import settings
+from app.services.planner import STOPWORDS_BY_LANG
+
+logger = logging.getLogger(__name__)
+
+LANGUAGES = ("ru", "en", "kk")
+# Текст без букв (формулы, таблицы чисел) - как раньше при ошибке langdetect
+DEFAULT_LANGUAGE = "en"
+
+# Буквы считаем str.count по алфавиту - в разы быстрее регулярных выражений на той же выборке
+_LATIN = "abcdefghijklmnopqrstuvwxyz"
+_KAZAKH = "әғқңөұүһі"
+_CYRILLIC = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя" + _KAZAKH
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+# Доля казахских букв среди кириллицы: в казахском тексте ~10%, в русском - 0 (кроме цитат)
+KAZAKH_LETTER_RATIO = 0.02
+SAMPLE_WINDOWS = 8
+
+# Служебные слова, общие для ru и kk ("да"), голоса не дают
+_RU_WORDS = frozenset(STOPWORDS_BY_LANG["ru"] - STOPWORDS_BY_LANG["kk"])
+_KK_WORDS = frozenset(STOPWORDS_BY_LANG["kk"] - STOPWORDS_BY_LANG["ru"])
+
+
+def sample_text(text: str, limit: int = None) -> str:
+    """SAMPLE_WINDOWS окон равной длины от начала до конца документа, начало окна - на границе слова"""
+    limit = limit or settings.LANGUAGE_SAMPLE_CHARS
+    if len(text) <= limit:
+        return text
+    window = limit // SAMPLE_WINDOWS
+    step = (len(text) - window) / (SAMPLE_WINDOWS - 1)
+    parts = []
+    for i in range(SAMPLE_WINDOWS):
+        start = int(i * step)
+        space = text.find(" ", start, start + 32)
+        if space >= 0:
+            start = space + 1
+        parts.append(text[start:start + window])
+    return " ".join(parts)
+
+
+def _count(sample: str, alphabet: str) -> int:
+    return sum(map(sample.count, alphabet))
+
+
+def _word_votes(sample: str) -> Dict[str, int]:
+    words = _WORD_RE.findall(sample)
+    return {
+        "ru_words": sum(w in _RU_WORDS for w in words),
+        "kk_words": sum(w in _KK_WORDS for w in words),
+    }
+
+
+def language_scores(text: str) -> Dict[str, int]:
+    """Признаки, по которым принимается решение (для логов и отладки)"""
+    sample = sample_text(text).lower()
+    return {
+        "latin": _count(sample, _LATIN),
+        "cyrillic": _count(sample, _CYRILLIC),
+        "kazakh": _count(sample, _KAZAKH),
+        **_word_votes(sample),
+    }
+
+
+def detect_language(text: str) -> str:
+    """ru | en | kk; один и тот же текст - всегда один и тот же ответ"""
+    sample = sample_text(text).lower()
+    latin, cyrillic = _count(sample, _LATIN), _count(sample, _CYRILLIC)
+    if not latin and not cyrillic:
+        return DEFAULT_LANGUAGE
+    if latin > cyrillic:
+        return "en"
+    kazakh = _count(sample, _KAZAKH)
+    if kazakh >= KAZAKH_LETTER_RATIO * cyrillic:
+        return "kk"
+    # Редкие казахские буквы: цитата в русском тексте или короткий казахский - решают служебные слова
+    if kazakh:
+        votes = _word_votes(sample)
+        if votes["kk_words"] > votes["ru_words"]:
+            return "kk"
+    return "ru"
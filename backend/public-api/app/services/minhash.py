@@ -0,0 +1,109 @@
+"""
+MinHash + LSH - поиск почти-дубликатов среди прошлых проверок
+"""
+import hashlib
+import logging
+from typing import List, Dict, Tuple, Optional
+from app.core.config import settings
+from app.services.fingerprint import WORD_RE
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_WORDS = 3
+_EMPTY = (1 << 64) - 1
+# Сдвиг для заимствованных значений при уплотнении пустых корзин
+_DENSIFY_STEP = 1 << 58
+
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash_signature(text: str, num_perm: int = None) -> List[int]:
+    """
+    One-permutation MinHash: один хеш на шингл, минимум в каждой из num_perm корзин,
+    пустые корзины заполняются из соседних (densification). Линейно по длине текста.
+    """
+    num_perm = num_perm or settings.MINHASH_PERMUTATIONS
+    words = [m.group().lower() for m in WORD_RE.finditer(text)]
+
+    bins = [_EMPTY] * num_perm
+    n = min(SHINGLE_WORDS, len(words))
+    for i in range(len(words) - n + 1 if n else 0):
+        h = _hash64(" ".join(words[i:i + n]))
+        b = h % num_perm
+        v = h // num_perm
+        if v < bins[b]:
+            bins[b] = v
+
+    if all(v == _EMPTY for v in bins):
+        return bins
+
+    signature = list(bins)
+    for j in range(num_perm):
+        if bins[j] != _EMPTY:
+            continue
+        d = 1
+        while bins[(j + d) % num_perm] == _EMPTY:
+            d += 1
+        signature[j] = bins[(j + d) % num_perm] + d * _DENSIFY_STEP
+    return signature
+
+
+def estimate_similarity(a: List[int], b: List[int]) -> float:
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    if not a or len(a) != len(b):
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class MinHashLSH:
+    """LSH по полосам: bands x rows = num_perm"""
+
+    def __init__(self, num_perm: int = None, bands: int = None):
+        self.num_perm = num_perm or settings.MINHASH_PERMUTATIONS
+        self.bands = bands or settings.LSH_BANDS
+        self.rows = self.num_perm // self.bands
+        self._buckets: List[Dict[Tuple[int, ...], set]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: List[int]):
+        for b in range(self.bands):
+            yield b, tuple(signature[b * self.rows:(b + 1) * self.rows])
+
+    def add(self, key: str, signature: Optional[List[int]]):
+        if not signature or len(signature) != self.num_perm or key in self._signatures:
+            return
+        self._signatures[key] = signature
+        for b, band in self._band_keys(signature):
+            self._buckets[b].setdefault(band, set()).add(key)
+
+    def adopt(self, loaded: "MinHashLSH"):
+        """Заменить содержимое индексом, загруженным в фоне; сигнатуры, добавленные за время загрузки, переносятся"""
+        for key, signature in self._signatures.items():
+            loaded.add(key, signature)
+        self._buckets, self._signatures = loaded._buckets, loaded._signatures
+
+    def query(self, signature: List[int], k: int = None, min_similarity: float = 0.0) -> List[Tuple[str, float]]:
+        """Top-k похожих: только кандидаты из общих корзин, без полного перебора"""
+        k = k or settings.DEDUP_TOP_K
+        if not signature or len(signature) != self.num_perm:
+            return []
+
+        candidates = set()
+        for b, band in self._band_keys(signature):
+            candidates.update(self._buckets[b].get(band, ()))
+
+        scored = [
+            (key, round(estimate_similarity(signature, self._signatures[key]), 4))
+            for key in candidates
+        ]
+        scored = [item for item in scored if item[1] >= min_similarity]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:k]
+
+
+minhash_index = MinHashLSH()
@@ -0,0 +1,104 @@
+"""
+Query planner - какие предложения отправлять в платный поиск
+"""
+import math
+import logging
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+from app.core.config import settings
+from app.services.fingerprint import WORD_RE
+from app.services.segmenter import Span
+
+logger = logging.getLogger(__name__)
+
+# Google получает только первые QUERY_CHARS символов предложения
+QUERY_CHARS = 150
+
+STOPWORDS_BY_LANG = {
+    "ru": {
+        "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так",
+        "его", "но", "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "мне", "было",
+        "вот", "от", "меня", "еще", "нет", "о", "из", "ему", "теперь", "когда", "даже", "ну", "ли",
+        "если", "уже", "или", "ни", "быть", "был", "него", "до", "вас", "нибудь", "опять", "уж", "вам",
+        "ведь", "там", "потом", "себя", "ничего", "ей", "может", "они", "тут", "где", "есть", "надо",
+        "ней", "для", "мы", "тебя", "их", "чем", "была", "сам", "чтоб", "без", "будто", "чего", "раз",
+        "тоже", "себе", "под", "будет", "ж", "тогда", "кто", "этот", "того", "потому", "этого", "какой",
+        "совсем", "ним", "здесь", "этом", "один", "почти", "мой", "тем", "чтобы", "нее", "были", "куда",
+        "зачем", "всех", "никогда", "можно", "при", "наконец", "два", "об", "другой", "хоть", "после",
+        "над", "больше", "тот", "через", "эти", "нас", "про", "всего", "них", "какая", "много", "разве",
+        "три", "эту", "моя", "впрочем", "хорошо", "свою", "этой", "перед", "иногда", "лучше", "чуть",
+        "том", "нельзя", "такой", "им", "более", "всегда", "конечно", "всю", "между", "это", "также",
+        "является", "являются", "данный", "данной", "который", "которые", "которая", "которых",
+    },
+    "en": {
+        "the", "a", "an", "and", "or", "but", "of", "to", "in", "on", "at", "for", "with", "by", "from",
+        "is", "are", "was", "were", "be", "been", "being", "it", "its", "this", "that", "these", "those",
+        "as", "not", "no", "can", "will", "would", "should", "could", "may", "might", "has", "have", "had",
+        "do", "does", "did", "which", "who", "whom", "what", "there", "their", "they", "them", "we", "our",
+        "you", "your", "he", "she", "his", "her", "also", "such", "than", "then", "into", "about", "more",
+    },
+    "kk": {
+        "және", "мен", "бен", "пен", "да", "де", "та", "те", "бұл", "осы", "сол", "ол", "олар", "біз",
+        "сіз", "үшін", "туралы", "бойынша", "арқылы", "сияқты", "ретінде", "болып", "болады",
+        "еді", "емес", "жоқ", "бар", "әр", "барлық", "кейін", "дейін", "ғана", "тек", "немесе", "бірақ",
+    },
+}
+# Язык не известен - стоп-слова всех языков
+STOPWORDS = set().union(*STOPWORDS_BY_LANG.values())
+
+
+def query_budget(total_words: int, tier: str = None) -> int:
+    """Бюджет запросов на проверку: растет с длиной документа, ограничен тарифом"""
+    tier = (tier or settings.DEFAULT_TIER).strip().lower()
+    caps = _tier_caps()
+    cap = caps.get(tier, caps.get(settings.DEFAULT_TIER, settings.QUERY_BUDGET_BASE))
+    budget = settings.QUERY_BUDGET_BASE + settings.QUERY_BUDGET_PER_1000_WORDS * total_words / 1000
+    return max(1, min(cap, int(budget)))
+
+
+def _tier_caps() -> Dict[str, int]:
+    caps = {}
+    for item in settings.QUERY_BUDGET_TIERS.split(","):
+        name, _, value = item.partition(":")
+        if name.strip() and value.strip().isdigit():
+            caps[name.strip().lower()] = int(value)
+    return caps
+
+
+def score_sentences(spans: List[Span], lang: Optional[str] = None) -> List[Tuple[float, Span]]:
+    """
+    Информативность предложения: доля редких в документе значимых слов,
+    штраф за шаблонные (стоп-слова языка документа) и слишком короткие фразы.
+    """
+    stopwords = STOPWORDS_BY_LANG.get(lang, STOPWORDS)
+    tokenized = [[w.lower() for w in WORD_RE.findall(span.text[:QUERY_CHARS])] for span in spans]
+    doc_freq = Counter(w for words in tokenized for w in words)
+
+    scored = []
+    for span, words in zip(spans, tokenized):
+        if not words:
+            continue
+        content = [w for w in words if w not in stopwords and len(w) > 3 and not w.isdigit()]
+        if not content:
+            continue
+        rarity = sum(1.0 / (1.0 + math.log(doc_freq[w])) for w in content) / len(words)
+        length = min(1.0, len(span.text) / 120)
+        scored.append((round(rarity * length, 6), span))
+
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored
+
+
+def confidence_width(hits: int, checked: int, z: float = 1.96) -> float:
+    """Полуширина интервала Уилсона для доли предложений с находками"""
+    if checked == 0:
+        return 1.0
+    p = hits / checked
+    denom = 1 + z * z / checked
+    return z * math.sqrt(p * (1 - p) / checked + z * z / (4 * checked * checked)) / denom
+
+
+def converged(hits: int, checked: int) -> bool:
+    if checked < settings.QUERY_MIN_BEFORE_STOP:
+        return False
+    return confidence_width(hits, checked) <= settings.QUERY_CONVERGENCE_WIDTH
@@ -0,0 +1,121 @@
+"""
+Sentence segmenter - один проход, позиции в исходном тексте (ru/en/kk)
+"""
+import re
+import logging
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Span(NamedTuple):
+    start: int
+    end: int
+    text: str
+
+
+# Сокращения (без точки, в нижнем регистре), после которых точка не завершает предложение
+ABBREVIATIONS_BY_LANG = {
+    "ru": {
+        "т", "е", "д", "п", "др", "пр", "г", "гг", "в", "вв", "им", "ул", "стр", "с", "см", "рис",
+        "табл", "напр", "проф", "доц", "акад", "канд", "тыс", "млн", "млрд", "руб", "коп", "ред",
+        "изд", "гл", "разд", "прим", "ср", "англ", "лат", "т.е", "т.д", "т.п", "т.к", "и.о", "н.э",
+        "т.н", "т.о",
+    },
+    "en": {
+        "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "fig", "no",
+        "vol", "pp", "ed", "eds", "al", "approx", "dept", "inc", "ltd", "jan", "feb", "mar", "apr",
+        "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+    },
+    "kk": {
+        "ж", "жж", "т.б", "т.с.с", "б.з.д", "б.з", "ғ", "бб", "қ", "мыс",
+    },
+}
+# Язык не известен - сокращения всех языков
+ABBREVIATIONS = set().union(*ABBREVIATIONS_BY_LANG.values())
+# В казахских текстах в ходу и русские сокращения
+_ABBREVIATIONS_FOR = {
+    "ru": ABBREVIATIONS_BY_LANG["ru"],
+    "en": ABBREVIATIONS_BY_LANG["en"],
+    "kk": ABBREVIATIONS_BY_LANG["kk"] | ABBREVIATIONS_BY_LANG["ru"],
+}
+
+# Сокращения, которыми часто заканчивается предложение: перед заглавной буквой - граница
+TERMINAL_ABBREVIATIONS = {"т.д", "т.п", "др", "пр", "etc", "т.б", "т.с.с", "н.э"}
+
+# Кандидат в конец предложения: знаки, закрывающие кавычки/скобки, затем пробелы.
+# Серия знаков разбирается единственным способом и только с ее начала (lookbehind) - на отточиях
+# оглавления ("Введение ........ 3") время линейное, без перебора разбиений серии
+_BOUNDARY_RE = re.compile(r"(?<![.!?…])[.!?…]+[\"'»”’)\]]*(?=\s|$)")
+# Последнее "слово" перед точкой, включая внутренние точки (т.е, e.g)
+_TAIL_RE = re.compile(r"(\w+(?:\.\w+)*)$")
+_WS_RE = re.compile(r"\s+")
+
+
+def _is_boundary(text: str, match: re.Match, abbreviations) -> bool:
+    end = match.end()
+    rest = _WS_RE.match(text, end)
+    next_pos = rest.end() if rest else end
+    if next_pos >= len(text):
+        return True
+
+    next_char = text[next_pos]
+    # Продолжение со строчной буквы - не новое предложение ("и т.д. и", "... и")
+    if next_char.islower():
+        return False
+
+    punct = match.group()
+    if punct[0] != "." or punct.startswith("..."):
+        return True
+
+    # Смотрим только на короткий хвост перед точкой - время на кандидата постоянное
+    tail = _TAIL_RE.search(text, max(0, match.start() - 16), match.start())
+    if tail is None:
+        return True
+    word = tail.group(1).lower()
+    if word in TERMINAL_ABBREVIATIONS:
+        return True
+    if word in abbreviations:
+        return False
+    # Инициалы: "А. С. Пушкин", "J. R. R. Tolkien"
+    if len(word) == 1 and word.isalpha():
+        return False
+    return True
+
+
+def iter_boundaries(text: str, lang: Optional[str] = None) -> Iterator[int]:
+    """
+    Концы предложений (позиция после знака). Решение по кандидату зависит только от 16 символов
+    перед ним и пробелов со следующим символом после - поэтому границы можно искать по кускам текста (sharding)
+    """
+    abbreviations = _ABBREVIATIONS_FOR.get(lang, ABBREVIATIONS)
+    for match in _BOUNDARY_RE.finditer(text):
+        if _is_boundary(text, match, abbreviations):
+            yield match.end()
+
+
+def iter_sentences(text: str, lang: Optional[str] = None, boundaries: Optional[Iterable[int]] = None) -> Iterator[Span]:
+    """
+    Генератор предложений (start, end, text) без пробелов по краям; lang - сокращения только этого языка;
+    boundaries - уже найденные концы предложений (по возрастанию)
+    """
+    start = 0
+    for end in iter_boundaries(text, lang) if boundaries is None else boundaries:
+        yield from _trimmed(text, start, end)
+        start = end
+    yield from _trimmed(text, start, len(text))
+
+
+def _trimmed(text: str, start: int, end: int) -> Iterator[Span]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        yield Span(start, end, text[start:end])
+
+
+def split_sentences(
+    text: str, min_length: int = 0, lang: Optional[str] = None, boundaries: Optional[Iterable[int]] = None
+) -> List[Span]:
+    return [span for span in iter_sentences(text, lang, boundaries) if len(span.text) > min_length]
@@ -0,0 +1,184 @@
+"""
+Sharded text preparation - длинные документы (от SHARD_MIN_CHARS) обрабатываются по кускам в пуле процессов
+В процессах пула - работа над текстом, не зависящая от состояния API: отпечатки запроса (шинглы, окно 1),
+поиск их в сегментах на диске (mmap - общие страницы с основным процессом) и границы предложений.
+
+Кусок отвечает за свой диапазон [own_start, own_end), начало которого - пробельный символ.
+Слева к нему добавлен контекст (до предыдущего пробела и еще 16 символов - столько смотрит сегментатор),
+справа - k слов (SHINGLE_SIZE) после конца диапазона. Отпечаток или граница предложения, начинающиеся
+в диапазоне, получаются теми же, что и при проходе по всему тексту; из куска берутся только они,
+поэтому слияние - конкатенация в порядке кусков. Совпадения, пересекающие границу кусков, склеиваются
+уже в основном процессе (merge_spans по всему тексту), там же - поиск по индексу в памяти и оценка.
+"""
+import asyncio
+import logging
+import os
+import re
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.fingerprint import WORD_RE, Fingerprint, fingerprints
+from app.services.segmenter import iter_boundaries
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s")
+# Сколько символов перед кандидатом в конец предложения смотрит сегментатор (_TAIL_RE)
+_TAIL_CONTEXT = 16
+
+
+class Chunk(NamedTuple):
+    left: int
+    own_start: int
+    own_end: int
+    right: int
+
+
+class Prepared(NamedTuple):
+    """Результат для всего текста: отпечатки запроса, их находки в сегментах, концы предложений"""
+    fingerprints: List[Fingerprint]
+    store_hits: Optional[Tuple[np.ndarray, np.ndarray]]
+    boundaries: Optional[List[int]]
+
+
+def sharded(text: str) -> bool:
+    return settings.SHARD_MIN_CHARS > 0 and len(text) >= settings.SHARD_MIN_CHARS
+
+
+def plan_chunks(text: str, chunk_chars: int, k: int) -> List[Chunk]:
+    chunks = []
+    own_start, n = 0, len(text)
+    while own_start < n:
+        cut = _WS_RE.search(text, own_start + chunk_chars) if own_start + chunk_chars < n else None
+        own_end = cut.start() if cut else n
+
+        left = own_start
+        if left:
+            # Кандидат в конец предложения, кончающийся ровно на own_start, начинается после предыдущего пробела
+            left -= 1
+            while left > 0 and not text[left].isspace():
+                left -= 1
+            left = max(0, left - _TAIL_CONTEXT)
+
+        right = n
+        if own_end < n:
+            # k слов после диапазона: шинглы, начатые в нем, и символ после пробелов за последней границей
+            for i, match in enumerate(WORD_RE.finditer(text, own_end)):
+                if i + 1 == k:
+                    right = min(n, match.end() + 1)
+                    break
+        chunks.append(Chunk(left, own_start, own_end, right))
+        own_start = own_end
+    return chunks
+
+
+# Состояние процесса пула: сегменты на диске открываются один раз
+_store = None
+
+
+def _init_worker():
+    global _store
+    # Ctrl+C получает основной процесс; пул он остановит сам
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if settings.FINGERPRINT_INDEX_DIR:
+        from app.services.fingerprint_store import SegmentStore
+        _store = SegmentStore(settings.FINGERPRINT_INDEX_DIR)
+
+
+def _prepare_chunk(chunk: str, base: int, own_start: int, own_end: int, k: int, lang: Optional[str], with_boundaries: bool):
+    lo, hi = own_start - base, own_end - base
+    fps = [fp for fp in fingerprints(chunk, k, 1) if lo <= fp[1] < hi]
+    hashes = np.fromiter((h for h, _, _ in fps), dtype="<u8", count=len(fps))
+    spans = np.array([(s, e) for _, s, e in fps], dtype=np.int64).reshape(-1, 2) + base
+
+    store_hits = None
+    if _store is not None:
+        _store.refresh()
+        store_hits = _store.lookup(hashes)
+
+    boundaries = [b + base for b in iter_boundaries(chunk, lang) if lo <= b < hi] if with_boundaries else None
+    return hashes, spans, store_hits, boundaries
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _processes() -> int:
+    return settings.ANALYSIS_PROCESSES or os.cpu_count() or 1
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: процесс API уже с потоками и event loop - fork такого процесса небезопасен
+        _pool = ProcessPoolExecutor(max_workers=_processes(), mp_context=get_context("spawn"), initializer=_init_worker)
+        logger.info(f"🧩 Analysis pool: {_processes()} processes")
+    return _pool
+
+
+async def start():
+    """Запустить процессы пула заранее (прогрев), а не на первом длинном документе"""
+    if settings.SHARD_MIN_CHARS <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, _ping) for _ in range(_processes())))
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def prepare(text: str, lang: Optional[str], with_boundaries: bool) -> Optional[Prepared]:
+    """Подготовка длинного текста по кускам; None - пул недоступен (вызывающий считает сам)"""
+    k = settings.SHINGLE_SIZE
+    chunks = plan_chunks(text, max(1000, settings.SHARD_CHUNK_CHARS), k)
+    loop = asyncio.get_running_loop()
+    try:
+        pool = _get_pool()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                pool, _prepare_chunk, text[c.left:c.right], c.left, c.own_start, c.own_end, k, lang, with_boundaries
+            )
+            for c in chunks
+        ))
+    except BrokenProcessPool as e:
+        # Процесс пула упал (OOM) - пул пересоздается при следующем длинном документе
+        logger.error(f"❌ Analysis pool broken: {e}")
+        shutdown()
+        return None
+
+    # Слияние линейно по числу отпечатков - тоже не в event loop
+    prepared = await asyncio.to_thread(_merge, results, with_boundaries)
+    logger.info(f"Sharded {len(text)} chars into {len(chunks)} chunks: {len(prepared.fingerprints)} fingerprints")
+    return prepared
+
+
+def _merge(results: List, with_boundaries: bool) -> Prepared:
+    fps: List[Fingerprint] = []
+    found, docs = [], []
+    boundaries = [] if with_boundaries else None
+    for hashes, spans, store_hits, chunk_boundaries in results:
+        if store_hits is not None:
+            # Номера отпечатков куска -> номера в общем списке
+            found.append(store_hits[0] + len(fps))
+            docs.append(store_hits[1])
+        fps.extend(zip(hashes.tolist(), spans[:, 0].tolist(), spans[:, 1].tolist()))
+        if with_boundaries:
+            boundaries.extend(chunk_boundaries)
+
+    store_hits = (np.concatenate(found), np.concatenate(docs)) if found else None
+    return Prepared(fps, store_hits, boundaries)
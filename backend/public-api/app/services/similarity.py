@@ -0,0 +1,98 @@
+"""
+Local semantic pre-filter - hashed character n-gram TF-IDF + cosine (NumPy, CPU)
+Только пары в "серой зоне" уходят в LLM
+"""
+import zlib
+import logging
+from typing import List, Dict, Tuple
+import numpy as np
+from app.core.config import settings
+from app.services.fingerprint import WORD_RE
+
+logger = logging.getLogger(__name__)
+
+
+def _ngram_ids(text: str, n: int, dim: int) -> np.ndarray:
+    # Нормализация: только слова в нижнем регистре, одиночные пробелы
+    normalized = " " + " ".join(WORD_RE.findall(text.lower())) + " "
+    count = max(0, len(normalized) - n + 1)
+    hashes = np.fromiter(
+        (zlib.crc32(normalized[i:i + n].encode("utf-8")) for i in range(count)),
+        dtype=np.uint32,
+        count=count
+    )
+    return (hashes % dim).astype(np.int64)
+
+
+def vectorize(texts: List[str], n: int = None, dim: int = None) -> np.ndarray:
+    """Строки матрицы - L2-нормированные TF-IDF векторы (IDF по этому же набору текстов)"""
+    n = n or settings.SIMILARITY_NGRAM
+    dim = dim or settings.SIMILARITY_DIM
+
+    counts = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        ids = _ngram_ids(text, n, dim)
+        if ids.size:
+            counts[row] = np.bincount(ids, minlength=dim)
+
+    tf = np.log1p(counts)
+    df = np.count_nonzero(counts, axis=0)
+    idf = np.log((len(texts) + 1) / (df + 1), dtype=np.float32) + 1.0
+    vectors = tf * idf
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def cosine_matrix(left: List[str], right: List[str]) -> np.ndarray:
+    """Косинусная близость всех пар left x right одним матричным произведением"""
+    if not left or not right:
+        return np.zeros((len(left), len(right)), dtype=np.float32)
+    vectors = vectorize(left + right)
+    return vectors[:len(left)] @ vectors[len(left):].T
+
+
+def pairwise_similarity(texts: List[str]) -> List[List[float]]:
+    """Матрица близости текстов друг с другом (для пакетной проверки), округлена для хранения"""
+    if not texts:
+        return []
+    vectors = vectorize(texts)
+    scores = np.clip(vectors @ vectors.T, 0.0, 1.0).astype(np.float64)
+    return np.round(scores, 3).tolist()
+
+
+def triage(pairs: List[Tuple[str, str]], low: float = None, high: float = None) -> Dict[str, List[Tuple[int, float]]]:
+    """
+    Разбить пары (фрагмент, кандидат) на три группы по косинусу:
+    related (>= high) - совпадение без LLM, unrelated (< low) - отбрасываем,
+    ambiguous - отправляем в LLM. Элементы: (индекс пары, score).
+    """
+    low = settings.SIMILARITY_LOW if low is None else low
+    high = settings.SIMILARITY_HIGH if high is None else high
+
+    groups = {'related': [], 'ambiguous': [], 'unrelated': []}
+    if not pairs:
+        return groups
+
+    # Уникальные тексты с каждой стороны - одна матрица на весь документ
+    left = list(dict.fromkeys(p[0] for p in pairs))
+    right = list(dict.fromkeys(p[1] for p in pairs))
+    left_idx = {t: i for i, t in enumerate(left)}
+    right_idx = {t: i for i, t in enumerate(right)}
+    scores = cosine_matrix(left, right)
+
+    for i, (fragment, candidate) in enumerate(pairs):
+        score = float(scores[left_idx[fragment], right_idx[candidate]])
+        if score >= high:
+            groups['related'].append((i, score))
+        elif score < low:
+            groups['unrelated'].append((i, score))
+        else:
+            groups['ambiguous'].append((i, score))
+
+    logger.info(
+        f"Similarity triage: {len(groups['related'])} related, "
+        f"{len(groups['ambiguous'])} ambiguous, {len(groups['unrelated'])} unrelated"
+    )
+    return groups
@@ -0,0 +1,217 @@
+"""
+Compact result storage
+- текст проверки хранится один раз (zlib), фрагменты совпадений - срезы этого текста
+- совпадения: колоночный упакованный массив (start, end, source_id, similarity, type)
+- метаданные источников - в общей таблице sources, у проверки только id + match_count
+"""
+import zlib
+import logging
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session, undefer_group
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import CheckResult, Source
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Индекс типа совпадения в упакованном формате; новые типы - только в конец списка
+MATCH_TYPES = ["local_fingerprint", "google_exact", "google_partial", "semantic_ai", "candidate"]
+_TYPE_INDEX = {t: i for i, t in enumerate(MATCH_TYPES)}
+_UNKNOWN_TYPE = 255
+
+# Колонки совпадений, little-endian; каждая колонка хранится подряд - так лучше сжимается
+_MATCH_COLUMNS = [
+    ("start", "<u4"),
+    ("end", "<u4"),
+    ("source_id", "<i8"),
+    ("similarity", "<f4"),
+    ("type", "u1"),
+]
+# Строк в одном INSERT источников: 4 параметра на строку, лимит asyncpg - 32767, SQLite - 32766
+_UPSERT_CHUNK = 500
+
+_SOURCE_COLUMNS = [
+    ("id", "<i8"),
+    ("match_count", "<u4"),
+    ("score", "<f4"),
+]
+
+
+def pack_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def unpack_text(blob: Optional[bytes]) -> str:
+    return zlib.decompress(blob).decode("utf-8") if blob else ""
+
+
+def _pack_columns(columns: List[Tuple[str, str]], values: Dict[str, list]) -> bytes:
+    count = len(values[columns[0][0]])
+    parts = [bytes([FORMAT_VERSION]), np.uint32(count).tobytes()]
+    for name, dtype in columns:
+        parts.append(np.asarray(values[name], dtype=dtype).tobytes())
+    return zlib.compress(b"".join(parts), 6)
+
+
+def _unpack_columns(columns: List[Tuple[str, str]], blob: bytes) -> Dict[str, np.ndarray]:
+    raw = zlib.decompress(blob)
+    if raw[0] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported storage format: {raw[0]}")
+    count = int(np.frombuffer(raw, dtype="<u4", count=1, offset=1)[0])
+    offset = 5
+    result = {}
+    for name, dtype in columns:
+        result[name] = np.frombuffer(raw, dtype=dtype, count=count, offset=offset)
+        offset += count * np.dtype(dtype).itemsize
+    return result
+
+
+def pack_matches(matches: List[Dict]) -> bytes:
+    return _pack_columns(_MATCH_COLUMNS, {
+        "start": [m["start"] for m in matches],
+        "end": [m["end"] for m in matches],
+        "source_id": [int(m["source_id"]) for m in matches],
+        "similarity": [m.get("similarity", 0.0) for m in matches],
+        "type": [_TYPE_INDEX.get(m.get("type"), _UNKNOWN_TYPE) for m in matches],
+    })
+
+
+def unpack_matches(blob: Optional[bytes], text: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[int, List[Dict]]:
+    """(всего совпадений, совпадения [offset:offset+limit]); text - исходный текст проверки"""
+    if not blob:
+        return 0, []
+    columns = _unpack_columns(_MATCH_COLUMNS, blob)
+    total = len(columns["start"])
+    stop = total if limit is None else min(total, offset + limit)
+    matches = []
+    for i in range(offset, stop):
+        start, end = int(columns["start"][i]), int(columns["end"][i])
+        type_index = int(columns["type"][i])
+        matches.append({
+            "start": start,
+            "end": end,
+            "text": text[start:end],
+            "source_id": int(columns["source_id"][i]),
+            "similarity": round(float(columns["similarity"][i]), 4),
+            "type": MATCH_TYPES[type_index] if type_index < len(MATCH_TYPES) else "unknown",
+        })
+    return total, matches
+
+
+def pack_sources(sources: List[Dict]) -> bytes:
+    return _pack_columns(_SOURCE_COLUMNS, {
+        "id": [int(s["id"]) for s in sources],
+        "match_count": [s.get("match_count", 0) for s in sources],
+        "score": [s.get("score", np.nan) for s in sources],
+    })
+
+
+def unpack_sources(blob: Optional[bytes]) -> List[Dict]:
+    """Ссылки проверки на источники: [{id, match_count[, score]}] без метаданных"""
+    if not blob:
+        return []
+    columns = _unpack_columns(_SOURCE_COLUMNS, blob)
+    refs = []
+    for source_id, count, score in zip(columns["id"], columns["match_count"], columns["score"]):
+        ref = {"id": int(source_id), "match_count": int(count)}
+        if not np.isnan(score):
+            ref["score"] = round(float(score), 4)
+        refs.append(ref)
+    return refs
+
+
+def upsert_sources(db: Session, sources: List[Dict]):
+    """
+    Добавить метаданные источников в общую таблицу (без коммита).
+    Уже известные id не перезаписываются; гонка двух воркеров гасится ON CONFLICT DO NOTHING.
+    Вставка - по _UPSERT_CHUNK строк: большой пакет не упирается в лимит параметров запроса.
+    """
+    rows = {}
+    for s in sources:
+        rows.setdefault(int(s["id"]), {
+            "id": int(s["id"]),
+            "title": (s.get("title") or "")[:500],
+            "url": s.get("url") or "",
+            "domain": s.get("domain") or "",
+        })
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        values = list(rows.values())
+        for i in range(0, len(values), _UPSERT_CHUNK):
+            db.execute(insert(Source).values(values[i:i + _UPSERT_CHUNK]).on_conflict_do_nothing(index_elements=["id"]))
+        return
+    known = {sid for (sid,) in db.query(Source.id).filter(Source.id.in_(list(rows)))}
+    db.add_all(Source(**row) for sid, row in rows.items() if sid not in known)
+
+
+def result_options(include_matches: bool = True) -> list:
+    """Опции загрузки строки для attach_result / load_matches: без совпадений текст и match_data не читаются"""
+    return [undefer_group("payload"), undefer_group("sources")] if include_matches else [undefer_group("sources")]
+
+
+def _is_legacy(row: CheckResult) -> bool:
+    # Старые строки (JSON-колонки) - без match_count; сам match_data не трогаем, чтобы не грузить группу payload
+    return row.match_count is None
+
+
+def store_result(row: CheckResult, text: str, result_data: Dict):
+    """Упаковать результат в строку проверки; источники - отдельно через upsert_sources"""
+    matches = result_data.get("matches", [])
+    row.text_data = pack_text(text)
+    row.match_data = pack_matches(matches)
+    row.source_data = pack_sources(result_data.get("sources", []))
+    row.match_count = len(matches)
+
+
+def _source_details(db: Session, refs: List[Dict]) -> List[Dict]:
+    # Метаданные всех источников страницы - одним запросом
+    ids = [ref["id"] for ref in refs]
+    known = {s.id: s for s in db.query(Source).filter(Source.id.in_(ids))} if ids else {}
+    sources = []
+    for ref in refs:
+        source = known.get(ref["id"])
+        sources.append({
+            "id": ref["id"],
+            "title": source.title if source else "",
+            "url": source.url if source else "",
+            "domain": source.domain if source else "",
+            **{k: v for k, v in ref.items() if k != "id"},
+        })
+    return sources
+
+
+def load_matches(db: Session, row: CheckResult, offset: int = 0, limit: Optional[int] = None) -> Tuple[int, List[Dict], List[Dict]]:
+    """
+    (всего, страница совпадений, источники страницы).
+    Старые строки (JSON-колонки matches/sources) читаются как раньше.
+    """
+    if _is_legacy(row):
+        matches = row.matches_json or []
+        page = matches[offset:None if limit is None else offset + limit]
+        ids = {m.get("source_id") for m in page}
+        return len(matches), page, [s for s in row.sources_json or [] if s.get("id") in ids]
+
+    total, page = unpack_matches(row.match_data, unpack_text(row.text_data), offset, limit)
+    ids = {m["source_id"] for m in page}
+    refs = [ref for ref in unpack_sources(row.source_data) if ref["id"] in ids]
+    return total, page, _source_details(db, refs)
+
+
+def attach_result(db: Session, row: CheckResult, include_matches: bool = True):
+    """Развернуть результат в row.matches / row.sources (как прежние JSON-поля) для ответа API"""
+    if row.status != "completed":
+        return row
+    if _is_legacy(row):
+        row.matches = row.matches_json if include_matches else None
+        row.sources = row.sources_json
+        return row
+
+    row.matches = unpack_matches(row.match_data, unpack_text(row.text_data))[1] if include_matches else None
+    row.sources = _source_details(db, unpack_sources(row.source_data))
+    return row
@@ -0,0 +1,187 @@
+"""
+Queue workers for background checks
+Usage: python -m app.worker --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, or_, select, update
+
+from prometheus_client import start_http_server
+
+from app.core.config import settings
+from app.core.cache import redis_health
+from app.core.queue import JobQueue, get_queue
+from app.core.progress import progress_hub
+from app.core.ratelimit import priority, NORMAL
+from app.models import CheckResult, init_db, async_engine
+from app.services.checks import run_check, load_indexes, close_indexes, result_writer
+from app.services.detector import detector
+from app.services.ai import ai_service
+
+logger = logging.getLogger(__name__)
+
+
+def _mark(task_id: str, status: str):
+    def mark(db) -> bool:
+        row = db.get(CheckResult, task_id)
+        if row is not None:
+            row.status = status
+            if status == "running":
+                row.started_at = datetime.utcnow()
+        return row is not None
+    return mark
+
+
+async def _fail(task_id: str):
+    await result_writer.write(_mark(task_id, "failed"))
+    await progress_hub.publish(task_id, {"event": "failed", "task_id": task_id})
+
+
+async def process_job(job: dict):
+    """pending -> running -> completed | failed"""
+    task_id = job["task_id"]
+
+    if not await result_writer.write(_mark(task_id, "running")):
+        logger.warning(f"Job {task_id}: check row not found, skipped")
+        return
+
+    try:
+        with priority(job.get("priority", NORMAL)):
+            result = await run_check(job["text"], job.get("mode", "deep"), task_id=task_id, lang=job.get("lang"))
+        logger.info(f"✓ Job {task_id}: {result.originality}%")
+    except Exception as e:
+        logger.error(f"❌ Job {task_id} failed: {e}", exc_info=True)
+        await _fail(task_id)
+
+
+async def reap_stale_jobs(lost_before: Optional[datetime] = None) -> List[str]:
+    """
+    Задачи, которые воркер взял и не завершил (процесс умер): с очереди они уже сняты,
+    поэтому не повторяются, а помечаются failed - клиент видит итог и может отправить текст снова.
+    lost_before - старт процесса с inprocess-очередью: pending-задачи, созданные раньше, пропали
+    вместе с очередью прежнего процесса и тоже помечаются failed (по истечении того же JOB_STALE_SECONDS)
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    stale = and_(
+        CheckResult.status == "running",
+        # Строки до появления started_at - по времени создания
+        or_(CheckResult.started_at < cutoff, and_(CheckResult.started_at.is_(None), CheckResult.created_at < cutoff)),
+    )
+    if lost_before is not None:
+        # Задачи своей очереди созданы после старта процесса - их не трогаем
+        stale = or_(stale, and_(CheckResult.status == "pending", CheckResult.created_at < min(cutoff, lost_before)))
+
+    def reap(db) -> List[str]:
+        task_ids = list(db.execute(select(CheckResult.task_id).where(stale)).scalars())
+        if task_ids:
+            db.execute(update(CheckResult).where(CheckResult.task_id.in_(task_ids), stale).values(status="failed"))
+        return task_ids
+
+    task_ids = await result_writer.write(reap)
+    for task_id in task_ids:
+        await progress_hub.publish(task_id, {"event": "failed", "task_id": task_id})
+    if task_ids:
+        logger.warning(f"⚠️ Reaped {len(task_ids)} stale jobs (>{settings.JOB_STALE_SECONDS}s): {task_ids[:5]}")
+    return task_ids
+
+
+async def reaper_loop(lost_before: Optional[datetime] = None):
+    while True:
+        try:
+            await reap_stale_jobs(lost_before)
+        except Exception as e:
+            logger.error(f"❌ Stale job reaper failed: {e}")
+        if settings.JOB_REAPER_INTERVAL <= 0:
+            return
+        await asyncio.sleep(settings.JOB_REAPER_INTERVAL)
+
+
+async def worker_loop(queue: JobQueue, name: str):
+    logger.info(f"Worker {name} started ({queue.name})")
+    while True:
+        try:
+            job = await queue.get(timeout=5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Worker {name}: queue error: {e}")
+            await asyncio.sleep(1)
+            continue
+        if job is None:
+            continue
+        # Ошибка вне run_check (запись статуса, битая задача) не должна останавливать воркер
+        try:
+            await process_job(job)
+        except Exception as e:
+            task_id = job.get("task_id") if isinstance(job, dict) else None
+            logger.error(f"❌ Worker {name}: job {task_id} crashed: {e}", exc_info=True)
+            if task_id:
+                try:
+                    await _fail(task_id)
+                except Exception as e:
+                    logger.error(f"❌ Worker {name}: job {task_id} not marked failed: {e}")
+
+
+async def _serve(name: str):
+    queue = get_queue()
+    redis_health.start()
+    await load_indexes()
+    try:
+        await worker_loop(queue, name)
+    finally:
+        await redis_health.stop()
+        await close_indexes()
+        await detector.aclose()
+        await ai_service.aclose()
+        await async_engine.dispose()
+
+
+def _run_process(index: int, metrics_port: int = 0):
+    logging.basicConfig(level=logging.INFO)
+    # Метрики на процесс: у каждого воркера свой порт
+    if metrics_port:
+        start_http_server(metrics_port + index)
+        logger.info(f"📈 Worker w{index} metrics on :{metrics_port + index}")
+    try:
+        asyncio.run(_serve(f"w{index}"))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Antiplagiat check workers")
+    parser.add_argument("--workers", type=int, default=settings.JOB_QUEUE_WORKERS)
+    parser.add_argument("--metrics-port", type=int, default=settings.WORKER_METRICS_PORT,
+                        help="порт метрик первого воркера, следующие - +1; 0 - без метрик")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    backend = settings.JOB_QUEUE_BACKEND.strip().lower()
+    if backend not in ("sqlite", "redis"):
+        raise SystemExit("JOB_QUEUE_BACKEND must be 'sqlite' or 'redis' for standalone workers")
+
+    init_db()
+    # Не daemon: у воркера свой пул процессов для длинных документов (sharding), а daemon-процессам
+    # порождать дочерние нельзя; завершение по-прежнему через join/terminate ниже
+    processes = [
+        multiprocessing.Process(target=_run_process, args=(i, args.metrics_port))
+        for i in range(max(1, args.workers))
+    ]
+    for p in processes:
+        p.start()
+    logger.info(f"🚀 {len(processes)} workers started ({backend})")
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
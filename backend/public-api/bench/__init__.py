@@ -0,0 +1,8 @@
+"""
+Benchmarks - воспроизводимые замеры без внешних сервисов
+- corpus: генератор текстов ru/en/kk заданной длины (с заимствованиями из пула "источников")
+- fakes: локальные заглушки Google Custom Search и OpenRouter (задержка, ошибки, распределение выдачи)
+- micro: сегментация, отпечатки, сходство, кеш, упаковка результатов
+- load: сквозная нагрузка на FastAPI-приложение и прямые замеры detector.analyze()
+- compare: сравнение отчета с базовым, ненулевой код выхода при регрессии
+"""
@@ -0,0 +1,62 @@
+"""
+Compare benchmark reports - регрессия, если задержка выросла больше допуска
+
+    python -m bench.compare baseline.json current.json --metric p95_ms --tolerance 0.2
+
+Код выхода 1 при регрессии - шаг CI перед деплоем.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+
+def compare(baseline: Dict, current: Dict, metric: str, tolerance: float, min_delta_ms: float) -> List[Dict]:
+    """Сравнение по имени бенчмарка; min_delta_ms отсекает шум на микросекундных замерах"""
+    before = {r["name"]: r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        base = before.get(result["name"])
+        if base is None or base.get(metric) is None or result.get(metric) is None:
+            continue
+        old, new = base[metric], result[metric]
+        change = (new - old) / old if old else 0.0
+        rows.append({
+            "name": result["name"],
+            "baseline": old,
+            "current": new,
+            "change": round(change, 4),
+            "regression": change > tolerance and new - old > min_delta_ms,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--metric", default="p95_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост, доля (0.2 = +20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    if baseline.get("suite") != current.get("suite"):
+        print(f"Warning: comparing different suites ({baseline.get('suite')} vs {current.get('suite')})", file=sys.stderr)
+
+    rows = compare(baseline, current, args.metric, args.tolerance, args.min_delta_ms)
+    for row in rows:
+        mark = "REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<48} {row['baseline']:>10.3f} -> {row['current']:>10.3f} ms {row['change']:+.1%} {mark}")
+
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"{len(regressions)} regression(s) in {args.metric} above {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
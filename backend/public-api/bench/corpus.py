@@ -0,0 +1,184 @@
+"""
+Corpus generator - детерминированные тексты ru/en/kk для бенчмарков
+Один и тот же seed дает один и тот же текст на любой машине (random.Random, без hash()).
+Часть предложений можно взять из пула "опубликованных" источников - тогда текст
+находится локальным индексом (CORPUS_DIR) и заглушкой Google.
+"""
+import argparse
+import os
+import random
+import zlib
+from typing import Dict, List
+
+LANGUAGES = ("ru", "en", "kk")
+
+# Длина текста в словах
+SIZES = {
+    "short": 150,
+    "medium": 1000,
+    "long": 5000,
+    # Диссертация: больше SHARD_MIN_CHARS - анализ идет по кускам в пуле процессов
+    "thesis": 90000,
+}
+
+_WORDS = {
+    "ru": (
+        "исследование анализ система данные метод результат процесс развитие работа модель "
+        "структура задача решение подход оценка качество уровень условие значение время "
+        "проект информация основа практика теория область показатель фактор элемент период "
+        "студент преподаватель университет экономика общество государство история культура "
+        "технология производство управление организация стратегия рынок ресурс политика "
+        "является позволяет определяет обеспечивает показывает рассматривает включает требует "
+        "важный основной современный значительный существенный новый общий различный научный "
+        "эффективный социальный экономический эффективно значительно также однако поэтому "
+        "в на по для при из с о между через после без в рамках в течение"
+    ).split(),
+    "en": (
+        "research analysis system data method result process development work model "
+        "structure problem solution approach evaluation quality level condition value time "
+        "project information foundation practice theory area indicator factor element period "
+        "student teacher university economy society state history culture technology "
+        "production management organization strategy market resource policy "
+        "is provides determines ensures shows considers includes requires allows "
+        "important main modern significant substantial new general different scientific "
+        "effective social economic effectively significantly also however therefore "
+        "in on for with from about between through after without within during the a of"
+    ).split(),
+    "kk": (
+        "зерттеу талдау жүйе деректер әдіс нәтиже үдеріс даму жұмыс модель құрылым "
+        "міндет шешім тәсіл бағалау сапа деңгей шарт мән уақыт жоба ақпарат негіз "
+        "тәжірибе теория сала көрсеткіш фактор элемент кезең студент оқытушы университет "
+        "экономика қоғам мемлекет тарих мәдениет технология өндіріс басқару ұйым стратегия "
+        "нарық ресурс саясат болып табылады мүмкіндік береді анықтайды қамтамасыз етеді "
+        "көрсетеді қарастырады қамтиды талап етеді маңызды негізгі заманауи елеулі жаңа "
+        "жалпы әртүрлі ғылыми тиімді әлеуметтік экономикалық тиімді айтарлықтай сондай-ақ "
+        "алайда сондықтан үшін арқылы кейін бойынша арасында ішінде және мен"
+    ).split(),
+}
+
+# Сокращения и числа - чтобы сегментатор проходил по неочевидным точкам
+_INSERTS = {
+    "ru": ["т.е.", "и т.д.", "см. рис. 2", "в 2021 г.", "проф. Иванов", "3.14", "др."],
+    "en": ["e.g.", "i.e.", "Dr. Smith", "Fig. 3", "vs.", "approx. 3.5", "etc."],
+    "kk": ["т.б.", "мыс.", "2021 ж.", "проф. Әбілов", "2.5", "т.с.с."],
+}
+
+_SOURCE_POOL_SIZE = 200
+
+
+def _rng(*parts) -> random.Random:
+    # hash() строк различается между процессами - seed через crc32
+    return random.Random(zlib.crc32("|".join(str(p) for p in parts).encode("utf-8")))
+
+
+def _sentence(rng: random.Random, lang: str) -> str:
+    words = [rng.choice(_WORDS[lang]) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.15:
+        words.insert(rng.randint(1, len(words) - 1), rng.choice(_INSERTS[lang]))
+    sentence = " ".join(words)
+    end = "." if rng.random() < 0.9 else rng.choice(["?", "!", "..."])
+    return sentence[0].upper() + sentence[1:] + end
+
+
+def random_sentence(lang: str, rng: random.Random) -> str:
+    return _sentence(rng, lang)
+
+
+def paraphrase(sentence: str, rng: random.Random, ratio: float = 0.4) -> str:
+    """Заменить долю ratio слов словами того же языка - пара попадает в серую зону сходства"""
+    lang = guess_language(sentence)
+    words = sentence.split()
+    for i in rng.sample(range(len(words)), int(len(words) * ratio)):
+        words[i] = rng.choice(_WORDS[lang])
+    return " ".join(words)
+
+
+def guess_language(text: str) -> str:
+    # Только для текстов этого генератора: специфичные казахские буквы, затем кириллица
+    if any(ch in "әғқңөұүһі" for ch in text.lower()):
+        return "kk"
+    if any("а" <= ch <= "я" for ch in text.lower()):
+        return "ru"
+    return "en"
+
+
+def source_sentences(lang: str, count: int = _SOURCE_POOL_SIZE) -> List[str]:
+    """Пул предложений "опубликованных" источников - одинаковый для всех запусков"""
+    rng = _rng("sources", lang)
+    return [_sentence(rng, lang) for _ in range(count)]
+
+
+def generate_text(lang: str, words: int, seed: int = 0, borrowed: float = 0.0) -> str:
+    """
+    Текст примерно из words слов, абзацы по 3-7 предложений.
+    borrowed - доля предложений из пула источников (0..1).
+    """
+    if lang not in _WORDS:
+        raise ValueError(f"Unsupported language: {lang}")
+    rng = _rng("text", lang, words, seed)
+    pool = source_sentences(lang) if borrowed > 0 else []
+
+    paragraphs, paragraph, total = [], [], 0
+    while total < words:
+        sentence = rng.choice(pool) if pool and rng.random() < borrowed else _sentence(rng, lang)
+        paragraph.append(sentence)
+        total += len(sentence.split())
+        if len(paragraph) >= rng.randint(3, 7):
+            paragraphs.append(" ".join(paragraph))
+            paragraph = []
+    if paragraph:
+        paragraphs.append(" ".join(paragraph))
+    return "\n\n".join(paragraphs)
+
+
+def build_corpus(langs=LANGUAGES, sizes=("short", "medium"), per_size: int = 5, borrowed: float = 0.2, seed: int = 0) -> List[Dict]:
+    """[{name, lang, size, text}] - набор документов для прогона"""
+    documents = []
+    for lang in langs:
+        for size in sizes:
+            for i in range(per_size):
+                documents.append({
+                    "name": f"{lang}-{size}-{i}",
+                    "lang": lang,
+                    "size": size,
+                    "text": generate_text(lang, SIZES[size], seed=seed * 100003 + i, borrowed=borrowed),
+                })
+    return documents
+
+
+def write_sources(path: str, langs=LANGUAGES, per_document: int = 20) -> int:
+    """Пул источников в *.txt - каталог для CORPUS_DIR; возвращает число файлов"""
+    os.makedirs(path, exist_ok=True)
+    written = 0
+    for lang in langs:
+        pool = source_sentences(lang)
+        for i in range(0, len(pool), per_document):
+            with open(os.path.join(path, f"source-{lang}-{i // per_document:03d}.txt"), "w", encoding="utf-8") as f:
+                f.write(" ".join(pool[i:i + per_document]))
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a benchmark corpus")
+    parser.add_argument("--out", required=True, help="каталог для текстов")
+    parser.add_argument("--sources", help="каталог для пула источников (CORPUS_DIR)")
+    parser.add_argument("--langs", default=",".join(LANGUAGES))
+    parser.add_argument("--sizes", default="short,medium")
+    parser.add_argument("--per-size", type=int, default=5)
+    parser.add_argument("--borrowed", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    documents = build_corpus(args.langs.split(","), args.sizes.split(","), args.per_size, args.borrowed, args.seed)
+    for doc in documents:
+        with open(os.path.join(args.out, f"{doc['name']}.txt"), "w", encoding="utf-8") as f:
+            f.write(doc["text"])
+    print(f"{len(documents)} documents -> {args.out}")
+    if args.sources:
+        print(f"{write_sources(args.sources, args.langs.split(','))} source files -> {args.sources}")
+
+
+if __name__ == "__main__":
+    main()
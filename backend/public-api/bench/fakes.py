@@ -0,0 +1,320 @@
+"""
+Fake external services - локальные заглушки Google Custom Search и OpenRouter
+Задержка (логнормальная: медиана + разброс), доля ошибок (429/5xx) и распределение выдачи
+задаются параметрами. Выдача зависит только от запроса и seed - одинаковый запрос
+всегда получает одинаковые результаты, как у настоящего поиска.
+
+Отдельно:   python -m bench.fakes --google-port 8101 --ai-port 8102
+В процессе: with FakeServices(...) as fakes: fakes.env() -> переменные окружения для приложения
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+import threading
+import zlib
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from bench.corpus import guess_language, paraphrase, random_sentence
+
+logger = logging.getLogger(__name__)
+
+ERROR_STATUSES = (429, 500, 503)
+
+_DOMAINS = [f"source{i}.example.{tld}" for i in range(12) for tld in ("com", "ru", "kz")]
+_PAIR_RE = re.compile(r"^Пара (\d+):", re.MULTILINE)
+
+
+class FakeConfig:
+    """
+    latency_ms - медиана задержки, jitter - sigma логнормального распределения (0 - без разброса),
+    error_rate - доля ответов 429/500/503
+    """
+
+    def __init__(self, latency_ms: float = 100.0, jitter: float = 0.3, error_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+
+class FakeGoogleConfig(FakeConfig):
+    """
+    results - сколько результатов на запрос (min-max), empty_rate - доля запросов без выдачи,
+    mix - веса типов результата: exact (сниппет = запрос), partial (парафраз, серая зона),
+    unrelated (чужое предложение)
+    """
+
+    def __init__(self, results: str = "1-5", empty_rate: float = 0.3, mix: str = "exact=0.3,partial=0.3,unrelated=0.4", **kwargs):
+        super().__init__(**kwargs)
+        low, _, high = results.partition("-")
+        self.results = (int(low), int(high or low))
+        self.empty_rate = empty_rate
+        self.mix = {k.strip(): float(v) for k, v in (item.split("=") for item in mix.split(",") if item.strip())}
+
+    def to_dict(self) -> Dict:
+        data = super().to_dict()
+        data["results"] = f"{self.results[0]}-{self.results[1]}"
+        return data
+
+
+class FakeAIConfig(FakeConfig):
+    """paraphrase_rate - доля пар, признанных парафразом"""
+
+    def __init__(self, paraphrase_rate: float = 0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.paraphrase_rate = paraphrase_rate
+
+
+def _rng(*parts) -> random.Random:
+    return random.Random(zlib.crc32("|".join(str(p) for p in parts).encode("utf-8")))
+
+
+class _FakeService:
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def _delay(self):
+        cfg = self.config
+        if cfg.latency_ms <= 0:
+            return
+        delay = cfg.latency_ms * (math.exp(self._rng.gauss(0, cfg.jitter)) if cfg.jitter else 1.0)
+        await asyncio.sleep(delay / 1000)
+
+    def _error(self) -> Optional[int]:
+        if self._rng.random() < self.config.error_rate:
+            self.errors += 1
+            return self._rng.choice(ERROR_STATUSES)
+        return None
+
+    def stats(self) -> Dict:
+        return {"requests": self.requests, "errors": self.errors}
+
+
+class FakeGoogle(_FakeService):
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/customsearch/v1", self.search)
+        return app
+
+    def _items(self, query: str, num: int):
+        cfg = self.config
+        rng = _rng("google", cfg.seed, query)
+        if rng.random() < cfg.empty_rate:
+            return []
+        kinds, weights = zip(*cfg.mix.items())
+        lang = guess_language(query)
+        items = []
+        for i in range(min(num, rng.randint(*cfg.results))):
+            kind = rng.choices(kinds, weights)[0]
+            if kind == "exact":
+                snippet = query
+            elif kind == "partial":
+                snippet = paraphrase(query, rng)
+            else:
+                snippet = random_sentence(lang, rng)
+            domain = rng.choice(_DOMAINS)
+            page = zlib.crc32(f"{query}|{i}".encode("utf-8"))
+            items.append({
+                "title": f"{kind.capitalize()} source {page % 10000}",
+                "link": f"https://{domain}/{kind}/{page}",
+                "displayLink": domain,
+                "snippet": snippet,
+            })
+        return items
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await self._delay()
+        status = self._error()
+        if status is not None:
+            return web.json_response({"error": {"code": status, "message": "fake error"}}, status=status)
+        query = request.query.get("q", "")
+        items = self._items(query, int(request.query.get("num", 10)))
+        return web.json_response({"items": items} if items else {"searchInformation": {"totalResults": "0"}})
+
+
+class FakeOpenRouter(_FakeService):
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", self.complete)
+        return app
+
+    def _verdict(self, rng: random.Random, i: int = None) -> Dict:
+        is_paraphrase = rng.random() < self.config.paraphrase_rate
+        verdict = {
+            "is_paraphrase": is_paraphrase,
+            "similarity": round(rng.uniform(0.7, 0.95) if is_paraphrase else rng.uniform(0.1, 0.4), 2),
+            "explanation": "fake verdict",
+        }
+        return verdict if i is None else {"id": i, **verdict}
+
+    async def complete(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        payload = await request.json()
+        await self._delay()
+        status = self._error()
+        if status is not None:
+            return web.json_response({"error": {"code": status, "message": "fake error"}}, status=status)
+
+        prompt = payload["messages"][0]["content"]
+        rng = _rng("ai", self.config.seed, prompt)
+        pairs = [int(n) for n in _PAIR_RE.findall(prompt)]
+        if pairs:
+            content = {"results": [self._verdict(rng, i) for i in pairs]}
+        elif "ключевых идей" in prompt:
+            content = {"key_ideas": [f"Идея {i}" for i in range(1, 6)]}
+        else:
+            content = self._verdict(rng)
+        return web.json_response({
+            "choices": [{"message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)}}]
+        })
+
+
+class FakeServices:
+    """
+    Обе заглушки в отдельном потоке со своим event loop - их задержки
+    не занимают loop измеряемого приложения. port=0 - свободный порт.
+    """
+
+    def __init__(self, google: FakeGoogleConfig = None, ai: FakeAIConfig = None, host: str = "127.0.0.1", google_port: int = 0, ai_port: int = 0):
+        self.google = FakeGoogle(google or FakeGoogleConfig())
+        self.ai = FakeOpenRouter(ai or FakeAIConfig())
+        self.host = host
+        self._ports = {"google": google_port, "ai": ai_port}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._runners = []
+
+    @property
+    def google_url(self) -> str:
+        return f"http://{self.host}:{self._ports['google']}/customsearch/v1"
+
+    @property
+    def ai_url(self) -> str:
+        return f"http://{self.host}:{self._ports['ai']}/api/v1/chat/completions"
+
+    def env(self) -> Dict[str, str]:
+        """Настройки приложения, направляющие внешние вызовы в заглушки"""
+        return {
+            "GOOGLE_SEARCH_URL": self.google_url,
+            "GOOGLE_SEARCH_API_KEY": "bench",
+            "GOOGLE_SEARCH_CX": "bench",
+            "AI_BASE_URL": self.ai_url,
+            "OPENROUTER_API_KEY": "bench",
+        }
+
+    async def _start_site(self, name: str, app: web.Application):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self._ports[name])
+        await site.start()
+        self._runners.append(runner)
+        self._ports[name] = runner.addresses[0][1]
+
+    async def start_async(self):
+        await self._start_site("google", self.google.app())
+        await self._start_site("ai", self.ai.app())
+
+    async def stop_async(self):
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners = []
+
+    def start(self) -> "FakeServices":
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="bench-fakes", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start_async(), self._loop).result()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop_async(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> "FakeServices":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict:
+        return {"google": self.google.stats(), "ai": self.ai.stats()}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Параметры заглушек - общие для bench.fakes и bench.load"""
+    group = parser.add_argument_group("fake services")
+    group.add_argument("--google-latency", type=float, default=120.0, help="медиана задержки Google, мс")
+    group.add_argument("--google-jitter", type=float, default=0.3)
+    group.add_argument("--google-errors", type=float, default=0.0, help="доля ответов 429/5xx")
+    group.add_argument("--google-results", default="1-5", help="результатов на запрос, min-max")
+    group.add_argument("--google-empty", type=float, default=0.3, help="доля запросов без выдачи")
+    group.add_argument("--google-mix", default="exact=0.3,partial=0.3,unrelated=0.4")
+    group.add_argument("--ai-latency", type=float, default=800.0, help="медиана задержки OpenRouter, мс")
+    group.add_argument("--ai-jitter", type=float, default=0.4)
+    group.add_argument("--ai-errors", type=float, default=0.0)
+    group.add_argument("--ai-paraphrase", type=float, default=0.5, help="доля пар-парафразов")
+    group.add_argument("--seed", type=int, default=0)
+
+
+def configs_from_args(args):
+    google = FakeGoogleConfig(
+        latency_ms=args.google_latency, jitter=args.google_jitter, error_rate=args.google_errors,
+        results=args.google_results, empty_rate=args.google_empty, mix=args.google_mix, seed=args.seed
+    )
+    ai = FakeAIConfig(
+        latency_ms=args.ai_latency, jitter=args.ai_jitter, error_rate=args.ai_errors,
+        paraphrase_rate=args.ai_paraphrase, seed=args.seed
+    )
+    return google, ai
+
+
+async def _serve(fakes: FakeServices):
+    await fakes.start_async()
+    for key, value in fakes.env().items():
+        print(f"{key}={value}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fakes.stop_async()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Google Custom Search and OpenRouter servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--google-port", type=int, default=8101)
+    parser.add_argument("--ai-port", type=int, default=8102)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    google, ai = configs_from_args(args)
+    fakes = FakeServices(google, ai, args.host, args.google_port, args.ai_port)
+    try:
+        asyncio.run(_serve(fakes))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
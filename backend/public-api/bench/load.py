@@ -0,0 +1,190 @@
+"""
+Load benchmarks - сквозные проверки против локальных заглушек Google/OpenRouter
+
+    python -m bench.load analyze --concurrency 8 --requests 60 --out analyze.json
+    python -m bench.load http --concurrency 16 --requests 200 --mode deep --out http.json
+    python -m bench.load http --url http://localhost:8001 --requests 200   # уже запущенный сервер
+
+analyze - detector.analyze() напрямую (без HTTP и БД), http - POST /api/v1/check
+через ASGI в том же процессе (или по --url). Для очереди (JOB_QUEUE_BACKEND) задержка
+считается до статуса completed. Приложение импортируется только после того, как
+окружение направлено в заглушки, временную SQLite и каталог источников.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bench.corpus import LANGUAGES, SIZES, generate_text, write_sources
+from bench.fakes import FakeServices, add_arguments, configs_from_args
+from bench.report import build_report, print_table, summarize, write_report
+
+POLL_INTERVAL = 0.05
+
+
+def _workload(langs: List[str], sizes: List[str], requests: int, borrowed: float, seed: int) -> List[Dict]:
+    # Каждый запрос - новый текст: иначе весь прогон уйдет в кеш результатов
+    docs = []
+    for i in range(requests):
+        lang, size = langs[i % len(langs)], sizes[(i // len(langs)) % len(sizes)]
+        docs.append({"lang": lang, "size": size, "text": generate_text(lang, SIZES[size], seed=seed * 100003 + i, borrowed=borrowed)})
+    return docs
+
+
+async def _drive(docs: List[Dict], concurrency: int, send: Callable[[Dict], Awaitable[None]]) -> Dict:
+    """concurrency исполнителей разбирают общий список; у каждого документа - своя длительность или ошибка"""
+    queue = list(reversed(docs))
+
+    async def worker():
+        while queue:
+            doc = queue.pop()
+            started = time.perf_counter()
+            try:
+                await send(doc)
+            except Exception as e:
+                doc["error"] = f"{type(e).__name__}: {e}"
+            doc["duration"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return {"elapsed": time.perf_counter() - started, "docs": docs}
+
+
+def _summaries(prefix: str, run: Dict, extra: Dict) -> List[Dict]:
+    docs, elapsed = run["docs"], run["elapsed"]
+    ok = [d for d in docs if "error" not in d]
+    errors = sorted({d["error"] for d in docs if "error" in d})
+    results = [summarize(prefix, [d["duration"] for d in ok], elapsed, errors=len(docs) - len(ok), error_samples=errors[:5], **extra)]
+    # Разбивка по языку и длине - общий p99 не покажет, что просел только один язык
+    for key in sorted({(d["lang"], d["size"]) for d in ok}):
+        group = [d["duration"] for d in ok if (d["lang"], d["size"]) == key]
+        results.append(summarize(f"{prefix}[{key[0]},{key[1]}]", group, elapsed))
+    return results
+
+
+async def bench_analyze(docs: List[Dict], concurrency: int, mode: str, warmup: List[Dict]) -> Dict:
+    from app.services.ai import ai_service
+    from app.services.detector import detector
+
+    async def send(doc):
+        await detector.analyze(doc["text"], mode)
+
+    try:
+        await _drive(warmup, 1, send)
+        return await _drive(docs, concurrency, send)
+    finally:
+        await detector.aclose()
+        await ai_service.aclose()
+
+
+async def bench_http(docs: List[Dict], concurrency: int, mode: str, warmup: List[Dict], url: Optional[str], timeout: float) -> Dict:
+    import httpx
+
+    async def run(client: httpx.AsyncClient):
+        async def send(doc):
+            response = await client.post("/api/v1/check", json={"text": doc["text"], "mode": mode})
+            response.raise_for_status()
+            data = response.json()
+            # Режим очереди: ждем, пока воркер закончит проверку
+            while data["status"] not in ("completed", "failed"):
+                await asyncio.sleep(POLL_INTERVAL)
+                response = await client.get(f"/api/v1/check/{data['task_id']}", params={"include_matches": "false"})
+                response.raise_for_status()
+                data = response.json()
+            if data["status"] == "failed":
+                raise RuntimeError("check failed")
+
+        await _drive(warmup, 1, send)
+        return await _drive(docs, concurrency, send)
+
+    limits = httpx.Limits(max_connections=concurrency * 2)
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+            return await run(client)
+
+    from app.main import app
+    # ASGITransport не запускает lifespan - startup/shutdown приложения вызываем сами
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout, limits=limits) as client:
+            return await run(client)
+
+
+def _prepare_environment(fakes: FakeServices, workdir: str, args):
+    """До импорта app: settings читаются один раз при первом импорте"""
+    os.environ.update(fakes.env())
+    # Лимиты клиента и квоты внешних API мерили бы не код, а настройки; заданные явно - остаются
+    for name in ("RATE_LIMIT_PER_MINUTE", "RATE_LIMIT_PER_DAY", "GOOGLE_RATE_PER_MINUTE", "GOOGLE_DAILY_QUOTA",
+                 "OPENROUTER_RATE_PER_MINUTE", "OPENROUTER_DAILY_QUOTA"):
+        os.environ.setdefault(name, "0")
+    if not args.keep_database:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.environ["JOB_QUEUE_SQLITE_PATH"] = os.path.join(workdir, "jobs.db")
+    if args.borrowed > 0 and "CORPUS_DIR" not in os.environ:
+        sources = os.path.join(workdir, "sources")
+        write_sources(sources, args.langs.split(","))
+        os.environ["CORPUS_DIR"] = sources
+
+
+async def _run(args, fakes: Optional[FakeServices]) -> List[Dict]:
+    langs, sizes = args.langs.split(","), args.sizes.split(",")
+    docs = _workload(langs, sizes, args.requests, args.borrowed, args.seed)
+    # Прогрев - отдельные тексты (seed со сдвигом), в отчет не попадает
+    warmup = _workload(langs, sizes, args.warmup, args.borrowed, args.seed + 1)
+
+    if args.suite == "analyze":
+        if args.borrowed > 0:
+            from app.services.fingerprint import fingerprint_index
+            fingerprint_index.load_corpus_dir(os.environ["CORPUS_DIR"])
+        run = await bench_analyze(docs, args.concurrency, args.mode, warmup)
+    else:
+        run = await bench_http(docs, args.concurrency, args.mode, warmup, args.url, args.timeout)
+
+    extra = {"concurrency": args.concurrency, "mode": args.mode}
+    if fakes is not None:
+        extra["fakes"] = fakes.stats()
+    return _summaries(f"{args.suite}[{args.mode}]", run, extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmarks with fake external services")
+    parser.add_argument("suite", choices=["analyze", "http"])
+    parser.add_argument("--mode", choices=["fast", "deep"], default="deep")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--langs", default=",".join(LANGUAGES))
+    parser.add_argument("--sizes", default="short,medium")
+    parser.add_argument("--borrowed", type=float, default=0.2, help="доля предложений из пула источников")
+    parser.add_argument("--url", help="внешний сервер вместо ASGI в процессе (заглушки настраиваются на нем)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--keep-database", action="store_true", help="не подменять DATABASE_URL временной SQLite")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--out", help="JSON-отчет (по умолчанию - stdout)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    google, ai = configs_from_args(args)
+    config = {
+        k: v for k, v in vars(args).items() if k not in ("out", "log_level")
+    }
+    config.update(google=google.to_dict(), ai=ai.to_dict())
+
+    with tempfile.TemporaryDirectory(prefix="antiplagiat-bench-") as workdir:
+        if args.url:
+            results = asyncio.run(_run(args, None))
+        else:
+            with FakeServices(google, ai) as fakes:
+                _prepare_environment(fakes, workdir, args)
+                results = asyncio.run(_run(args, fakes))
+
+    print_table(results)
+    write_report(build_report(f"load.{args.suite}", results, config), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Micro-benchmarks - горячие функции анализа без сети и БД
+
+    python -m bench.micro --out micro.json
+    python -m bench.micro --filter fingerprint --sizes long
+"""
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+from typing import Callable, Dict, List, Tuple
+
+from bench.corpus import LANGUAGES, SIZES, generate_text, paraphrase, source_sentences
+from bench.report import build_report, print_table, summarize, timed, write_report
+
+
+def _cases(langs: List[str], sizes: List[str], seed: int) -> List[Tuple[str, str, str]]:
+    return [(lang, size, generate_text(lang, SIZES[size], seed=seed, borrowed=0.2)) for lang in langs for size in sizes]
+
+
+def _text_benchmarks(cases, index, disk_index) -> List[Tuple[str, Callable]]:
+    from app.core.cache import normalize_text
+    from app.core.config import settings
+    from app.services.fingerprint import fingerprints
+    from app.services.language import detect_language
+    from app.services.minhash import minhash_signature
+    from app.services.segmenter import split_sentences
+    from app.services.storage import pack_matches, pack_text, unpack_matches
+
+    benchmarks = []
+    for lang, size, text in cases:
+        tag = f"[{lang},{size}]"
+        found = index.search(text)["matches"]
+        packed = pack_matches(found)
+        benchmarks += [
+            (f"language.detect{tag}", lambda t=text: detect_language(t)),
+            (f"segmenter.split_sentences{tag}", lambda t=text, l=lang: split_sentences(t, min_length=40, lang=l)),
+            (f"cache.normalize_text{tag}", lambda t=text: normalize_text(t)),
+            (f"fingerprint.fingerprints{tag}", lambda t=text: fingerprints(t, settings.SHINGLE_SIZE, settings.WINNOW_WINDOW)),
+            (f"fingerprint.search{tag}", lambda t=text: index.search(t)),
+            (f"fingerprint.search_segments{tag}", lambda t=text: disk_index.search(t)),
+            (f"minhash.signature{tag}", lambda t=text: minhash_signature(t)),
+            (f"storage.pack{tag}", lambda t=text, m=found: (pack_text(t), pack_matches(m))),
+            (f"storage.unpack_matches{tag}", lambda t=text, p=packed: unpack_matches(p, t)),
+        ]
+    return benchmarks
+
+
+def _segmenter_benchmarks(lines: int = 200) -> List[Tuple[str, Callable]]:
+    from app.services.segmenter import split_sentences
+
+    # Оглавление диссертации: отточия до номера страницы; регрессия в регулярном выражении
+    # границ (перебор разбиений серии точек) здесь дает секунды вместо миллисекунд
+    toc = "\n".join(f"Глава {i} Введение в предмет {'.' * (40 + i % 40)} {i + 3}" for i in range(lines))
+    leader = "Введение " + "." * 5000 + "3 Глава 1"
+    return [
+        (f"segmenter.dot_leaders[{lines} lines]", lambda: split_sentences(toc, min_length=40, lang="ru")),
+        ("segmenter.dot_leaders[5000 dots]", lambda: split_sentences(leader, lang="ru")),
+    ]
+
+
+def _triage_benchmarks(langs: List[str], seed: int, pairs: int = 50) -> List[Tuple[str, Callable]]:
+    from app.services.similarity import triage
+
+    benchmarks = []
+    for lang in langs:
+        rng = random.Random(seed)
+        sentences = source_sentences(lang)[:pairs]
+        # Как после поиска: часть сниппетов совпадает, часть - парафраз, часть - чужие
+        batch = [(s, s if i % 3 == 0 else paraphrase(s, rng) if i % 3 == 1 else sentences[-1 - i]) for i, s in enumerate(sentences)]
+        benchmarks.append((f"similarity.triage[{lang},{pairs} pairs]", lambda b=batch: triage(b)))
+    return benchmarks
+
+
+def _cache_benchmarks(ops: int = 1000) -> List[Tuple[str, Callable]]:
+    from app.core.cache import LRUCache, TwoTierCache, get_cache_key
+
+    keys = [get_cache_key("bench", f"query {i}") for i in range(ops)]
+    lru = LRUCache(max_items=ops * 2, max_bytes=64 * 1024 * 1024, ttl=3600)
+    for key in keys:
+        lru.set(key, {"items": [key]}, 200)
+    small = LRUCache(max_items=ops // 2, max_bytes=64 * 1024 * 1024, ttl=3600)
+
+    # Redis в бенчмарке не используется - замеряется только локальный уровень
+    tiered = TwoTierCache("bench", 3600, lru)
+    loop = asyncio.new_event_loop()
+
+    def set_evicting():
+        for key in keys:
+            small.set(key, key, 200)
+
+    return [
+        (f"cache.key[x{ops}]", lambda: [get_cache_key("bench", f"query {i}") for i in range(ops)]),
+        (f"cache.lru.get_hit[x{ops}]", lambda: [lru.get(key) for key in keys]),
+        (f"cache.lru.set_evicting[x{ops}]", set_evicting),
+        (f"cache.two_tier.get_many_local[x{ops}]", lambda: loop.run_until_complete(tiered.get_many(keys))),
+    ]
+
+
+def run(langs: List[str], sizes: List[str], repeat: int, name_filter: str = "", seed: int = 0) -> List[Dict]:
+    from app.services.fingerprint import FingerprintIndex, stable_id
+    from app.services.fingerprint_store import SegmentBuilder, SegmentStore
+
+    # Отдельный индекс с пулом источников - тексты корпуса частично в нем находятся;
+    # тот же пул - в сегменте на диске (поиск через mmap, без документов в памяти)
+    index, builder = FingerprintIndex(), SegmentBuilder()
+    for lang in langs:
+        for i, sentence in enumerate(source_sentences(lang)):
+            index.add_document(f"{lang}:{i}", sentence)
+            builder.add_document(stable_id(f"{lang}:{i}"), sentence, title=f"{lang}:{i}")
+
+    with tempfile.TemporaryDirectory(prefix="antiplagiat-micro-") as workdir:
+        disk_index = FingerprintIndex()
+        disk_index.store = SegmentStore(workdir)
+        disk_index.store.append(builder)
+
+        benchmarks = (
+            _text_benchmarks(_cases(langs, sizes, seed), index, disk_index) + _segmenter_benchmarks()
+            + _triage_benchmarks(langs, seed) + _cache_benchmarks()
+        )
+        results = []
+        for name, fn in benchmarks:
+            if name_filter and name_filter not in name:
+                continue
+            results.append(summarize(name, timed(fn, repeat)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the analysis hot path")
+    parser.add_argument("--langs", default=",".join(LANGUAGES))
+    parser.add_argument("--sizes", default="short,medium,long")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--filter", default="", help="только бенчмарки, содержащие подстроку")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON-отчет (по умолчанию - stdout)")
+    args = parser.parse_args()
+
+    # Логи сервисов на каждый вызов исказят замеры
+    logging.basicConfig(level=logging.WARNING)
+    langs, sizes = args.langs.split(","), args.sizes.split(",")
+    results = run(langs, sizes, args.repeat, args.filter, args.seed)
+    print_table(results)
+    write_report(build_report("micro", results, {
+        "langs": langs, "sizes": sizes, "repeat": args.repeat, "seed": args.seed
+    }), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark report - задержки p50/p95/p99 и пропускная способность в JSON
+"""
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def summarize(name: str, samples: List[float], elapsed: Optional[float] = None, **extra) -> Dict:
+    """
+    samples - длительности операций в секундах; elapsed - время всего прогона
+    (при параллельной нагрузке пропускная способность считается по нему, а не по сумме)
+    """
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    count = len(values)
+    total = elapsed if elapsed is not None else float(values.sum()) / 1000
+    result = {
+        "name": name,
+        "count": count,
+        "p50_ms": round(float(np.percentile(values, 50)), 4) if count else None,
+        "p95_ms": round(float(np.percentile(values, 95)), 4) if count else None,
+        "p99_ms": round(float(np.percentile(values, 99)), 4) if count else None,
+        "mean_ms": round(float(values.mean()), 4) if count else None,
+        "max_ms": round(float(values.max()), 4) if count else None,
+        "throughput_per_s": round(count / total, 2) if total > 0 else None,
+    }
+    result.update(extra)
+    return result
+
+
+def timed(fn, repeat: int, warmup: int = 3) -> List[float]:
+    """Длительность каждого из repeat вызовов fn() после прогрева"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def build_report(suite: str, results: List[Dict], config: Dict) -> Dict:
+    return {
+        "format": FORMAT_VERSION,
+        "suite": suite,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+
+
+def write_report(report: Dict, path: Optional[str]):
+    """В файл или, если path не задан/"-", в stdout"""
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    if not path or path == "-":
+        print(data)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(data + "\n")
+
+
+def print_table(results: List[Dict], stream=sys.stderr):
+    """Короткая сводка для человека; машиночитаемый отчет - write_report"""
+    for r in results:
+        if not r["count"]:
+            print(f"{r['name']:<48} no samples", file=stream)
+            continue
+        print(
+            f"{r['name']:<48} n={r['count']:<6} p50={r['p50_ms']:.3f}ms p95={r['p95_ms']:.3f}ms "
+            f"p99={r['p99_ms']:.3f}ms {r['throughput_per_s']}/s",
+            file=stream
+        )
@@ -0,0 +1,126 @@
+"""
+Startup benchmark - холодный старт в новом процессе: импорт приложения, startup (lifespan до
+приема запросов) и готовность (/ready: индексы загружены, прогрев выполнен)
+
+    python -m bench.startup --runs 5 --out startup.json
+    python -m bench.startup --corpus --warmup          # с каталогом источников и прогревом
+
+Код выхода 1, если медиана startup больше --budget-ms (по умолчанию STARTUP_BUDGET_MS) -
+так бюджет проверяется в CI. Время считается от первой строки кода дочернего процесса,
+без запуска самого интерпретатора (он есть в process_ms).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.corpus import write_sources
+from bench.report import build_report, print_table, summarize, write_report
+
+READY_TIMEOUT = 60.0
+READY_POLL = 0.005
+
+
+async def _measure(started: float) -> Dict:
+    from app.main import app
+    from app.core.readiness import readiness
+    imported = time.perf_counter()
+
+    # Без HTTP-сервера: lifespan - то, что uvicorn выполняет до приема соединений
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter()
+        deadline = startup + READY_TIMEOUT
+        while not readiness.ready and readiness.report()["status"] != "failed" and time.perf_counter() < deadline:
+            await asyncio.sleep(READY_POLL)
+        ready = time.perf_counter()
+        report = readiness.report()
+    return {
+        "import": imported - started,
+        "startup": startup - started,
+        "ready": ready - started,
+        "status": report["status"],
+        "components": report["components"],
+    }
+
+
+def _child():
+    started = time.perf_counter()
+    result = asyncio.run(_measure(started))
+    print(json.dumps(result))
+
+
+def _run_once(env: Dict[str, str]) -> Dict:
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-m", "bench.startup", "--child"],
+        env=env, capture_output=True, text=True, timeout=READY_TIMEOUT * 2
+    )
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"startup child failed: {completed.stderr.strip()[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process"] = elapsed
+    return result
+
+
+def _environment(workdir: str, args) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["JOB_QUEUE_SQLITE_PATH"] = os.path.join(workdir, "jobs.db")
+    env["STARTUP_WARMUP"] = "true" if args.warmup else "false"
+    if args.corpus:
+        sources = os.path.join(workdir, "sources")
+        write_sources(sources)
+        env["CORPUS_DIR"] = sources
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--corpus", action="store_true", help="каталог источников в CORPUS_DIR")
+    parser.add_argument("--warmup", action="store_true", help="STARTUP_WARMUP=true")
+    parser.add_argument("--budget-ms", type=float, help="бюджет startup (медиана); по умолчанию STARTUP_BUDGET_MS")
+    parser.add_argument("--out", help="JSON-отчет (по умолчанию - stdout)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child()
+        return
+
+    if args.budget_ms is None:
+        from app.core.config import settings
+        args.budget_ms = settings.STARTUP_BUDGET_MS
+
+    with tempfile.TemporaryDirectory(prefix="antiplagiat-startup-") as workdir:
+        env = _environment(workdir, args)
+        # Каждый прогон - новая БД: иначе после первого таблицы уже созданы
+        runs: List[Dict] = []
+        for i in range(max(1, args.runs)):
+            env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, f'startup-{i}.db')}"
+            runs.append(_run_once(env))
+
+    results = [summarize(f"startup.{name}", [r[name] for r in runs]) for name in ("import", "startup", "ready", "process")]
+    failed = [r["components"] for r in runs if r["status"] != "ready"]
+    startup_p50 = results[1]["p50_ms"]
+    within = startup_p50 <= args.budget_ms and not failed
+    results[1].update(budget_ms=args.budget_ms, within_budget=within)
+
+    print_table(results)
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "child")}
+    config["components"] = runs[-1]["components"]
+    write_report(build_report("startup", results, config), args.out)
+    if failed:
+        print(f"not ready: {failed[0]}", file=sys.stderr)
+    if not within:
+        print(f"startup p50 {startup_p50:.0f} ms exceeds budget {args.budget_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()